@@ -0,0 +1,115 @@
+'''
+Compares Sleepy's handlers over a db model and the equivalent ndb model.
+
+The same REST calls are made against two resources, /dbtodos (a db.Model) and /ndbtodos (the app's
+ndb ToDo), and for each handler this prints the mean time per call and the number of datastore and memcache
+RPCs it made.
+
+The SDK stubs answer each RPC synchronously, so overlapping RPCs don't save time here the way they do
+in production. The times mostly show the cost of each API; the RPC counts, and which of them ndb
+issues together (see sleepybackend), show where the latency win comes from.
+
+usage: python benchmarks/backend_bench.py [rows] [iterations]
+'''
+import json
+import sys
+
+import benchutil
+benchutil.FixSysPath()
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import db
+from google.appengine.ext import ndb
+import webapp2
+
+from datamodel import ToDo
+from restapi import Sleepy, ToDoRestHandler
+
+class DbToDo(db.Model):
+    text = db.StringProperty()
+    order = db.IntegerProperty()
+    rank = db.StringProperty()
+    done = db.BooleanProperty(default = False)
+    created = db.DateTimeProperty(auto_now_add = True)
+    modified = db.DateTimeProperty(auto_now = True)
+    # ToDoRestHandler is searchable, see GetSearchIndex
+    search_terms = db.StringListProperty()
+
+class BenchRestHandler(ToDoRestHandler):
+    def GetCacheTtl(self):
+        # caching would hide the datastore, which is what we want to measure
+        return None
+
+class DbToDoRestHandler(BenchRestHandler):
+    def GetModelClass(self):
+        return DbToDo
+
+    def GetOwnerKey(self, *args, **kwargs):
+        # db models need db parents
+        return db.Key.from_path("ToDoOwner", "anonymous")
+
+class NdbToDoRestHandler(BenchRestHandler):
+    def GetModelClass(self):
+        return ToDo
+
+_rpcCounts = {}
+
+def CountRpc(service, call, request, response):
+    _rpcCounts[service] = _rpcCounts.get(service, 0) + 1
+
+def Call(aApp, aMethod, aPath, aJsonable = None):
+    # don't let ndb's in-context cache carry over between calls, as it wouldn't between requests
+    ndb.get_context().clear_cache()
+    lrequest = webapp2.Request.blank(aPath)
+    lrequest.method = aMethod
+    if aJsonable is not None:
+        lrequest.body = json.dumps(aJsonable)
+    lresponse = lrequest.get_response(aApp)
+    if lresponse.status_int >= 400:
+        raise Exception("%s %s: %s" % (aMethod, aPath, lresponse.body))
+    return lresponse
+
+def main():
+    lrows = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    literations = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    ltestbed = benchutil.ActivateTestbed()
+    try:
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append("backend_bench", CountRpc)
+
+        lapp = webapp2.WSGIApplication(Sleepy.FixRoutes([
+            ("dbtodos", DbToDoRestHandler),
+            ("ndbtodos", NdbToDoRestHandler)
+        ]))
+
+        print "%s rows, %s iterations" % (lrows, literations)
+        print "%-10s %-12s %10s %12s %10s" % ("resource", "handler", "ms/call", "datastore", "memcache")
+
+        for lresource in ["dbtodos", "ndbtodos"]:
+            lids = []
+            for lindex in xrange(lrows):
+                lresponse = Call(lapp, "POST", "/%s" % lresource, {"text": "todo %s" % lindex, "order": lindex})
+                lids.append(json.loads(lresponse.body)["id"])
+
+            lbatch = {"read": lids[:10], "ops": [{"method": "update", "id": lid, "data": {"done": True}} for lid in lids[10:20]]}
+
+            lcalls = [
+                ("get list", lambda: Call(lapp, "GET", "/%s" % lresource)),
+                ("get page", lambda: Call(lapp, "GET", "/%s?limit=50" % lresource)),
+                ("get item", lambda: Call(lapp, "GET", "/%s/%s" % (lresource, lids[0]))),
+                ("put", lambda: Call(lapp, "PUT", "/%s/%s" % (lresource, lids[1]), {"done": True})),
+                ("post", lambda: Call(lapp, "POST", "/%s" % lresource, {"text": "new"})),
+                ("batch", lambda: Call(lapp, "POST", "/%s/_batch" % lresource, lbatch))
+            ]
+
+            for lname, lfunc in lcalls:
+                _rpcCounts.clear()
+                lseconds = benchutil.TimePerCall(lfunc, literations)
+                print "%-10s %-12s %10.2f %12.1f %10.1f" % (lresource, lname, lseconds * 1000.0,
+                        _rpcCounts.get("datastore_v3", 0) / float(literations),
+                        _rpcCounts.get("memcache", 0) / float(literations))
+    finally:
+        ltestbed.deactivate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+'''
+Shared setup for the benchmarks in this directory.
+
+The benchmarks run in-process against the App Engine SDK's testbed stubs, so they need the
+python 2.7 SDK. Point APPENGINE_SDK at it if it isn't in /usr/local/google_appengine.
+'''
+import os
+import sys
+import time
+
+SDKPATH = os.environ.get("APPENGINE_SDK", "/usr/local/google_appengine")
+SRCPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+def FixSysPath():
+    """
+    Makes the SDK, its bundled libraries, and the app source importable.
+    """
+    if SDKPATH not in sys.path:
+        sys.path.insert(0, SDKPATH)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    if SRCPATH not in sys.path:
+        sys.path.insert(0, SRCPATH)
+
+def ActivateTestbed():
+    """
+    Sets up the testbed with datastore and memcache stubs, and a signed in user (the app needs one, see
+    app.yaml). Returns the testbed, call deactivate() when done.
+    """
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    ltestbed = testbed.Testbed()
+    ltestbed.activate()
+    # make the stub strongly consistent, so reads straight after writes see them
+    lpolicy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+    ltestbed.init_datastore_v3_stub(consistency_policy=lpolicy)
+    ltestbed.init_memcache_stub()
+    ltestbed.init_user_stub()
+    ltestbed.setup_env(USER_EMAIL = "bench@example.com", USER_ID = "bench", USER_IS_ADMIN = "0", overwrite = True)
+    return ltestbed
+
+def TimePerCall(aFunc, aIterations):
+    """
+    Calls aFunc aIterations times, returns mean seconds per call.
+    """
+    lstart = time.time()
+    for _ in xrange(aIterations):
+        aFunc()
+    return (time.time() - lstart) / aIterations
@@ -0,0 +1,150 @@
+'''
+Micro-benchmark of the per-row cost of converting models to Jsonables and back.
+
+Compares the per-row reflection Sleepy used before codecs were compiled (copied here as
+LegacyModelToJsonable / LegacyJsonableToModel, with the helpers they called) with Sleepy's compiled
+SleepyCodec path.
+
+usage: python benchmarks/codec_bench.py [rows]
+'''
+import datetime
+import sys
+
+import benchutil
+benchutil.FixSysPath()
+
+from google.appengine.ext import db
+
+from restapi import Sleepy
+
+class DbToDo(db.Model):
+    """
+    ToDo as a db model, as it was before it moved to ndb. The legacy code below only understands db models.
+    """
+    text = db.StringProperty()
+    order = db.IntegerProperty()
+    done = db.BooleanProperty(default = False)
+    created = db.DateTimeProperty(auto_now_add = True)
+    modified = db.DateTimeProperty(auto_now = True)
+
+# the rest of this section is Sleepy's code from before codecs, copied so later changes to Sleepy don't alter the baseline
+
+LEGACYSUPPORTEDDBTYPES = [
+        db.IntegerProperty, 
+        db.FloatProperty, 
+        db.BooleanProperty,
+        db.StringProperty,
+        db.DateTimeProperty,
+        db.DateProperty
+]
+
+def LegacyConstructDefaultTemplate(aModelClass, aMaxDepth = 5):
+    ltemplate = None
+
+    if aMaxDepth > 0:
+        ltemplate = {}
+        
+        lmodel = aModelClass()
+                
+        for lkey in lmodel.properties(): 
+            if lkey[:1] is "_":
+                continue # ignore private props
+            
+            ltemplate[lkey] = None
+            
+    return ltemplate
+
+def LegacyParseDateTimeString(string):
+    return datetime.datetime.strptime(string, '%Y-%m-%dT%H:%M:%S.%fZ')
+
+def LegacyParseDateString(string):
+    return datetime.datetime.strptime(string, '%Y-%m-%dZ').date()
+
+def LegacyModelToJsonable(aModel, aTemplate = None):
+    ljsonable = {}
+    ljsonable['id'] = aModel.key().id()
+
+    ltemplate = aTemplate
+    if not ltemplate:
+        ltemplate = LegacyConstructDefaultTemplate(aModel.__class__)
+
+    for lkey in ltemplate:
+        if hasattr(aModel, lkey):
+            lvalue = getattr(aModel, lkey)
+            if lkey in aModel.properties():
+                lprop = aModel.properties()[lkey]
+                if not type(lprop) in LEGACYSUPPORTEDDBTYPES:
+                    raise TypeError("%s not supported" % type(lprop).__name__)
+                elif lvalue and type(lprop) == db.DateProperty or type(lprop) == db.DateTimeProperty:
+                    ldateString = lvalue.isoformat()
+                    if not hasattr(lvalue, "utcoffset") or not lvalue.utcoffset():
+                        ldateString = ("%sZ" % ldateString)
+                    ljsonable[lkey] = ldateString
+                else:
+                    ljsonable[lkey] = lvalue
+            else:
+                ljsonable[lkey] = lvalue
+    return ljsonable
+
+def LegacyJsonableToModel(aJsonable, aModel, aTemplate = None):
+    ltemplate = aTemplate
+    if not ltemplate:
+        ltemplate = LegacyConstructDefaultTemplate(aModel.__class__)
+
+    for lkey in ltemplate:
+        if lkey in aJsonable and hasattr(aModel, lkey):
+            lvalue = aJsonable[lkey]
+            if lkey in aModel.properties():
+                lprop = aModel.properties()[lkey]
+                if not type(lprop) in LEGACYSUPPORTEDDBTYPES:
+                    raise TypeError("%s not supported" % type(lprop).__name__)
+                elif type(lprop) is db.DateProperty:
+                    setattr(aModel, lkey, LegacyParseDateString(lvalue))
+                elif type(lprop) is db.DateTimeProperty:
+                    setattr(aModel, lkey, LegacyParseDateTimeString(lvalue))
+                else:
+                    setattr(aModel, lkey, lvalue)
+            else:
+                setattr(aModel, lkey, lvalue)
+
+def main():
+    lrows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    ltestbed = benchutil.ActivateTestbed()
+    try:
+        lmodels = [DbToDo(text = "todo %s" % lindex, order = lindex) for lindex in xrange(lrows)]
+        db.put(lmodels)
+        ljsonables = [Sleepy.ModelToJsonable(lmodel) for lmodel in lmodels]
+
+        def LegacyEncode():
+            for lmodel in lmodels:
+                LegacyModelToJsonable(lmodel)
+
+        def CompiledEncode():
+            lcodec = Sleepy.GetCodec(DbToDo)
+            for lmodel in lmodels:
+                lcodec.Encode(lmodel)
+
+        def LegacyDecode():
+            for lmodel, ljsonable in zip(lmodels, ljsonables):
+                LegacyJsonableToModel(ljsonable, lmodel)
+
+        def CompiledDecode():
+            lcodec = Sleepy.GetCodec(DbToDo)
+            for lmodel, ljsonable in zip(lmodels, ljsonables):
+                lcodec.Decode(ljsonable, lmodel)
+
+        print "%s rows, microseconds per row" % lrows
+        for lname, lfunc in [
+                    ("encode, legacy", LegacyEncode),
+                    ("encode, compiled", CompiledEncode),
+                    ("decode, legacy", LegacyDecode),
+                    ("decode, compiled", CompiledDecode)
+                ]:
+            lseconds = benchutil.TimePerCall(lfunc, 5)
+            print "%-20s %8.2f" % (lname, lseconds * 1000000.0 / lrows)
+    finally:
+        ltestbed.deactivate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+'''
+Compares list storage (see Sleepy.UseListStorage) with the usual entity per item storage.
+
+The same REST calls are made against two resources over the app's ToDo, /todos (an entity per item) and
+/listtodos (one list document), at a few list sizes. For each call this prints the mean time per call, the
+number of datastore RPCs it made, and the response size.
+
+Sleepy's response cache is turned off, so the entity per item reads go to the datastore every time. The SDK
+stubs don't charge for entity size or count the way production does, so the RPC counts matter more than the
+times; the times mostly show the cost of encoding and decoding.
+
+usage: python benchmarks/list_bench.py [iterations]
+'''
+import json
+import sys
+
+import benchutil
+benchutil.FixSysPath()
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import ndb
+import webapp2
+
+from restapi import Sleepy, ToDoRestHandler
+
+# list sizes to compare at
+LISTSIZES = [10, 200, 1000]
+
+class EntityToDoRestHandler(ToDoRestHandler):
+    def GetCacheTtl(self):
+        # caching would hide the datastore, which is what we want to measure
+        return None
+
+class ListToDoRestHandler(EntityToDoRestHandler):
+    def UseListStorage(self):
+        return True
+
+    def GetOwnerKey(self, *args, **kwargs):
+        # not the user's, or the list would be made from the entities /todos makes (see ListBackend.LoadList)
+        return ndb.Key("ListBenchOwner", "bench")
+
+_rpcCounts = {}
+
+def CountRpc(service, call, request, response):
+    _rpcCounts[service] = _rpcCounts.get(service, 0) + 1
+
+def Call(aApp, aMethod, aPath, aJsonable = None):
+    # don't let ndb's in-context cache carry over between calls, as it wouldn't between requests
+    ndb.get_context().clear_cache()
+    lrequest = webapp2.Request.blank(aPath)
+    lrequest.method = aMethod
+    if aJsonable is not None:
+        lrequest.body = json.dumps(aJsonable)
+    lresponse = lrequest.get_response(aApp)
+    if lresponse.status_int >= 400:
+        raise Exception("%s %s: %s" % (aMethod, aPath, lresponse.body))
+    return lresponse
+
+def main():
+    literations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    ltestbed = benchutil.ActivateTestbed()
+    try:
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append("list_bench", CountRpc)
+
+        lapp = webapp2.WSGIApplication(Sleepy.FixRoutes([
+            ("todos", EntityToDoRestHandler),
+            ("listtodos", ListToDoRestHandler)
+        ]))
+        lapp.allowed_methods = webapp2.WSGIApplication.allowed_methods.union(["PATCH"])
+
+        print "%s iterations" % literations
+        print "%-6s %-10s %-10s %10s %10s %10s" % ("size", "resource", "call", "ms/call", "datastore", "bytes")
+
+        lcreated = {}
+        for lsize in LISTSIZES:
+            for lresource in ["todos", "listtodos"]:
+                lids = lcreated.setdefault(lresource, [])
+                while len(lids) < lsize:
+                    lresponse = Call(lapp, "POST", "/%s" % lresource, {"text": "todo %s" % len(lids), "order": len(lids)})
+                    lids.append(json.loads(lresponse.body)["id"])
+
+                lcounter = [0]
+                def lput():
+                    lcounter[0] += 1
+                    return Call(lapp, "PUT", "/%s/%s" % (lresource, lids[1]), {"text": "edited %s" % lcounter[0]})
+                def lpostAndDelete():
+                    # keeps the list the same size
+                    lresponse = Call(lapp, "POST", "/%s" % lresource, {"text": "new"})
+                    Call(lapp, "DELETE", "/%s/%s" % (lresource, json.loads(lresponse.body)["id"]))
+                    return lresponse
+
+                lcalls = [
+                    ("get list", lambda: Call(lapp, "GET", "/%s" % lresource)),
+                    ("get item", lambda: Call(lapp, "GET", "/%s/%s" % (lresource, lids[0]))),
+                    ("put", lput),
+                    ("post+del", lpostAndDelete)
+                ]
+
+                for lname, lfunc in lcalls:
+                    lbytes = [0]
+                    def lcall():
+                        lbytes[0] += len(lfunc().body)
+                    _rpcCounts.clear()
+                    lseconds = benchutil.TimePerCall(lcall, literations)
+                    print "%-6s %-10s %-10s %10.2f %10.1f %10.0f" % (lsize, lresource, lname, lseconds * 1000.0,
+                            _rpcCounts.get("datastore_v3", 0) / float(literations), lbytes[0] / float(literations))
+    finally:
+        ltestbed.deactivate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+'''
+Load benchmark for the REST API.
+
+Drives main.app in-process, with webapp2 requests and the testbed's datastore and memcache stubs, so
+there's no network involved. Each scenario is a request repeated a number of times. For each one this
+reports:
+
+- throughput, in requests per second of time spent handling them
+- p50 / p95 / p99 latency, in milliseconds
+- datastore RPCs per request
+- mean response bytes
+
+Results are printed and, if an output path is given, written as JSON so runs can be compared to
+catch regressions. Sleepy's response cache is cleared before every request unless the scenario name
+says "cached", so by default the numbers are for the full path through the datastore.
+
+usage: python benchmarks/rest_bench.py [output.json] [iterations]
+'''
+import json
+import sys
+import time
+
+import benchutil
+benchutil.FixSysPath()
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+import webapp2
+
+from datamodel import ToDo
+from main import app
+from restapi import ToDoRestHandler
+
+# collection sizes for the GET list scenarios
+LISTSIZES = [10, 1000, 10000]
+
+_rpcCounts = {}
+
+def CountRpc(service, call, request, response):
+    _rpcCounts[service] = _rpcCounts.get(service, 0) + 1
+
+def Percentile(aSortedValues, aPercent):
+    """
+    Nearest rank percentile of an already sorted list
+    """
+    lindex = int(round(aPercent / 100.0 * len(aSortedValues) + 0.5)) - 1
+    return aSortedValues[max(0, min(lindex, len(aSortedValues) - 1))]
+
+def Seed(aCount):
+    """
+    Replaces all ToDos with aCount new ones, belonging to the user the requests are made as. 
+    Returns their ids.
+    """
+    ndb.delete_multi(ToDo.query().fetch(keys_only = True))
+    lownerKey = ToDoRestHandler().GetOwnerKey()
+    lkeys = []
+    for lstart in xrange(0, aCount, 500):
+        lkeys.extend(ndb.put_multi([ToDo(parent = lownerKey, text = "todo %s" % lindex, order = lindex)
+                                    for lindex in xrange(lstart, min(lstart + 500, aCount))]))
+    return [lkey.id() for lkey in lkeys]
+
+def Run(aName, aIterations, aMakeRequest, aCached = False):
+    """
+    Makes aIterations requests, each built by aMakeRequest(aIteration). Returns a result dictionary.
+    """
+    llatencies = []
+    lbytes = 0
+    ldatastoreRpcs = 0
+    for literation in xrange(aIterations):
+        if not aCached:
+            memcache.flush_all()
+        # ndb's in-context cache doesn't outlive a request in production
+        ndb.get_context().clear_cache()
+        lrequest = aMakeRequest(literation)
+
+        _rpcCounts.clear()
+        lstart = time.time()
+        lresponse = lrequest.get_response(app)
+        llatencies.append(time.time() - lstart)
+
+        if lresponse.status_int >= 400:
+            raise Exception("%s: %s %s" % (aName, lresponse.status, lresponse.body))
+        lbytes += len(lresponse.body)
+        ldatastoreRpcs += _rpcCounts.get("datastore_v3", 0)
+
+    llatencies.sort()
+    return {
+        "scenario": aName,
+        "requests": aIterations,
+        "throughput_rps": aIterations / sum(llatencies),
+        "p50_ms": Percentile(llatencies, 50) * 1000.0,
+        "p95_ms": Percentile(llatencies, 95) * 1000.0,
+        "p99_ms": Percentile(llatencies, 99) * 1000.0,
+        "datastore_rpcs_per_request": ldatastoreRpcs / float(aIterations),
+        "response_bytes": lbytes / float(aIterations)
+    }
+
+def JsonRequest(aMethod, aPath, aJsonable = None):
+    lrequest = webapp2.Request.blank(aPath)
+    lrequest.method = aMethod
+    if aJsonable is not None:
+        lrequest.body = json.dumps(aJsonable)
+    return lrequest
+
+def main():
+    loutputPath = sys.argv[1] if len(sys.argv) > 1 else None
+    literations = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    ltestbed = benchutil.ActivateTestbed()
+    try:
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append("rest_bench", CountRpc)
+
+        lresults = []
+
+        for lsize in LISTSIZES:
+            Seed(lsize)
+            # the biggest lists are slow, there's no need for as many samples
+            lcount = max(5, literations * 10 / lsize) if lsize > 100 else literations
+            lresults.append(Run("get list %s" % lsize, lcount, lambda i: JsonRequest("GET", "/todos")))
+            lresults.append(Run("get list %s cached" % lsize, lcount, lambda i: JsonRequest("GET", "/todos"), aCached = True))
+
+        lids = Seed(literations * 2)
+        lresults.append(Run("get by id", literations, lambda i: JsonRequest("GET", "/todos/%s" % lids[i])))
+        lresults.append(Run("post", literations, lambda i: JsonRequest("POST", "/todos", {"text": "new %s" % i, "order": i})))
+        lresults.append(Run("put", literations, lambda i: JsonRequest("PUT", "/todos/%s" % lids[i], {"done": True})))
+        lresults.append(Run("delete", literations, lambda i: JsonRequest("DELETE", "/todos/%s" % lids[literations + i])))
+        lresults.append(Run("page", literations, lambda i: webapp2.Request.blank("/")))
+
+        print "%-22s %10s %9s %9s %9s %10s %10s" % ("scenario", "req/s", "p50 ms", "p95 ms", "p99 ms", "ds rpcs", "bytes")
+        for lresult in lresults:
+            print "%-22s %10.1f %9.2f %9.2f %9.2f %10.1f %10.0f" % (lresult["scenario"], lresult["throughput_rps"],
+                    lresult["p50_ms"], lresult["p95_ms"], lresult["p99_ms"],
+                    lresult["datastore_rpcs_per_request"], lresult["response_bytes"])
+
+        if loutputPath:
+            with open(loutputPath, "w") as lfile:
+                json.dump({"iterations": literations, "results": lresults}, lfile, indent = 4, sort_keys = True)
+    finally:
+        ltestbed.deactivate()
+
+if __name__ == "__main__":
+    main()
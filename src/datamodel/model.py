@@ -3,19 +3,18 @@ Created Dec 10, 2011
 
 @author: emlyn o'regan
 '''
-from google.appengine.ext import db
+from google.appengine.ext import ndb
 
-class ToDo(db.Model):
-    text = db.StringProperty()
-    order = db.IntegerProperty()
-    done = db.BooleanProperty()
-    created = db.DateTimeProperty(auto_now_add = True)
-    modified = db.DateTimeProperty(auto_now = True)
-
-    def __init__(self, *args, **kwargs):
-        db.Model.__init__(self, *args, **kwargs)
-        if self.done is None:
-            self.done = False
+class ToDo(ndb.Model):
+    text = ndb.StringProperty()
+    order = ndb.IntegerProperty()
+    # position in the list, see restapi/sleepyrank.py
+    rank = ndb.StringProperty()
+    done = ndb.BooleanProperty(default = False)
+    created = ndb.DateTimeProperty(auto_now_add = True)
+    modified = ndb.DateTimeProperty(auto_now = True)
+    # the words in text, for GET /todos?q=. See restapi/sleepysearch.py
+    search_terms = ndb.StringProperty(repeated = True)
 
 #    @property
 #    def calculated(self):
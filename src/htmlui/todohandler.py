@@ -1,12 +1,98 @@
+import datetime
+import hashlib
+import logging
 import os
 from google.appengine.ext.webapp import template
 from google.appengine.ext import webapp
+from restapi import Sleepy, ToDoRestHandler
+from restapi import sleepycodec
+from restapi.sleepystats import SleepyStats
 
 class ToDoHandler(webapp.RequestHandler):
+    # the page, made once per instance. See GetPage
+    _page = None
+
+    # the page's placeholder for the initial list, see get
+    BOOTSTRAPMARKER = '<script type="application/json" id="todos-bootstrap">'
+
+    # the page as tools/buildassets.py builds it, and its source
+    BUILTPAGEPATH = os.path.join(os.path.dirname(__file__), "todos.built.html")
+    SOURCEPAGEPATH = os.path.join(os.path.dirname(__file__), "todos.html")
+
+    @classmethod
+    def GetPage(cls):
+        """
+        The page, as a pair of the html before and after the initial list goes in.
+
+        tools/buildassets.py writes todos.built.html, with the scripts and the stylesheet bundled, and that's
+        served as it is. Without it (eg: in development), todos.html is rendered instead, with a warning, as
+        it loads every asset separately and unminified.
+        """
+        if cls._page is None:
+            if os.path.exists(cls.BUILTPAGEPATH):
+                with open(cls.BUILTPAGEPATH) as lfile:
+                    lhtml = lfile.read()
+            else:
+                logging.warning("%s isn't built, serving %s; run tools/buildassets.py before deploying" %
+                                (os.path.basename(cls.BUILTPAGEPATH), os.path.basename(cls.SOURCEPAGEPATH)))
+                lhtml = SleepyStats.Timed("render", template.render)(cls.SOURCEPAGEPATH, {})
+            if isinstance(lhtml, unicode):
+                lhtml = lhtml.encode("utf-8")
+            lbefore, lmarker, lafter = lhtml.partition(cls.BOOTSTRAPMARKER)
+            cls._page = (lbefore + lmarker, lafter)
+        return cls._page
+
+    def GetRestHandler(self):
+        """
+        A ToDoRestHandler for GET /todos, as the caller, to get the initial list from
+        """
+        retval = ToDoRestHandler()
+        retval.initialize(webapp.Request.blank("/todos"), webapp.Response())
+        return retval
+
+    def GetBootstrapItems(self, aRestHandler):
+        """
+        The initial list for the page: the json GET /todos returns, got by calling ToDoRestHandler directly, so it's
+        encoded with the same template and scoped to the same owner. It's cached as GET /todos is, so page loads
+        share a cache entry (the client's own requests are all delta syncs, which aren't cached).
+        Returns None if it can't be had.
+        """
+        aRestHandler.get("todos", None)
+        if aRestHandler.response.status_int != 200:
+            return None
+        return aRestHandler.response.body
 
     def get(self):
-        template_values = {}
-                
-        path = os.path.join(os.path.dirname(__file__), "todos.html")
-        self.response.out.write(template.render(path, template_values))
-        
\ No newline at end of file
+        lrestHandler = self.GetRestHandler()
+        lbefore, lafter = self.GetPage()
+
+        # the page has the caller's list in it, so its etag is the list's, which changes whenever the list does
+        # and is had without a query. It's read before the list is, so a write made while the list is read
+        # changes it. A page from before then still has a right watermark: nothing has changed since.
+        self.response.headers["Cache-Control"] = "private, no-cache"
+        letag = None
+        try:
+            lcollectionETag = Sleepy.GetCollectionETag(lrestHandler)
+            if lcollectionETag:
+                letag = '"%s"' % hashlib.md5(lbefore + lcollectionETag + lafter).hexdigest()
+        except Exception, ex:
+            logging.exception(ex)
+
+        if letag:
+            self.response.headers["ETag"] = letag
+            if Sleepy.ETagMatches(self.request.headers.get("If-None-Match"), letag):
+                self.response.set_status(304)
+                return
+
+        # anything changed after this will turn up in the page's first delta sync
+        lwatermark = datetime.datetime.utcnow() - Sleepy.SYNCOVERLAP
+        litems = self.GetBootstrapItems(lrestHandler)
+
+        # in the same form as a full delta sync, so the page can carry on with delta syncs from there
+        lbootstrap = ""
+        if litems is not None:
+            lwatermarkJson = Sleepy.JsonableToJson(sleepycodec.FormatDateOrDateTime(lwatermark))
+            lbootstrap = '{"items":%s,"watermark":%s}' % (litems, lwatermarkJson)
+            # nothing in the json may end the script element. "<" only occurs in strings, where it can be escaped.
+            lbootstrap = lbootstrap.replace("<", "\\u003c")
+        self.response.out.write(lbefore + lbootstrap + lafter)
@@ -22,7 +22,61 @@ $(function(){
 
     // Toggle the `done` state of this todo item.
     toggle: function() {
-      this.save({done: !this.get("done")});
+      this.patch({done: !this.get("done")});
+    },
+
+    // Save just the given attributes, with PATCH rather than sending the whole
+    // todo. The server doesn't write anything if they haven't changed, and
+    // sends back only what did.
+    patch: function(attrs) {
+      if (this.isNew()) return this.save(attrs);
+      var self = this;
+      this.set(attrs);
+      $.ajax({
+        url:         this.url(),
+        type:        'PATCH',
+        contentType: 'application/json',
+        dataType:    'json',
+        data:        JSON.stringify(attrs),
+        success:     function(resp) { self.set(resp); }
+      });
+    },
+
+    // How many times a move is retried after a conflict, and how long to wait
+    // before each retry, in milliseconds.
+    moveRetries: 3,
+    moveRetryDelay: 1000,
+
+    // Move this todo to just after `after` and before `before` (either may be
+    // null for the start or end of the list). Only this todo is written.
+    //
+    // If two todos got the same rank the server can't put anything between
+    // them; it answers 409 and spreads the ranks out in the background. Then
+    // we wait, pick up the new ranks and try again.
+    move: function(after, before, retries) {
+      if (retries === undefined) retries = this.moveRetries;
+      var self = this;
+      $.ajax({
+        url:         this.url() + '/move',
+        type:        'POST',
+        contentType: 'application/json',
+        dataType:    'json',
+        data:        JSON.stringify({
+          after:  after ? after.id : null,
+          before: before ? before.id : null
+        }),
+        success: function(resp) {
+          self.set(resp);
+          if (self.collection) self.collection.sort();
+        },
+        error: function(xhr) {
+          if (xhr.status != 409 || !retries) return;
+          _.delay(function() {
+            if (self.collection) self.collection.refresh();
+            self.move(after, before, retries - 1);
+          }, self.moveRetryDelay);
+        }
+      });
     }
 
   });
@@ -41,6 +95,42 @@ $(function(){
 //    localStorage: new Store("todos"),
 
     url: '/todos',
+
+    // The server's watermark from the last sync. Passing it back as `since`
+    // gets only what has changed since then.
+    watermark: '1970-01-01T00:00:00.000000Z',
+
+    // How often to check the server for changes, in milliseconds.
+    refreshInterval: 30000,
+
+    // Bring the collection up to date with the server, fetching only the todos
+    // changed or deleted since the last sync. The first sync gets everything.
+    refresh: function() {
+      // a todo still being created would come back as a duplicate; wait for it.
+      if (this.any(function(todo){ return todo.isNew(); })) return;
+      var self = this;
+      $.ajax({
+        url:      this.url,
+        dataType: 'json',
+        data:     {since: this.watermark},
+        success:  function(resp) {
+          if (resp.full) {
+            self.reset(resp.items);
+          } else {
+            _.each(resp.items, function(attrs) {
+              var todo = self.get(attrs.id);
+              if (todo) todo.set(attrs); else self.add(attrs);
+            });
+            _.each(resp.deleted, function(id) {
+              var todo = self.get(id);
+              if (todo) todo.trigger('destroy', todo, self);
+            });
+          }
+          self.watermark = resp.watermark;
+          if (resp.more) self.refresh();
+        }
+      });
+    },
     
     // Filter down the list of all todo items that are finished.
     done: function() {
@@ -59,9 +149,45 @@ $(function(){
       return this.last().get('order') + 1;
     },
 
-    // Todos are sorted by their original insertion order.
+    // Todos are sorted by their rank, which the server assigns (new todos go
+    // at the end) and changes when a todo is moved. Todos not yet saved sort last.
     comparator: function(todo) {
-      return todo.get('order');
+      return todo.get('rank') || '~' + ('0000000000' + todo.get('order')).slice(-10);
+    },
+
+    // Destroy all the finished todo items with one bulk request, however many
+    // there are. The server deletes them in the background; once its job is
+    // done, a sync picks up anything we got wrong.
+    destroyDone: function() {
+      var self = this;
+      _.each(this.done(), function(todo){
+        todo.trigger('destroy', todo, todo.collection);
+      });
+      $.ajax({
+        url:      this.url + '?done=true',
+        type:     'DELETE',
+        dataType: 'json',
+        success:  function(job, status, xhr) {
+          self.waitForJob(xhr.getResponseHeader('Location'));
+        }
+      });
+    },
+
+    // Poll a bulk job until it finishes, then sync.
+    waitForJob: function(url) {
+      var self = this;
+      $.ajax({
+        url:      url,
+        dataType: 'json',
+        cache:    false,
+        success:  function(job) {
+          if (job.status == 'running') {
+            _.delay(function(){ self.waitForJob(url); }, 1000);
+          } else {
+            self.refresh();
+          }
+        }
+      });
     }
 
   });
@@ -86,6 +212,8 @@ $(function(){
       "click .check"              : "toggleDone",
       "dblclick div.todo-text"    : "edit",
       "click span.todo-destroy"   : "clear",
+      "click span.todo-up"        : "moveUp",
+      "click span.todo-down"      : "moveDown",
       "keypress .todo-input"      : "updateOnEnter"
     },
 
@@ -124,7 +252,7 @@ $(function(){
 
     // Close the `"editing"` mode, saving changes to the todo.
     close: function() {
-      this.model.save({text: this.input.val()});
+      this.model.patch({text: this.input.val()});
       $(this.el).removeClass("editing");
     },
 
@@ -133,6 +261,26 @@ $(function(){
       if (e.keyCode == 13) this.close();
     },
 
+    // Swap places with the todo above, by moving between the two above.
+    moveUp: function() {
+      var list = this.model.collection;
+      var index = list.indexOf(this.model);
+      if (index > 0) this.moveBetween(list.at(index - 2), list.at(index - 1));
+    },
+
+    // Swap places with the todo below, by moving between the two below.
+    moveDown: function() {
+      var list = this.model.collection;
+      var index = list.indexOf(this.model);
+      if (index < list.length - 1) this.moveBetween(list.at(index + 1), list.at(index + 2));
+    },
+
+    // Todos which aren't saved yet have no id to move next to, or to move.
+    moveBetween: function(after, before) {
+      if (this.model.isNew() || (after && after.isNew()) || (before && before.isNew())) return;
+      this.model.move(after || null, before || null);
+    },
+
     // Remove this view from the DOM.
     remove: function() {
       $(this.el).remove();
@@ -175,7 +323,16 @@ $(function(){
       Todos.bind('reset', this.addAll, this);
       Todos.bind('all',   this.render, this);
 
-      Todos.fetch();
+      // the page comes with the list in it, so there's no need to ask for it
+      var bootstrap = $('#todos-bootstrap').html();
+      if (bootstrap) {
+        bootstrap = JSON.parse(bootstrap);
+        Todos.watermark = bootstrap.watermark;
+        Todos.reset(bootstrap.items);
+      } else {
+        Todos.refresh();
+      }
+      setInterval(function(){ Todos.refresh(); }, Todos.refreshInterval);
     },
 
     // Re-rendering the App just means refreshing the statistics -- the rest
@@ -195,8 +352,10 @@ $(function(){
       this.$("#todo-list").append(view.render().el);
     },
 
-    // Add all items in the **Todos** collection at once.
+    // Add all items in the **Todos** collection at once. This happens again
+    // when the collection is re-sorted after a move, so start afresh.
     addAll: function() {
+      this.$("#todo-list").empty();
       Todos.each(this.addOne);
     },
 
@@ -211,7 +370,7 @@ $(function(){
 
     // Clear all done todo items, destroying their models.
     clearCompleted: function() {
-      _.each(Todos.done(), function(todo){ todo.destroy(); });
+      Todos.destroyDone();
       return false;
     },
 
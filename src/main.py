@@ -2,6 +2,7 @@ import webapp2
 
 import htmlui
 import restapi
+from restapi.sleepystats import SleepyStats, SleepyStatsMiddleware
 
 # basic route for bringing up the app
 lroutes = [ ('/', htmlui.ToDoHandler) ]
@@ -11,3 +12,9 @@ lroutes.extend(restapi.restRoutes)
 
 # create the application with these routes
 app = webapp2.WSGIApplication(lroutes, debug=True)
+# webapp2 doesn't allow PATCH by default, see Sleepy.PatchHandler
+app.allowed_methods = webapp2.WSGIApplication.allowed_methods.union(["PATCH"])
+
+# per request timings, see restapi/sleepystats.py. Turned on with SLEEPYSTATS in app.yaml
+if SleepyStats.enabled:
+    app = SleepyStatsMiddleware(app)
@@ -1,8 +1,31 @@
 from todoresthandler import *
 from sleepy import *
+from sleepyadmin import *
 
 restRoutes = [
   ('todos', ToDoRestHandler)
 ]
 
-restRoutes = Sleepy.FixRoutes(restRoutes)
\ No newline at end of file
+restRoutes = Sleepy.FixRoutes(restRoutes)
+
+# housekeeping, admin only (see app.yaml)
+restRoutes.extend([
+  ('/_sleepy/collecttombstones', CollectTombstonesHandler),
+  ('/_sleepy/rebalanceranks', RebalanceRanksHandler),
+  ('/_sleepy/repaircounters', RepairCountersHandler),
+  ('/_sleepy/backfillsearchterms', BackfillSearchTermsHandler),
+  ('/_sleepy/adoptrootentities', AdoptRootEntitiesHandler),
+  ('/_stats', StatsHandler)
+])
+
+# handlers whose ranks /_sleepy/rebalanceranks rebalances
+RebalanceRanksHandler.restHandlers = [ToDoRestHandler]
+
+# handlers whose counters /_sleepy/repaircounters recomputes
+RepairCountersHandler.restHandlers = [ToDoRestHandler]
+
+# handlers whose search terms /_sleepy/backfillsearchterms sets
+BackfillSearchTermsHandler.restHandlers = [ToDoRestHandler]
+
+# handlers whose unowned entities /_sleepy/adoptrootentities gives to the admin calling it
+AdoptRootEntitiesHandler.restHandlers = [ToDoRestHandler]
@@ -1,7 +1,42 @@
 import datetime
-from google.appengine.ext import db
+import gzip
+import hashlib
+import itertools
+import StringIO
+import time
+from google.appengine.api import taskqueue
+from google.appengine.ext import deferred
+from google.appengine.ext import ndb
 import json
 import logging
+import random
+import sleepycodec
+import sleepyrank
+import sleepysearch
+from sleepycodec import SleepyCodec
+from sleepycache import SleepyCache
+from sleepylist import ListBackend
+from sleepymodels import SleepyTombstone, SleepyCounterShard, SleepyDirtyCounters, SleepyJob
+from sleepybackend import DbBackend, NdbBackend, GetBackend, GetBackendOf, KeyOf, KeyIdOrName, ParentOf, RootOf, KeyString, ToNdbKey
+from sleepystats import SleepyStats
+
+class PreconditionFailed(Exception):
+    """
+    Raised when a conditional request (eg: If-Match) doesn't match the current state of a resource
+    """
+    status = 412
+
+class Conflict(Exception):
+    """
+    Raised when a request can't be carried out because of the current state of the resource
+    """
+    status = 409
+
+class Forbidden(Exception):
+    """
+    Raised when the caller isn't allowed to use a resource at all
+    """
+    status = 403
 
 class Sleepy:
     @classmethod
@@ -48,9 +83,7 @@ class Sleepy:
         if aMaxDepth > 0:
             ltemplate = {}
             
-            lmodel = aModelClass()
-                    
-            for lkey in lmodel.properties(): 
+            for lkey in GetBackend(aModelClass).Properties(aModelClass): 
                 if lkey[:1] is "_":
                     continue # ignore private props
                 
@@ -61,22 +94,30 @@ class Sleepy:
                 
         return ltemplate
 
-    SUPPORTEDDBTYPES = [
-            db.IntegerProperty, 
-            db.FloatProperty, 
-            db.BooleanProperty,
-            db.StringProperty,
-            db.DateTimeProperty,
-            db.DateProperty
-    ]
+    # property types Sleepy can convert, for db models. See sleepybackend for ndb.
+    SUPPORTEDDBTYPES = DbBackend.SUPPORTEDTYPES
+
+    # number of entities fetched per datastore page, and written per chunk, on collection GETs
+    STREAMBATCHSIZE = 100
+
+    # largest page a client may ask for with ?limit=
+    MAXLIMIT = 1000
 
     @classmethod
     def ParseDateTimeString(cls, string):
-        return datetime.datetime.strptime(string, '%Y-%m-%dT%H:%M:%S.%fZ')
+        return sleepycodec.ParseDateTimeString(string)
 
     @classmethod
     def ParseDateString(cls, string):
-        return datetime.datetime.strptime(string, '%Y-%m-%dZ').date()
+        return sleepycodec.ParseDateString(string)
+
+    @classmethod
+    def GetCodec(cls, aModelClass, aTemplate = None):
+        """
+        Returns the compiled SleepyCodec for aModelClass and aTemplate (the default template if None).
+        Codecs are cached, so this is cheap to call per request.
+        """
+        return SleepyCodec.Get(aModelClass, aTemplate, cls.ConstructDefaultTemplate)
 
     @classmethod
     def ModelToJsonable(cls, aModel, aTemplate = None):
@@ -88,40 +129,12 @@ class Sleepy:
         ljsonable = None
 
         if aModel:
-            ljsonable = {}
-            ljsonable['id'] = aModel.key().id() # We're going to work with numeric ids as resource identifiers
-
-            ltemplate = aTemplate
-            if not ltemplate:
-                ltemplate = cls.ConstructDefaultTemplate(aModel.__class__)
-                
-            # here we have a template
-            
-            for lkey in ltemplate:
-                if hasattr(aModel, lkey):
-                    lvalue = getattr(aModel, lkey)
-                    if lkey in aModel.properties():
-                        # it's a datastore property
-                        lprop = aModel.properties()[lkey]
-                        if not type(lprop) in cls.SUPPORTEDDBTYPES:
-                            raise TypeError("%s not supported" % type(lprop).__name__)
-                        elif lvalue and type(lprop) == db.DateProperty or type(lprop) == db.DateTimeProperty:
-                            ldateString = lvalue.isoformat()
-                            # kludgy fix
-                            if not hasattr(lvalue, "utcoffset") or not lvalue.utcoffset():
-                                ldateString = ("%sZ" % ldateString)
-                            ljsonable[lkey] = ldateString
-                        else:
-                            ljsonable[lkey] = lvalue
-                    else:
-                        # it's some other kind of property.
-                        # just guess that it's ok for now
-                        ljsonable[lkey] = lvalue
+            ljsonable = SleepyStats.Timed("serialize", cls.GetCodec(aModel.__class__, aTemplate).Encode)(aModel)
         
         return ljsonable
 
     @classmethod
-    def JsonableToModel(cls, aJsonable, aModel, aTemplate = None):
+    def JsonableToModel(cls, aJsonable, aModel, aTemplate = None, aChanged = None):
         """
         Update a model instance from a Jsonable. 
         
@@ -133,6 +146,8 @@ class Sleepy:
         The first entry in the save list is guaranteed to be aModel.
         
         The Delete list is a list of any models which need to be deleted.
+        
+        If aChanged is a list, the names of the fields whose values actually changed are added to it.
         """
         lsavemodels = []
         ldeletemodels = []
@@ -142,35 +157,9 @@ class Sleepy:
             lsavemodels.append(aModel)
            
             if aJsonable:
-                ltemplate = aTemplate
-                if not ltemplate:
-                    ltemplate = cls.ConstructDefaultTemplate(aModel.__class__)
-                
-                # here we have a template
-                for lkey in ltemplate:
-                    if lkey in aJsonable:
-                        try:
-                            # ok the key is in the template and the incoming jsonable, try setting the value
-                            if hasattr(aModel, lkey):
-                                lvalue = aJsonable[lkey]
-                                
-                                if lkey in aModel.properties():
-                                    # it's a datastore property
-                                    lprop = aModel.properties()[lkey]
-                                    if not type(lprop) in cls.SUPPORTEDDBTYPES:
-                                        raise TypeError("%s not supported" % type(lprop).__name__)
-                                    elif type(lprop) is db.DateProperty:
-                                        setattr(aModel, lkey, cls.ParseDateString(lvalue))
-                                    elif type(lprop) is db.DateTimeProperty:
-                                        setattr(aModel, lkey, cls.ParseDateTimeString(lvalue))
-                                    else:
-                                        setattr(aModel, lkey, lvalue)
-                                else:
-                                    # it's some other kind of property.
-                                    # just guess that it's ok for now
-                                    setattr(aModel, lkey, lvalue)
-                        except Exception, ex:
-                            raise ex.__class__("Error assigning '%s': %s" % (lkey, str(ex)))
+                lchanged = cls.GetCodec(aModel.__class__, aTemplate).Decode(aJsonable, aModel)
+                if aChanged is not None:
+                    aChanged.extend(lchanged)
                         
         return lsaveanddeletearrays
 
@@ -185,40 +174,11 @@ class Sleepy:
         """
         lmeta = None
         
-        ltemplate = aTemplate
-        
-        if aModelClass and not ltemplate:
-            ltemplate =  cls.ConstructDefaultTemplate(aModelClass)
-
-        if ltemplate:
-            lmeta = {}
-            
-            lmodel = None
-            if aModelClass:
-                # it'll be convenient to have a blank model instance
-                lmodel = aModelClass()
-            
-            # here we have a template
-            for lkey in ltemplate:
-                
-                if lmodel and hasattr(lmodel, lkey):
-                    lproperties = lmodel.properties()
-                    if lkey in lproperties:
-                        lprop = lmodel.properties()[lkey]
-                        if "data_type" in type(lprop).__dict__:
-                            lmeta[lkey] = type(lprop).__dict__["data_type"]. __name__.replace("basestring", "string")
-                        else:
-                            lmeta[lkey] = type(lprop).__name__
-                    else:
-                        lpropTypeMethodName = "proptype_%s" % lkey
-                        if hasattr(lmodel, lpropTypeMethodName):
-                            lpropTypeMethod = getattr(lmodel, lpropTypeMethodName)
-                            lpropType = lpropTypeMethod()
-                            lmeta[lkey] = lpropType.__name__.replace("str","string").replace("unicode","string")
-                        else:
-                            lmeta[lkey] = None # not a db field. Don't know anything about it.
-                else:
-                    raise ValueError("Incompatible template, field '%s' does not exist in model" % lkey)
+        if aModelClass:
+            lmeta = cls.GetCodec(aModelClass, aTemplate).Meta()
+        elif aTemplate:
+            # without a model class, no template can be compatible
+            raise ValueError("Incompatible template, field '%s' does not exist in model" % list(aTemplate)[0])
             
         return lmeta
 
@@ -231,6 +191,108 @@ class Sleepy:
     def MethodExists(cls, aObject, aMethodName):
         return hasattr(aObject, aMethodName)
 
+    @classmethod
+    def GetOwnerKey(cls, aRestHandler, *args, **kwargs):
+        """
+        Handlers partition their entities by owner by implementing GetOwnerKey(*args, **kwargs), returning the key
+        of the caller's owner entity (which needn't exist), eg: one per user. It must be a key of the same API (db or 
+        ndb) as the model class.
+        
+        New entities are created as children of the owner key, ids are looked up under it, and collection queries
+        are ancestor queries on it. So a request only reads the caller's entities, whatever other owners have,
+        and lists are strongly consistent. Tombstones, counters, jobs and cache entries are per owner too.
+        Each owner's entities are one entity group, so writes to them are limited to about one a second.
+        
+        GetOwnerKey() returning None means the caller has no owner, and is refused.
+        
+        Returns None if the handler doesn't partition by owner. It's asked once per handler instance. Deferred 
+        tasks make handlers with MakeTaskHandler, which sets the owner instead.
+        """
+        if not hasattr(aRestHandler, "_sleepyOwnerKey"):
+            lownerKey = None
+            if cls.MethodExists(aRestHandler, "GetOwnerKey"):
+                lownerKey = aRestHandler.GetOwnerKey(*args, **kwargs)
+                if lownerKey is None:
+                    raise Forbidden("this resource needs an owner")
+            aRestHandler._sleepyOwnerKey = lownerKey
+        return aRestHandler._sleepyOwnerKey
+
+    @classmethod
+    def MakeTaskHandler(cls, aRestHandlerClass, aOwnerKey, aStorage = None):
+        """
+        A handler for a deferred task to work with, with no request. Its owner is aOwnerKey; None means
+        the task works on every owner's entities. aStorage, if given, is the backend it reads and writes its
+        entities with, rather than its own (see GetStorage).
+        """
+        retval = aRestHandlerClass()
+        retval._sleepyOwnerKey = aOwnerKey
+        if aStorage:
+            retval._sleepyStorage = aStorage
+        return retval
+
+    @classmethod
+    def NewModel(cls, aRestHandler, aModelClass, *args, **kwargs):
+        """
+        A new instance of aModelClass, under the caller's owner if there is one
+        """
+        lownerKey = cls.GetOwnerKey(aRestHandler, *args, **kwargs)
+        if lownerKey:
+            return aModelClass(parent = lownerKey)
+        return aModelClass()
+
+    @classmethod
+    def AdoptRootEntities(cls, aRestHandlerClass, aOwnerKey, aCursor = None, *args, **kwargs):
+        """
+        Moves the entities of a handler's model class which have no parent, ie: were made before the handler
+        partitioned by owner (see GetOwnerKey), under aOwnerKey. Until then no request can see them. Run with
+        deferred; it does a page of MAXBATCHSIZE entities, then defers itself for the next.
+        
+        Each entity is copied to the same id under aOwnerKey, and the original is deleted through CommitChanges,
+        so it leaves a tombstone at its old key, and counters and caches are kept right for both. The copies get
+        a new modified time, so clients' delta syncs pick them up. If the id is already taken under aOwnerKey by
+        a different entity, the copy gets a new id.
+        
+        A retry finds copies already made and doesn't make them again. Ranks are copied as they are; run 
+        RebalanceRanks afterwards to interleave them with the owner's own.
+        
+        The roots are always entities; with list storage (see UseListStorage) the copies go into aOwnerKey's list.
+        """
+        lrestHandler = cls.MakeTaskHandler(aRestHandlerClass, aOwnerKey)
+        lmodelClass = lrestHandler.GetModelClass()
+        lbackend = GetBackend(lmodelClass)
+        lstorage = cls.GetStorage(lrestHandler)
+
+        lqry = lbackend.Query(lmodelClass)
+        lmodels, lcursor, lmore = cls.Wait(lbackend.FetchPageAsync(lqry, cls.MAXBATCHSIZE, aCursor))
+        lroots = [lmodel for lmodel in lmodels if ParentOf(lmodel) is None]
+
+        if lroots:
+            lcopyKeys = [lstorage.MakeKey(lmodelClass, lbackend.Id(lroot), aOwnerKey) for lroot in lroots]
+            lexisting = cls.Wait(lstorage.GetMultiAsync(lcopyKeys))
+            lproperties = [lname for lname, lprop in lbackend.Properties(lmodelClass).items() if not lbackend.IsAutoNow(lprop)]
+
+            lcopies = []
+            for lroot, lcopyKey, lfound in zip(lroots, lcopyKeys, lexisting):
+                if lfound:
+                    if all(getattr(lfound, lname) == getattr(lroot, lname) for lname in lproperties):
+                        # copied by an earlier try of this page
+                        continue
+                    lcopyKey = lstorage.MakeKey(lmodelClass, lstorage.AllocateIds(lmodelClass, 1, aOwnerKey)[0], aOwnerKey)
+                lcopy = lstorage.Copy(lroot, lcopyKey)
+                # new to the owner, so counted in full
+                lcopy._sleepyCounted = frozenset()
+                lcopies.append(lcopy)
+
+            if lstorage is lbackend:
+                cls.CommitChanges(lrestHandler, lcopies, lroots)
+            else:
+                cls.CommitChanges(lrestHandler, lcopies, [])
+                # the roots are entities, whatever the handler's storage
+                cls.CommitChanges(cls.MakeTaskHandler(aRestHandlerClass, aOwnerKey, lbackend), [], lroots)
+
+        if lmore and lmodels:
+            deferred.defer(cls.AdoptRootEntities, aRestHandlerClass, aOwnerKey, lcursor, *args, **kwargs)
+
     @classmethod
     def GetHandler(cls, aRestHandler, aResource, aResourceArg, *args, ** kwargs):
         try:
@@ -245,9 +307,32 @@ class Sleepy:
             if cls.MethodExists(aRestHandler, "GetTemplate"):
                 ltemplate = aRestHandler.GetTemplate()
 
+            ltemplate = cls.GetFieldsTemplate(aRestHandler, lmodelClass, ltemplate)
+
+            lbackend = GetBackend(lmodelClass)
+            lkind = lbackend.Kind(lmodelClass)
+            lownerKey = cls.GetOwnerKey(aRestHandler, *args, **kwargs)
+            lcacheKind = SleepyCache.Scope(lkind, lownerKey)
+
+            lcacheTtl = SleepyCache.GetTtl(aRestHandler, *args, **kwargs)
+            if cls.IsPretty(aRestHandler):
+                # the cache only holds compact json
+                lcacheTtl = None
+            lcacheVariant = None
+            if lcacheTtl:
+                lcacheVariant = SleepyCache.GetVariant(aRestHandler, ltemplate, *args, **kwargs)
+
             if aResourceArg and aResourceArg == "meta":
                 ljsonable = cls.ModelClassToMeta(lmodelClass, ltemplate)
                 cls.ReturnJsonable(aRestHandler, ljsonable)
+            elif aResourceArg and aResourceArg == "meta/stats":
+                if not cls.GetCounters(aRestHandler):
+                    raise KeyError("stats are not supported for this resource")
+                cls.ReturnJsonable(aRestHandler, cls.GetCounterValues(aRestHandler, lmodelClass, *args, **kwargs))
+            elif aResourceArg == "_export":
+                cls.ExportHandler(aRestHandler, lmodelClass, ltemplate, *args, **kwargs)
+            elif aResourceArg and aResourceArg.startswith("_jobs/"):
+                cls.ReturnJob(aRestHandler, lkind, lownerKey, aResourceArg[len("_jobs/"):])
             elif aResourceArg:
                 lId = None
                 try:
@@ -255,202 +340,2337 @@ class Sleepy:
                 except:
                     raise ValueError("id must be an integer")
                 
-                cls.CheckMethodExists(lmodelClass, "get_by_id", "Class returned by GetModelClass() must support get_by_id")
-                
-                lmodel = lmodelClass.get_by_id(lId)
+                letag = None
+                ljson = None
+                if lcacheTtl:
+                    lcached = SleepyCache.GetEntity(lcacheKind, lId, lcacheVariant)
+                    if lcached:
+                        letag, ljson = lcached
 
-                if lmodel and cls.MethodExists(aRestHandler, "IsAuthorized"): 
-                    if not aRestHandler.IsAuthorized(lmodel, *args, **kwargs):
-                        lmodel = None
+                if ljson is None:
+                    cls.CheckMethodExists(lmodelClass, "get_by_id", "Class returned by GetModelClass() must support get_by_id")
+                    
+                    lmodel = cls.Wait(cls.GetStorage(aRestHandler).GetByIdAsync(lmodelClass, lId, lownerKey))
+    
+                    if lmodel and cls.MethodExists(aRestHandler, "IsAuthorized"): 
+                        if not aRestHandler.IsAuthorized(lmodel, *args, **kwargs):
+                            lmodel = None
+    
+                    if lmodel:
+                        # here we have a model to return to the caller
+                        lcodec = cls.GetCodec(lmodelClass, ltemplate)
+                        letag = lcodec.ETag(lmodel)
+                        ljson = SleepyStats.Timed("json", cls.JsonableToJson)(
+                                    SleepyStats.Timed("serialize", lcodec.Encode)(lmodel), cls.IsPretty(aRestHandler))
 
-                if lmodel:
-                    # here we have a model to return to the caller
-                    lresultJsonable = cls.ModelToJsonable(lmodel, ltemplate)
+                        if lcacheTtl:
+                            SleepyCache.SetEntity(lcacheKind, lId, lcacheVariant, (letag, ljson), lcacheTtl)
 
-                    cls.ReturnJsonable(aRestHandler, lresultJsonable)
-                else:
+                if ljson is None:
                     cls.ReturnNotFound(aRestHandler)
+                elif cls.UseETags(aRestHandler):
+                    if cls.IsPretty(aRestHandler):
+                        # same entity, different bytes
+                        letag = cls.WeakETag(letag)
+                    cls.ReturnJsonOrNotModified(aRestHandler, ljson, letag)
+                else:
+                    cls.ReturnJson(aRestHandler, ljson)
             else:
-                lqry = lmodelClass.all()
+                # check the arguments first, so a bad request gets its error rather than a 304
+                cls.GetFiltersAndOrders(aRestHandler, lmodelClass)
+                cls.GetLimitArg(aRestHandler)
+                if aRestHandler.request.get("q"):
+                    cls.GetQueryWordsArg(aRestHandler)
+                elif aRestHandler.request.get("since"):
+                    cls.GetSinceArg(aRestHandler, lmodelClass, ltemplate)
 
-                if lqry and cls.MethodExists(aRestHandler, "ModifyQuery"):
-                    lqry = aRestHandler.ModifyQuery(lqry, *args, **kwargs)
-                
-                lisAuthorizedMethod = None
-                if cls.MethodExists(aRestHandler, "IsAuthorized"):
-                    lisAuthorizedMethod = cls.IsAuthorized
-                    
-                lresultsJsonable = []
+                lcacheKey = None
+                lcached = None
+                letag = None
 
-                for lmodel in lqry:
-                    if (lisAuthorizedMethod is None) or lisAuthorizedMethod(lmodel, *args, **kwargs):
-                        lresultsJsonable.append(cls.ModelToJsonable(lmodel, ltemplate))
-                        
-                cls.ReturnJsonable(aRestHandler, lresultsJsonable)
+                lgeneration = None
+                if lcacheTtl or cls.UseETags(aRestHandler):
+                    # must be read before querying, so that a write which lands during the query changes it
+                    lgeneration = SleepyCache.GetGeneration(lcacheKind)
+
+                # without a generation, neither an ETag nor a cached response could tell a write had happened
+                if cls.UseETags(aRestHandler) and lgeneration is not None:
+                    letag = SleepyCache.CollectionETag(lcacheKind, lgeneration, 
+                                    SleepyCache.GetVariant(aRestHandler, ltemplate, *args, **kwargs), aRestHandler.request)
+
+                if letag and cls.ETagMatches(aRestHandler.request.headers.get("If-None-Match"), letag):
+                    # nothing has changed since the caller last asked; no need to query at all
+                    cls.ReturnNotModified(aRestHandler, letag)
+                else:
+                    if letag:
+                        aRestHandler.response.headers["ETag"] = letag
+
+                    if lcacheTtl and lgeneration is not None:
+                        lcacheKey = SleepyCache.CollectionKey(lcacheKind, lgeneration, lcacheVariant, aRestHandler.request)
+                        lcached = SleepyCache.GetCollection(lcacheKey, lcacheKind)
+    
+                    if lcached:
+                        lheaders, lbody = lcached
+                        aRestHandler.response.headers.update(lheaders)
+                        cls.ReturnJson(aRestHandler, lbody)
+                    elif aRestHandler.request.get("since") and not aRestHandler.request.get("q"):
+                        cls.ReturnDelta(aRestHandler, lmodelClass, ltemplate, *args, **kwargs)
+                    else:
+                        if aRestHandler.request.get("q"):
+                            cls.ReturnSearch(aRestHandler, lmodelClass, ltemplate, *args, **kwargs)
+                        else:
+                            cls.ReturnCollection(aRestHandler, lmodelClass, ltemplate, *args, **kwargs)
+    
+                        if lcacheKey:
+                            lheaders = {}
+                            if "X-Sleepy-Next-Cursor" in aRestHandler.response.headers:
+                                lheaders["X-Sleepy-Next-Cursor"] = aRestHandler.response.headers["X-Sleepy-Next-Cursor"]
+                            SleepyCache.SetCollection(lcacheKey, lheaders, aRestHandler.response.body, lcacheTtl)
+
+            cls.CompressResponse(aRestHandler)
         except Exception, ex:
             logging.exception(ex)
             cls.ReturnException(aRestHandler, ex)
+
+    @classmethod
+    def GetCollectionETag(cls, aRestHandler, *args, **kwargs):
+        """
+        An ETag for something built from the caller's whole collection, eg: a page with the list in it. Like
+        collection GET ETags it comes from the cache generation, so it changes whenever any entity in the 
+        collection is written, and needs no query. None if the generation can't be read.
+        """
+        lmodelClass = aRestHandler.GetModelClass()
+        lcacheKind = SleepyCache.Scope(GetBackend(lmodelClass).Kind(lmodelClass), cls.GetOwnerKey(aRestHandler, *args, **kwargs))
+        lgeneration = SleepyCache.GetGeneration(lcacheKind)
+        if lgeneration is None:
+            return None
+        return '"%s"' % hashlib.md5("%s|%s" % (lcacheKind, lgeneration)).hexdigest()
+
+    @classmethod
+    def GetFieldsTemplate(cls, aRestHandler, aModelClass, aTemplate):
+        """
+        Narrows aTemplate to the fields named in the optional ?fields= argument (comma separated).
         
+        Returns aTemplate unchanged if there's no fields argument.
+        """
+        retval = aTemplate
+        lfieldsArg = aRestHandler.request.get("fields")
+        if lfieldsArg:
+            lallowedFields = cls.GetCodec(aModelClass, aTemplate).fields
+            retval = {}
+            for lfield in lfieldsArg.split(","):
+                lfield = lfield.strip()
+                if lfield and lfield != "id": # id is always included
+                    if not lfield in lallowedFields:
+                        raise ValueError("unknown field '%s'" % lfield)
+                    retval[lfield] = None
+            if not retval:
+                raise ValueError("fields must name at least one field")
+        return retval
+
     @classmethod
-    def PutHandler(cls, aRestHandler, aResource, aResourceArg, *args, ** kwargs):
-        try:
-            cls.CheckMethodExists(aRestHandler, "GetModelClass", "Rest Handler must include a method GetModelClass()")                
+    def GetProjection(cls, aRestHandler, aModelClass, aTemplate):
+        """
+        If a collection GET can be answered with a projection query, returns the properties to project, otherwise None.
+        
+        Projection queries read just the requested fields from the index, rather than whole entities. They
+        need a composite index containing the projected properties, so handlers list the field sets they have
+        indexes for in GetProjections(), eg: [("text", "done")], and a ?fields= request which asks for exactly
+        one of those sets is answered with a projection.
+        
+        As projected entities are partial, projections aren't used for handlers which implement IsAuthorized.
+        ModifyQuery must not add equality filters on projected properties.
+        """
+        retval = None
+        if aTemplate and cls.MethodExists(aRestHandler, "GetProjections") and not cls.MethodExists(aRestHandler, "IsAuthorized"):
+            lfields = set(aTemplate)
+            lbackend = GetBackend(aModelClass)
+            lproperties = lbackend.Properties(aModelClass)
+            for lprojection in aRestHandler.GetProjections():
+                if set(lprojection) == lfields:
+                    if all(lfield in lproperties and lbackend.IsIndexed(lproperties[lfield]) for lfield in lprojection):
+                        retval = tuple(lprojection)
+                    break
+        return retval
 
-            lmodelClass = aRestHandler.GetModelClass()
-            
-            if not lmodelClass:
-                raise ValueError("GetModelClass() must not return None")
+    # responses smaller than this aren't worth compressing
+    MINGZIPSIZE = 1024
 
-            ltemplate = None
-            if cls.MethodExists(aRestHandler, "GetTemplate"):
-                ltemplate = aRestHandler.GetTemplate()
+    @classmethod
+    def CompressResponse(cls, aRestHandler):
+        """
+        gzips the response body if the client accepts it and it's big enough to be worthwhile.
 
-            if aResourceArg:
-                lId = None
-                try:
-                    lId = int(aResourceArg)
-                except:
-                    raise ValueError("id must be an integer")
+        The gzipped body isn't byte for byte the identity one, so its ETag is made weak. Either way the response
+        may be stored by caches, so it's marked as varying by Accept-Encoding.
+        """
+        lresponse = aRestHandler.response
+        if lresponse.status_int in [200, 304]:
+            lresponse.headers["Vary"] = "Accept-Encoding"
+        if lresponse.status_int == 200 and len(lresponse.body) >= cls.MINGZIPSIZE and \
+                "gzip" in aRestHandler.request.headers.get("Accept-Encoding", "") and \
+                not "Content-Encoding" in lresponse.headers:
+            lbuffer = StringIO.StringIO()
+            lgzip = gzip.GzipFile(mode = "wb", fileobj = lbuffer, compresslevel = 6)
+            lgzip.write(lresponse.body)
+            lgzip.close()
+            lresponse.body = lbuffer.getvalue()
+            lresponse.headers["Content-Encoding"] = "gzip"
+            if "ETag" in lresponse.headers:
+                lresponse.headers["ETag"] = cls.WeakETag(lresponse.headers["ETag"])
 
-                lincomingJsonable = cls.GetIncomingJsonable(aRestHandler)
+    @classmethod
+    def ReturnCollection(cls, aRestHandler, aModelClass, aTemplate, *args, **kwargs):
+        """
+        Runs the query for a collection GET and streams the results to the response.
+        """
+        llimit = cls.GetLimitArg(aRestHandler)
+        lcursor = aRestHandler.request.get("cursor")
 
-                cls.CheckMethodExists(lmodelClass, "get_by_id", "Class returned by GetModelClass() must support get_by_id")
-                
-                lmodel = lmodelClass.get_by_id(lId)
+        lfilters, lorders = cls.GetFiltersAndOrders(aRestHandler, aModelClass)
 
-                if lmodel and cls.MethodExists(aRestHandler, "IsAuthorized"): 
-                    if not aRestHandler.IsAuthorized(lmodel, *args, **kwargs):
-                        lmodel = None
-                
-                if lmodel:
-                    lsaveanddeletearrays = cls.JsonableToModel(lincomingJsonable, lmodel, ltemplate)
+        lprojection = cls.GetProjection(aRestHandler, aModelClass, aTemplate)
+        if lprojection and [lfield for lfield, loperator, _ in lfilters if loperator == "=" and lfield in lprojection]:
+            # the datastore can't project a property with an equality filter
+            lprojection = None
 
-                    lsavemodels = lsaveanddeletearrays[0]
-                    ldeletemodels = lsaveanddeletearrays[1]
+        lstorage = cls.GetStorage(aRestHandler)
+        lqry = lstorage.Query(aModelClass, lprojection, aAncestor = cls.GetOwnerKey(aRestHandler, *args, **kwargs))
 
-                    if cls.MethodExists(lmodel, "DecorateModel"):
-                        lsavemodels = map(lmodel.DecorateModel, lsavemodels)
-                    
-                    db.put(lsavemodels)
-                    db.delete(ldeletemodels)
+        if lqry and cls.MethodExists(aRestHandler, "ModifyQuery"):
+            lqry = aRestHandler.ModifyQuery(lqry, *args, **kwargs)
 
-                    lresultJsonable = cls.ModelToJsonable(lmodel, ltemplate)
-                    
-                    cls.ReturnJsonable(aRestHandler, lresultJsonable)
-                else:
-                    cls.ReturnNotFound(aRestHandler)
-            else:
-                raise KeyError("id is required")
-        except Exception, ex:
-            logging.exception(ex)
-            cls.ReturnException(aRestHandler, ex)        
+        for lfield, loperator, lvalue in lfilters:
+            lqry = lstorage.Filter(aModelClass, lqry, lfield, loperator, lvalue)
+        for lfield, ldescending in lorders:
+            lqry = lstorage.Order(aModelClass, lqry, lfield, ldescending)
 
-    @classmethod
-    def PostHandler(cls, aRestHandler, aResource, aResourceArg, *args, ** kwargs):
-        try:
-            cls.CheckMethodExists(aRestHandler, "GetModelClass", "Rest Handler must include a method GetModelClass()")                
+        lisAuthorizedMethod = None
+        if cls.MethodExists(aRestHandler, "IsAuthorized"):
+            lisAuthorizedMethod = aRestHandler.IsAuthorized
 
-            lmodelClass = aRestHandler.GetModelClass()
-            
-            if not lmodelClass:
-                raise ValueError("GetModelClass() must not return None")
+        lstate = {}
+        lresults = cls.FetchPages(aModelClass, lqry, llimit, lcursor, lstate, lstorage)
 
-            ltemplate = None
-            if cls.MethodExists(aRestHandler, "GetTemplate"):
-                ltemplate = aRestHandler.GetTemplate()
+        lencode = SleepyStats.Timed("serialize", cls.GetCodec(aModelClass, aTemplate).Encode)
 
-            if aResourceArg:
-                raise KeyError("no arguments accepted for POST")
-            else:
-                lincomingJsonable = cls.GetIncomingJsonable(aRestHandler)
+        def lresultsJsonable():
+            for lmodel in lresults:
+                if (lisAuthorizedMethod is None) or lisAuthorizedMethod(lmodel, *args, **kwargs):
+                    yield lencode(lmodel)
 
-                lmodel = lmodelClass() # create a new model instance
-                
-                lsaveanddeletearrays = cls.JsonableToModel(lincomingJsonable, lmodel, ltemplate)
+        cls.ReturnJsonableStream(aRestHandler, lresultsJsonable())
 
-                lsavemodels = lsaveanddeletearrays[0]
-                ldeletemodels = lsaveanddeletearrays[1]
+        if llimit and lstate.get("more") and lstate.get("cursor"):
+            # there may be more; hand back a cursor for the next page.
+            # this goes by entities read rather than returned, so filtering by
+            # IsAuthorized can't end paging early.
+            aRestHandler.response.headers["X-Sleepy-Next-Cursor"] = lstate["cursor"]
 
-                if cls.MethodExists(lmodel, "DecorateModel"):
-                    lsavemodels = map(lmodel.DecorateModel, lsavemodels)
-                
-                db.put(lsavemodels)
-                db.delete(ldeletemodels)
+    # query string arguments with their own meaning on collection GETs. Any other argument is a filter, unless it
+    # starts with "_" (eg: jQuery's cache buster), in which case it's ignored.
+    RESERVEDARGS = ["limit", "cursor", "since", "fields", "pretty", "order_by", "q"]
 
-                lresultJsonable = cls.ModelToJsonable(lmodel, ltemplate)
-                
-                cls.ReturnJsonable(aRestHandler, lresultJsonable)
-        except Exception, ex:
-            logging.exception(ex)
-            cls.ReturnException(aRestHandler, ex)        
+    # suffixes for filter arguments, eg: ?order__gte=3
+    FILTEROPERATORS = {
+        "lt": "<",
+        "lte": "<=",
+        "gt": ">",
+        "gte": ">="
+    }
 
     @classmethod
-    def DeleteHandler(cls, aRestHandler, aResource, aResourceArg, *args, ** kwargs):
-        try:
-            cls.CheckMethodExists(aRestHandler, "GetModelClass", "Rest Handler must include a method GetModelClass()")                
+    def GetFiltersAndOrders(cls, aRestHandler, aModelClass):
+        """
+        Parses the filters and sort orders in the query string of a collection GET, eg: ?done=false&order_by=-order
+        
+        A filter is field=value, or field__lt, __lte, __gt or __gte=value. The value is parsed according to
+        the property's type; booleans are true / false, datetimes and dates are formatted as in the json. 
+        order_by is a comma separated list of fields, each optionally preceded by "-" for descending order.
+        
+        Fields must be in the handler's template and be indexed datastore properties. Handlers can restrict
+        them further by implementing GetQueryFields() and GetOrderFields(), each returning a list of field names.
+        As the datastore requires, inequality filters can only be on one field, which must be the first order_by
+        field if there is one. Most combinations need composite indexes; see GetIndexes.
+        
+        Returns a pair: a list of (field, operator, value) filters, and a list of (field, descending) orders.
+        """
+        lqueryFields = cls.GetQueryFields(aRestHandler, aModelClass)
+        lorderFields = cls.GetOrderFields(aRestHandler, aModelClass)
+        lproperties = GetBackend(aModelClass).Properties(aModelClass)
 
-            lmodelClass = aRestHandler.GetModelClass()
-            
-            if not lmodelClass:
-                raise ValueError("GetModelClass() must not return None")
+        lfilters = []
+        lorders = []
+        for lname, lvalue in aRestHandler.request.GET.items():
+            if lname in cls.RESERVEDARGS or lname[:1] == "_":
+                continue
+            lfield, _, loperatorName = lname.partition("__")
+            if not lfield in lqueryFields:
+                raise ValueError("unknown query argument '%s'" % lname)
+            if loperatorName and not loperatorName in cls.FILTEROPERATORS:
+                raise ValueError("unknown operator '%s', use one of %s" % (loperatorName, ", ".join(sorted(cls.FILTEROPERATORS))))
+            try:
+                lparsedValue = cls.ParseQueryValue(GetBackend(aModelClass).MetaTypeName(lproperties[lfield]), lvalue)
+            except ValueError:
+                raise ValueError("invalid value for '%s'" % lname)
+            lfilters.append((lfield, cls.FILTEROPERATORS.get(loperatorName, "="), lparsedValue))
 
-            if aResourceArg:
-                lId = None
-                try:
-                    lId = int(aResourceArg)
-                except:
-                    raise ValueError("id must be an integer")
+        lorderArg = aRestHandler.request.get("order_by")
+        if lorderArg:
+            for lfield in lorderArg.split(","):
+                lfield = lfield.strip()
+                ldescending = lfield[:1] == "-"
+                if ldescending:
+                    lfield = lfield[1:]
+                if not lfield in lorderFields:
+                    raise ValueError("can't order by '%s'" % lfield)
+                lorders.append((lfield, ldescending))
 
-                cls.CheckMethodExists(lmodelClass, "get_by_id", "Class returned by GetModelClass() must support get_by_id")
-                
-                lmodel = lmodelClass.get_by_id(lId)
+        linequalityFields = set(lfield for lfield, loperator, _ in lfilters if loperator != "=")
+        if len(linequalityFields) > 1:
+            raise ValueError("inequality filters are only allowed on one field")
+        if linequalityFields and lorders and not lorders[0][0] in linequalityFields:
+            raise ValueError("the first order_by field must be %s, as it has an inequality filter" % list(linequalityFields)[0])
 
-                if lmodel and cls.MethodExists(aRestHandler, "IsAuthorized"): 
-                    if not aRestHandler.IsAuthorized(lmodel, *args, **kwargs):
-                        lmodel = None
-                    
-                if lmodel:
-                    # allow models to specify other models that need deleting
-                    ldeleteList = [lmodel]
-                    if cls.MethodExists(lmodel, "GetDeleteList"):
-                        ldeleteList.append(lmodel.GetDeleteList())
+        return lfilters, lorders
 
-                    db.delete(ldeleteList)
+    @classmethod
+    def GetQueryableFields(cls, aRestHandler, aModelClass):
+        """
+        Fields of the handler's template which are indexed datastore properties of supported types
+        """
+        ltemplate = None
+        if cls.MethodExists(aRestHandler, "GetTemplate"):
+            ltemplate = aRestHandler.GetTemplate()
 
-                    cls.ReturnNone(aRestHandler)
-                else:
-                    cls.ReturnNotFound(aRestHandler)
+        lbackend = GetBackend(aModelClass)
+        lproperties = lbackend.Properties(aModelClass)
+        retval = []
+        for lfield in cls.GetCodec(aModelClass, ltemplate).fields:
+            lprop = lproperties.get(lfield)
+            if lprop is not None and type(lprop) in lbackend.SUPPORTEDTYPES and lbackend.IsIndexed(lprop):
+                retval.append(lfield)
+        return retval
+
+    @classmethod
+    def GetQueryFields(cls, aRestHandler, aModelClass):
+        """
+        Fields which can be filtered on. See GetFiltersAndOrders
+        """
+        retval = cls.GetQueryableFields(aRestHandler, aModelClass)
+        if cls.MethodExists(aRestHandler, "GetQueryFields"):
+            retval = [lfield for lfield in aRestHandler.GetQueryFields() if lfield in retval]
+        return retval
+
+    @classmethod
+    def GetOrderFields(cls, aRestHandler, aModelClass):
+        """
+        Fields which can be ordered by. See GetFiltersAndOrders
+        """
+        retval = cls.GetQueryableFields(aRestHandler, aModelClass)
+        if cls.MethodExists(aRestHandler, "GetOrderFields"):
+            retval = [lfield for lfield in aRestHandler.GetOrderFields() if lfield in retval]
+        return retval
+
+    @classmethod
+    def ParseQueryValue(cls, aTypeName, aValue):
+        """
+        Parses a filter value from the query string, given the property's type name (as in meta)
+        """
+        if aTypeName == "bool":
+            if aValue in ["true", "1"]:
+                return True
+            elif aValue in ["false", "0"]:
+                return False
             else:
-                raise KeyError("id is required")
-        except Exception, ex:
-            logging.exception(ex)
-            cls.ReturnException(aRestHandler, ex)
+                raise ValueError("invalid bool")
+        elif aTypeName == "int":
+            return int(aValue)
+        elif aTypeName == "float":
+            return float(aValue)
+        elif aTypeName == "datetime":
+            return cls.ParseDateTimeString(aValue)
+        elif aTypeName == "date":
+            return cls.ParseDateString(aValue)
+        else:
+            return aValue
+
+    # largest number of equality filters GetIndexes makes composite indexes for
+    MAXINDEXEDFILTERS = 2
 
     @classmethod
-    def ReturnException(cls, aRestHandler, aException):
-        """ 
-        http response with json representation of an exception
-        """ 
-        # should set status codes here
-        aRestHandler.response.set_status(400)
-        aRestHandler.response.body = "%s: %s" % (aException.__class__.__name__, str(aException))
-       
+    def GetIndexes(cls, aRestHandler):
+        """
+        Works out the composite indexes needed by the queries GetFiltersAndOrders accepts for a handler.
+        
+        That's an index for each combination of up to MAXINDEXEDFILTERS equality filters on query fields, with
+        one order_by (in either direction) or inequality filter on another field. Queries with only equality filters,
+        or only one order_by field, use the datastore's built in indexes. Queries ordering by several fields
+        need their own index entries, which aren't generated.
+        
+        If the handler partitions by owner (see GetOwnerKey), queries are ancestor queries, so the indexes are
+        ancestor indexes, and ordering by one field (or delta syncs, which order by the auto_now field) needs one too.
+        
+        Returns a list of (kind, ancestor, list of (property, descending)). See IndexesToYaml
+        """
+        lmodelClass = aRestHandler.GetModelClass()
+        lkind = GetBackend(lmodelClass).Kind(lmodelClass)
+        lqueryFields = sorted(cls.GetQueryFields(aRestHandler, lmodelClass))
+        lsortFields = sorted(set(cls.GetOrderFields(aRestHandler, lmodelClass)) | set(lqueryFields))
+        lancestor = cls.MethodExists(aRestHandler, "GetOwnerKey")
+
+        retval = []
+        if lancestor:
+            lancestorSortFields = list(lsortFields)
+            if cls.UseDeltaSync(aRestHandler):
+                lversionKey = cls.GetCodec(lmodelClass).versionKey
+                if lversionKey and not lversionKey in lancestorSortFields:
+                    lancestorSortFields.append(lversionKey)
+            for lsortField in lancestorSortFields:
+                for ldescending in [False, True]:
+                    retval.append((lkind, True, [(lsortField, ldescending)]))
+
+        for lcount in range(1, cls.MAXINDEXEDFILTERS + 1):
+            for lequalityFields in itertools.combinations(lqueryFields, lcount):
+                for lsortField in lsortFields:
+                    if not lsortField in lequalityFields:
+                        for ldescending in [False, True]:
+                            retval.append((lkind, lancestor, [(lfield, False) for lfield in lequalityFields] + [(lsortField, ldescending)]))
+        return retval
+
     @classmethod
-    def ReturnJsonable(cls, aRestHandler, aJsonable):
-        """ 
-        http response with string representation of Json structure
-        """ 
-        loutput = json.dumps(aJsonable, sort_keys=True, indent=4)
-        aRestHandler.response.out.write(loutput)
+    def IndexesToYaml(cls, aIndexes):
+        """
+        Formats indexes from GetIndexes as index.yaml entries
+        """
+        llines = []
+        for lkind, lancestor, lproperties in aIndexes:
+            llines.append("- kind: %s" % lkind)
+            if lancestor:
+                llines.append("  ancestor: yes")
+            llines.append("  properties:")
+            for lproperty, ldescending in lproperties:
+                llines.append("  - name: %s" % lproperty)
+                if ldescending:
+                    llines.append("    direction: desc")
+            llines.append("")
+        return "\n".join(llines)
 
     @classmethod
-    def ReturnNotFound(cls, aRestHandler):
-        aRestHandler.response.set_status(404)
-        aRestHandler.response.body = ""
-    
+    def FetchPages(cls, aModelClass, aQuery, aLimit = None, aCursor = None, aState = None, aBackend = None):
+        """
+        Runs aQuery from aCursor, returning a generator of its results (at most aLimit of them, if given).
+        
+        Results are fetched STREAMBATCHSIZE at a time. The first page is asked for straight away, and each
+        following page is asked for before the current one is handed out, so with ndb the datastore works on the next
+        page while the caller is busy with this one. (db queries can't be run asynchronously, so they just page.)
+        
+        If aState is a dictionary, the generator keeps "cursor" and "more" in it up to date: the cursor
+        following the last page fetched, and whether there may be more results after it.
+        
+        Only a page of models is held at a time, but what the caller makes of them may not be; see 
+        ReturnJsonableStream.
+        
+        aBackend is the backend aQuery is from (see GetStorage); the model class's if it's None.
+        """
+        lbackend = aBackend or GetBackend(aModelClass)
+
+        def lpageSize(aRemaining):
+            return min(aRemaining or cls.STREAMBATCHSIZE, cls.STREAMBATCHSIZE)
+
+        try:
+            lfirstFuture = lbackend.FetchPageAsync(aQuery, lpageSize(aLimit), aCursor)
+        except Exception:
+            if aCursor:
+                raise ValueError("invalid cursor")
+            raise
+
+        def lresults():
+            lfuture = lfirstFuture
+            lremaining = aLimit
+            while lfuture:
+                lmodels, lnextCursor, lmore = cls.Wait(lfuture)
+                lfuture = None
+                if lremaining is not None:
+                    lremaining -= len(lmodels)
+                if lmodels and lmore and (lremaining is None or lremaining > 0):
+                    lfuture = lbackend.FetchPageAsync(aQuery, lpageSize(lremaining), lnextCursor)
+                if aState is not None:
+                    aState["cursor"] = lnextCursor
+                    aState["more"] = lmore
+                for lmodel in lmodels:
+                    yield lmodel
+
+        return lresults()
+
     @classmethod
-    def ReturnNone(cls, aRestHandler):
-        aRestHandler.response.body = ""
+    def GetSearchIndex(cls, aRestHandler):
+        """
+        Handlers make their collections searchable by implementing GetSearchIndex(), returning a pair: the name of
+        a repeated, indexed StringProperty to hold each entity's search terms, and a list of the fields whose words
+        are searched, eg: ("search_terms", ["text"]). The terms property should be left out of the handler's
+        template, so clients neither see nor set it.
+        
+        The terms are worked out from the fields on every write through Sleepy (see WriteChanges), and 
+        BackfillSearchTerms sets them for entities written before. See sleepysearch for how they're made and
+        matched, and ReturnSearch for the search itself.
+        
+        Returns None if the handler isn't searchable.
+        """
+        retval = None
+        if cls.MethodExists(aRestHandler, "GetSearchIndex"):
+            retval = aRestHandler.GetSearchIndex()
+        return retval
+
+    @classmethod
+    def SetSearchTerms(cls, aRestHandler, aModels):
+        """
+        Brings the search terms of the handler's models in aModels up to date, if it's searchable. 
+        
+        Returns the models whose terms changed.
+        """
+        retval = []
+        lsearchIndex = cls.GetSearchIndex(aRestHandler)
+        if lsearchIndex:
+            ltermsField, lfields = lsearchIndex
+            lmodelClass = aRestHandler.GetModelClass()
+            for lmodel in aModels:
+                if isinstance(lmodel, lmodelClass):
+                    lterms = sleepysearch.Terms([getattr(lmodel, lfield) for lfield in lfields])
+                    if list(getattr(lmodel, ltermsField) or []) != lterms:
+                        setattr(lmodel, ltermsField, lterms)
+                        retval.append(lmodel)
+        return retval
+
+    # a search ranks at most this many matches. Searches matching more should use more words.
+    MAXSEARCHRESULTS = 1000
+
+    # query string arguments that make no sense for searches
+    SEARCHREJECTEDARGS = ["cursor", "since", "order_by"]
+
+    @classmethod
+    def GetQueryWordsArg(cls, aRestHandler):
+        """
+        Checks the arguments of a collection GET with ?q=, and returns the words to search for. See ReturnSearch
+        """
+        if not cls.GetSearchIndex(aRestHandler):
+            raise ValueError("search is not supported for this resource")
+        for lname in cls.SEARCHREJECTEDARGS:
+            if aRestHandler.request.get(lname):
+                raise ValueError("%s is not supported for searches" % lname)
+        return sleepysearch.QueryWords(aRestHandler.request.get("q"))
+
+    @classmethod
+    def ReturnSearch(cls, aRestHandler, aModelClass, aTemplate, *args, **kwargs):
+        """
+        Runs a search for a collection GET with ?q=, and returns the matches, best first. See GetSearchIndex
+        
+        A match has all the words in q. Filters, fields and limit work as for any collection GET, though only 
+        equality filters can be combined with a search without a composite index. Results are ranked by 
+        sleepysearch.Score, so they can't be ordered or paged. At most MAXSEARCHRESULTS matches are ranked; if
+        there are more, X-Sleepy-Search-Truncated is set and the rest are left out.
+        """
+        ltermsField, lfields = cls.GetSearchIndex(aRestHandler)
+        lquery = aRestHandler.request.get("q")
+        lwords = cls.GetQueryWordsArg(aRestHandler)
+        llimit = cls.GetLimitArg(aRestHandler)
+
+        lfilters, _ = cls.GetFiltersAndOrders(aRestHandler, aModelClass)
+
+        lstorage = cls.GetStorage(aRestHandler)
+        lqry = lstorage.Query(aModelClass, aAncestor = cls.GetOwnerKey(aRestHandler, *args, **kwargs))
+
+        if cls.MethodExists(aRestHandler, "ModifyQuery"):
+            lqry = aRestHandler.ModifyQuery(lqry, *args, **kwargs)
+
+        for lfield, loperator, lvalue in lfilters:
+            lqry = lstorage.Filter(aModelClass, lqry, lfield, loperator, lvalue)
+        for lword in lwords:
+            lqry = lstorage.Filter(aModelClass, lqry, ltermsField, "=", lword)
+
+        lstate = {}
+        lmatches = list(cls.FetchPages(aModelClass, lqry, cls.MAXSEARCHRESULTS, None, lstate, lstorage))
+        if cls.MethodExists(aRestHandler, "IsAuthorized"):
+            lmatches = [lmodel for lmodel in lmatches if aRestHandler.IsAuthorized(lmodel, *args, **kwargs)]
+
+        # sort is stable, so equal scores stay in key order
+        lmatches.sort(key = lambda lmodel: -sleepysearch.Score(lquery, lwords, [getattr(lmodel, lfield) for lfield in lfields]))
+        if llimit:
+            lmatches = lmatches[:llimit]
+
+        if lstate.get("more"):
+            aRestHandler.response.headers["X-Sleepy-Search-Truncated"] = "true"
+
+        lencode = SleepyStats.Timed("serialize", cls.GetCodec(aModelClass, aTemplate).Encode)
+        cls.ReturnJsonableStream(aRestHandler, (lencode(lmodel) for lmodel in lmatches))
+
+    @classmethod
+    def BackfillSearchTerms(cls, aRestHandlerClass, aCursor = None, *args, **kwargs):
+        """
+        Sets the search terms of every entity of a searchable handler (see GetSearchIndex), for entities written
+        before it was searchable, or before its terms changed. Run with deferred.
+        
+        Does a page of MAXBATCHSIZE entities, across all owners, writing those whose terms change, then defers
+        itself for the next. Writes go through CommitChanges, so they invalidate the cache, and as they update
+        modified, clients' next delta syncs fetch the entities again.
+        """
+        lrestHandler = cls.MakeTaskHandler(aRestHandlerClass, None)
+        lmodelClass = lrestHandler.GetModelClass()
+        lstorage = cls.GetStorage(lrestHandler)
+
+        lqry = lstorage.Query(lmodelClass)
+        if cls.MethodExists(lrestHandler, "ModifyQuery"):
+            lqry = lrestHandler.ModifyQuery(lqry, *args, **kwargs)
+
+        lmodels, lcursor, lmore = cls.Wait(lstorage.FetchPageAsync(lqry, cls.MAXBATCHSIZE, aCursor))
+
+        lchangedModels = cls.SetSearchTerms(lrestHandler, lmodels)
+        if lchangedModels:
+            cls.CommitChanges(lrestHandler, lchangedModels, [])
+
+        if lmore and lmodels:
+            deferred.defer(cls.BackfillSearchTerms, aRestHandlerClass, lcursor, *args, **kwargs)
+
+    # how long tombstones are kept for. Clients which haven't synced for longer than this get the full collection.
+    TOMBSTONEMAXAGE = datetime.timedelta(days = 30)
+
+    # watermarks are set this far in the past, so that entities written just before a sync, but not yet
+    # visible to queries, are picked up by the next one. Clients will see some entities twice.
+    SYNCOVERLAP = datetime.timedelta(seconds = 5)
+
+    @classmethod
+    def UseDeltaSync(cls, aRestHandler):
+        """
+        Handlers opt in to delta syncs (GET ?since=) by implementing UseDeltaSync() to return True.
+        
+        This makes deletes leave tombstones, and needs the model class to have an auto_now DateTimeProperty.
+        """
+        return cls.MethodExists(aRestHandler, "UseDeltaSync") and aRestHandler.UseDeltaSync()
+
+    @classmethod
+    def GetSinceArg(cls, aRestHandler, aModelClass, aTemplate):
+        """
+        Checks the arguments of a collection GET with ?since=, and returns since parsed. See ReturnDelta
+        """
+        if not cls.UseDeltaSync(aRestHandler):
+            raise ValueError("since is not supported for this resource")
+
+        lfilters, lorders = cls.GetFiltersAndOrders(aRestHandler, aModelClass)
+        if lfilters or lorders:
+            # a filtered delta couldn't report entities which have changed so as to no longer match
+            raise ValueError("since can't be combined with filters or order_by")
+
+        if not cls.GetCodec(aModelClass, aTemplate).versionKey:
+            raise ValueError("since requires the model to have an auto_now DateTimeProperty")
+
+        try:
+            return cls.ParseDateTimeString(aRestHandler.request.get("since"))
+        except ValueError:
+            raise ValueError("since must be a datetime, as returned in watermark")
+
+    @classmethod
+    def ReturnDelta(cls, aRestHandler, aModelClass, aTemplate, *args, **kwargs):
+        """
+        Handles a collection GET with ?since=<datetime>, returning only what has changed since then:
+        
+        {
+            "items": [entities modified after since],
+            "deleted": [ids of entities deleted after since],
+            "watermark": datetime to pass as since next time,
+            "more": true if there are more changes to fetch now,
+            "full": true if since was too long ago to be able to report deletes
+        }
+        
+        If "full" is true, "items" is the whole collection, and the client should throw away anything else it has.
+        
+        ?limit= restricts the number of items returned, as for a normal collection GET.
+        """
+        lcodec = cls.GetCodec(aModelClass, aTemplate)
+        lsince = cls.GetSinceArg(aRestHandler, aModelClass, aTemplate)
+
+        lnow = datetime.datetime.utcnow()
+        lfull = lsince < lnow - cls.TOMBSTONEMAXAGE
+        lwatermark = max(lsince, lnow - cls.SYNCOVERLAP)
+
+        # a full response can't be paged by modified time, because the next page might be older
+        # than the tombstones, so it just returns everything.
+        llimit = None
+        if not lfull:
+            llimit = cls.GetLimitArg(aRestHandler) or cls.MAXLIMIT
+
+        lownerKey = cls.GetOwnerKey(aRestHandler, *args, **kwargs)
+        lstorage = cls.GetStorage(aRestHandler)
+        lqry = lstorage.Query(aModelClass, aAncestor = lownerKey)
+
+        if cls.MethodExists(aRestHandler, "ModifyQuery"):
+            lqry = aRestHandler.ModifyQuery(lqry, *args, **kwargs)
+
+        if not lfull:
+            lqry = lstorage.Filter(aModelClass, lqry, lcodec.versionKey, ">", lsince)
+        lqry = lstorage.Order(aModelClass, lqry, lcodec.versionKey)
+
+        lisAuthorizedMethod = None
+        if cls.MethodExists(aRestHandler, "IsAuthorized"):
+            lisAuthorizedMethod = aRestHandler.IsAuthorized
+
+        lmore = False
+        ldeletedIds = []
+
+        if lfull:
+            lresults = cls.FetchPages(aModelClass, lqry, aBackend = lstorage)
+        else:
+            # ask for the tombstones and the page of items together, so the two queries overlap.
+            # here we can afford to hold them in memory; they're bounded by MAXLIMIT and llimit
+            ltombstoneBackend = GetBackend(SleepyTombstone)
+            ltombstoneQry = ltombstoneBackend.Query(SleepyTombstone, aAncestor = ToNdbKey(lownerKey))
+            ltombstoneQry = ltombstoneBackend.Filter(SleepyTombstone, ltombstoneQry, "kind_name", "=", lstorage.Kind(aModelClass))
+            ltombstoneQry = ltombstoneBackend.Filter(SleepyTombstone, ltombstoneQry, "deleted", ">", lsince)
+            ltombstoneQry = ltombstoneBackend.Filter(SleepyTombstone, ltombstoneQry, "deleted", "<=", lwatermark)
+            ltombstoneQry = ltombstoneBackend.Order(SleepyTombstone, ltombstoneQry, "deleted")
+            ltombstonesFuture = ltombstoneBackend.FetchPageAsync(ltombstoneQry, cls.MAXLIMIT)
+
+            lresults = cls.Wait(lstorage.FetchPageAsync(lqry, llimit))[0]
+            if len(lresults) >= llimit:
+                # there's more to come. Resume just before the last one we've got, in case others share its time.
+                lmore = True
+                lwatermark = getattr(lresults[-1], lcodec.versionKey) - datetime.timedelta(microseconds = 1)
+
+            ltombstones = cls.Wait(ltombstonesFuture)[0]
+            if len(ltombstones) >= cls.MAXLIMIT:
+                lmore = True
+                lwatermark = min(lwatermark, ltombstones[-1].deleted - datetime.timedelta(microseconds = 1))
+            ldeletedIds = [ltombstone.entity_id for ltombstone in ltombstones if ltombstone.deleted <= lwatermark]
+
+        lencode = SleepyStats.Timed("serialize", lcodec.Encode)
+
+        def lresultsJsonable():
+            for lmodel in lresults:
+                if (lisAuthorizedMethod is None) or lisAuthorizedMethod(lmodel, *args, **kwargs):
+                    yield lencode(lmodel)
+
+        lheaderJson = cls.JsonableToJson({
+            "deleted": ldeletedIds,
+            "watermark": sleepycodec.FormatDateOrDateTime(lwatermark),
+            "more": lmore,
+            "full": lfull
+        }, cls.IsPretty(aRestHandler))
+
+        # open up the object to stream the items in as its last member
+        aRestHandler.response.headers["Content-Type"] = cls.JSONCONTENTTYPE
+        aRestHandler.response.out.write(lheaderJson.rstrip()[:-1].rstrip())
+        aRestHandler.response.out.write(',"items":')
+        cls.ReturnJsonableStream(aRestHandler, lresultsJsonable())
+        aRestHandler.response.out.write("}")
+
+    @classmethod
+    def CollectTombstones(cls, aCursor = None):
+        """
+        Deletes tombstones older than TOMBSTONEMAXAGE, in batches. 
+        
+        Run it regularly, eg: from cron. It continues itself with deferred until there are none left.
+        
+        Each batch is deleted, so each run queries from the start again; a cursor would belong to a query 
+        with an earlier cut off. aCursor is ignored, it's only accepted for tasks queued before this.
+        """
+        lbackend = GetBackend(SleepyTombstone)
+        lqry = lbackend.Query(SleepyTombstone, aKeysOnly = True)
+        lqry = lbackend.Filter(SleepyTombstone, lqry, "deleted", "<", datetime.datetime.utcnow() - cls.TOMBSTONEMAXAGE)
+        lkeys, _, _ = lbackend.FetchPageAsync(lqry, cls.MAXBATCHSIZE, None).get_result()
+        if lkeys:
+            lbackend.DeleteMultiAsync(lkeys).get_result()
+        if len(lkeys) >= cls.MAXBATCHSIZE:
+            deferred.defer(cls.CollectTombstones)
+
+    @classmethod
+    def PutHandler(cls, aRestHandler, aResource, aResourceArg, *args, ** kwargs):
+        try:
+            cls.CheckMethodExists(aRestHandler, "GetModelClass", "Rest Handler must include a method GetModelClass()")                
+
+            lmodelClass = aRestHandler.GetModelClass()
+            
+            if not lmodelClass:
+                raise ValueError("GetModelClass() must not return None")
+
+            ltemplate = None
+            if cls.MethodExists(aRestHandler, "GetTemplate"):
+                ltemplate = aRestHandler.GetTemplate()
+
+            if aResourceArg:
+                cls.UpdateHandler(aRestHandler, lmodelClass, ltemplate, aResourceArg, False, *args, **kwargs)
+            elif cls.UseBulkOperations(aRestHandler):
+                cls.BulkHandler(aRestHandler, lmodelClass, ltemplate, "update", *args, **kwargs)
+            else:
+                raise KeyError("id is required")
+        except Exception, ex:
+            logging.exception(ex)
+            cls.ReturnException(aRestHandler, ex)        
+
+    @classmethod
+    def PatchHandler(cls, aRestHandler, aResource, aResourceArg, *args, ** kwargs):
+        try:
+            cls.CheckMethodExists(aRestHandler, "GetModelClass", "Rest Handler must include a method GetModelClass()")                
+
+            lmodelClass = aRestHandler.GetModelClass()
+            
+            if not lmodelClass:
+                raise ValueError("GetModelClass() must not return None")
+
+            ltemplate = None
+            if cls.MethodExists(aRestHandler, "GetTemplate"):
+                ltemplate = aRestHandler.GetTemplate()
+
+            if aResourceArg:
+                cls.UpdateHandler(aRestHandler, lmodelClass, ltemplate, aResourceArg, True, *args, **kwargs)
+            else:
+                raise KeyError("id is required")
+        except Exception, ex:
+            logging.exception(ex)
+            cls.ReturnException(aRestHandler, ex)        
+
+    @classmethod
+    def UpdateHandler(cls, aRestHandler, aModelClass, aTemplate, aIdArg, aPatch, *args, **kwargs):
+        """
+        Updates one entity from the request body, for PUT <id> (aPatch False) and PATCH <id> (aPatch True).
+        
+        Either way only the fields in the body are applied. If none of them changes the entity, nothing is 
+        written: no put, no index writes, no new modified time, no cache invalidation.
+        
+        PUT responds with the whole entity. PATCH responds with just its id and the fields that changed (plus
+        the model's auto_now field, if it has one in the template and there was a write), so a client can keep
+        its copy up to date. With a "Prefer: return=minimal" header, either responds 204 with no body.
+        
+        The entity is read and written in one transaction, so a concurrent write can't slip in between, whether
+        or not there's an If-Match header; otherwise counters (see GetCounters) could drift.
+        """
+        lId = cls.ParseId(aIdArg)
+
+        lincomingJsonable = cls.GetIncomingJsonable(aRestHandler)
+
+        cls.CheckMethodExists(aModelClass, "get_by_id", "Class returned by GetModelClass() must support get_by_id")
+        
+        lstorage = cls.GetStorage(aRestHandler)
+        lownerKey = cls.GetOwnerKey(aRestHandler, *args, **kwargs)
+        lcodec = cls.GetCodec(aModelClass, aTemplate)
+        lifMatch = aRestHandler.request.headers.get("If-Match")
+
+        def lupdate():
+            # read inside the transaction, so the counter snapshot, the If-Match check and the write are atomic
+            lupdateModel = cls.Wait(lstorage.GetByIdAsync(aModelClass, lId, lownerKey))
+
+            if lupdateModel and cls.MethodExists(aRestHandler, "IsAuthorized"): 
+                if not aRestHandler.IsAuthorized(lupdateModel, *args, **kwargs):
+                    lupdateModel = None
+
+            if not lupdateModel:
+                return None, [], [], []
+
+            cls.SnapshotCounters(aRestHandler, [lupdateModel])
+            if lifMatch and not cls.ETagMatches(lifMatch, lcodec.ETag(lupdateModel)):
+                raise PreconditionFailed("entity has been modified")
+
+            lchanged = []
+            lsavemodels, ldeletemodels = cls.JsonableToModel(lincomingJsonable, lupdateModel, aTemplate, lchanged)
+
+            if not lchanged and not ldeletemodels and len(lsavemodels) <= 1:
+                # nothing has changed, so there's nothing to write
+                return lupdateModel, [], [], lchanged
+
+            if cls.MethodExists(lupdateModel, "DecorateModel"):
+                lsavemodels = map(lupdateModel.DecorateModel, lsavemodels)
+            
+            cls.WriteChanges(aRestHandler, lsavemodels, ldeletemodels)
+            return lupdateModel, lsavemodels, ldeletemodels, lchanged
+
+        lmodel, lsavemodels, ldeletemodels, lchanged = lstorage.RunInTransaction(lupdate)
+
+        if lmodel:
+            lwritten = bool(lsavemodels or ldeletemodels)
+            if lwritten:
+                cls.ChangesWritten(aRestHandler, lsavemodels, ldeletemodels)
+
+            cls.ReturnUpdated(aRestHandler, aModelClass, aTemplate, lmodel, lchanged, lwritten, aPatch)
+        else:
+            cls.ReturnNotFound(aRestHandler)
+
+    @classmethod
+    def ReturnUpdated(cls, aRestHandler, aModelClass, aTemplate, aModel, aChanged, aWritten, aPatch):
+        """
+        The response to an update of aModel, see UpdateHandler. aChanged is the fields that changed, aWritten
+        whether it was written.
+        """
+        lcodec = cls.GetCodec(aModelClass, aTemplate)
+
+        if cls.UseETags(aRestHandler):
+            aRestHandler.response.headers["ETag"] = lcodec.ETag(aModel)
+
+        if cls.PrefersMinimal(aRestHandler):
+            aRestHandler.response.headers["Preference-Applied"] = "return=minimal"
+            aRestHandler.response.set_status(204)
+            cls.ReturnNone(aRestHandler)
+        elif aPatch:
+            lfields = set(aChanged)
+            if aWritten and lcodec.versionKey in lcodec.fields:
+                lfields.add(lcodec.versionKey)
+            lresultJsonable = SleepyStats.Timed("serialize", cls.GetCodec(aModelClass, dict.fromkeys(lfields)).Encode)(aModel) \
+                                if lfields else {"id": GetBackend(aModelClass).Id(aModel)}
+            cls.ReturnJsonable(aRestHandler, lresultJsonable)
+        else:
+            lresultJsonable = SleepyStats.Timed("serialize", lcodec.Encode)(aModel)
+            cls.ReturnJsonable(aRestHandler, lresultJsonable)
+
+    @classmethod
+    def UseListStorage(cls, aRestHandler):
+        """
+        Handlers keep each owner's whole collection as one document, rather than as an entity per item, by
+        implementing UseListStorage() to return True. Their entities are then stored by sleepylist.ListBackend,
+        rather than their model class's backend (see GetStorage), and everything else works as it does for
+        entities: the rest API, tombstones, counters, search terms, ranks, jobs and tasks.
+
+        Reading the whole list is one get, where entity storage runs a query, but every write rewrites the list,
+        in a transaction. So collection reads get much cheaper, writes get dearer as the list grows, and as a
+        list is one entity group it takes about one write a second. That suits lists of up to a few hundred
+        small items, read far more often than written. benchmarks/list_bench.py compares the two storages.
+
+        Underneath:
+
+        - a list is made from the owner's existing entities when it's first read, so switching a handler to list
+          storage keeps what it had. The entities themselves are left as they were.
+        - items are never put, so datastore hooks don't run; the list sets auto_now and auto_now_add properties
+        - queries without an owner, which tasks run across every owner, read every list of the kind in turn, and
+          are only ordered within each list
+
+        The model class must be an ndb one whose properties are all of types Sleepy converts, and handlers with
+        ModifyQuery can't use list storage, as there's no datastore query for it to change (see CheckListStorage).
+        """
+        return cls.MethodExists(aRestHandler, "UseListStorage") and aRestHandler.UseListStorage()
+
+    @classmethod
+    def CheckListStorage(cls, aRestHandler, aModelClass):
+        """
+        Raises TypeError if the handler can't use list storage. See UseListStorage
+        """
+        if GetBackend(aModelClass) is not NdbBackend:
+            raise TypeError("list storage needs an ndb model class")
+        if cls.MethodExists(aRestHandler, "ModifyQuery"):
+            raise TypeError("list storage is not supported for handlers with ModifyQuery")
+        for lname, lprop in NdbBackend.Properties(aModelClass).items():
+            if not type(lprop) in NdbBackend.SUPPORTEDTYPES and not isinstance(lprop, ndb.ComputedProperty):
+                raise TypeError("list storage can't keep %s, a %s" % (lname, type(lprop).__name__))
+
+    @classmethod
+    def GetStorage(cls, aRestHandler):
+        """
+        The backend which stores the handler's entities: its model class's (see sleepybackend.GetBackend), or
+        ListBackend if it uses list storage (see UseListStorage). Everything Sleepy reads and writes of them goes
+        through it; Sleepy's own entities (tombstones, counters, jobs) always use ndb.
+
+        It's worked out once per handler instance. Deferred tasks can set it with MakeTaskHandler.
+        """
+        if not hasattr(aRestHandler, "_sleepyStorage"):
+            lmodelClass = aRestHandler.GetModelClass()
+            lstorage = GetBackend(lmodelClass)
+            if cls.UseListStorage(aRestHandler):
+                cls.CheckListStorage(aRestHandler, lmodelClass)
+                lstorage = ListBackend
+            aRestHandler._sleepyStorage = lstorage
+        return aRestHandler._sleepyStorage
+
+    @classmethod
+    def PrefersMinimal(cls, aRestHandler):
+        """
+        True if the caller sent "Prefer: return=minimal", asking for no body in the response.
+        """
+        for lpreference in aRestHandler.request.headers.get("Prefer", "").split(","):
+            if lpreference.split(";")[0].strip().replace(" ", "") == "return=minimal":
+                return True
+        return False
+
+    @classmethod
+    def PostHandler(cls, aRestHandler, aResource, aResourceArg, *args, ** kwargs):
+        try:
+            cls.CheckMethodExists(aRestHandler, "GetModelClass", "Rest Handler must include a method GetModelClass()")                
+
+            lmodelClass = aRestHandler.GetModelClass()
+            
+            if not lmodelClass:
+                raise ValueError("GetModelClass() must not return None")
+
+            ltemplate = None
+            if cls.MethodExists(aRestHandler, "GetTemplate"):
+                ltemplate = aRestHandler.GetTemplate()
+
+            if aResourceArg == "_batch":
+                cls.BatchHandler(aRestHandler, lmodelClass, ltemplate, *args, **kwargs)
+            elif aResourceArg == "_import":
+                cls.ImportHandler(aRestHandler, lmodelClass, ltemplate, *args, **kwargs)
+            elif aResourceArg and aResourceArg.endswith("/move"):
+                cls.MoveHandler(aRestHandler, lmodelClass, ltemplate, aResourceArg[:-len("/move")], *args, **kwargs)
+            elif aResourceArg:
+                raise KeyError("no arguments accepted for POST")
+            else:
+                lincomingJsonable = cls.GetIncomingJsonable(aRestHandler)
+
+                lmodel = cls.NewModel(aRestHandler, lmodelClass, *args, **kwargs)
+                
+                lsaveanddeletearrays = cls.JsonableToModel(lincomingJsonable, lmodel, ltemplate)
+
+                lsavemodels = lsaveanddeletearrays[0]
+                ldeletemodels = lsaveanddeletearrays[1]
+
+                cls.AssignRanks(aRestHandler, lmodelClass, [lmodel], *args, **kwargs)
+
+                if cls.MethodExists(lmodel, "DecorateModel"):
+                    lsavemodels = map(lmodel.DecorateModel, lsavemodels)
+                
+                cls.CommitChanges(aRestHandler, lsavemodels, ldeletemodels)
+
+                lcodec = cls.GetCodec(lmodelClass, ltemplate)
+
+                if cls.UseETags(aRestHandler):
+                    aRestHandler.response.headers["ETag"] = lcodec.ETag(lmodel)
+
+                lresultJsonable = SleepyStats.Timed("serialize", lcodec.Encode)(lmodel)
+                
+                cls.ReturnJsonable(aRestHandler, lresultJsonable)
+        except Exception, ex:
+            logging.exception(ex)
+            cls.ReturnException(aRestHandler, ex)        
+
+    @classmethod
+    def DeleteHandler(cls, aRestHandler, aResource, aResourceArg, *args, ** kwargs):
+        try:
+            cls.CheckMethodExists(aRestHandler, "GetModelClass", "Rest Handler must include a method GetModelClass()")                
+
+            lmodelClass = aRestHandler.GetModelClass()
+            
+            if not lmodelClass:
+                raise ValueError("GetModelClass() must not return None")
+
+            if aResourceArg:
+                lId = None
+                try:
+                    lId = int(aResourceArg)
+                except:
+                    raise ValueError("id must be an integer")
+
+                cls.CheckMethodExists(lmodelClass, "get_by_id", "Class returned by GetModelClass() must support get_by_id")
+                
+                lstorage = cls.GetStorage(aRestHandler)
+                lownerKey = cls.GetOwnerKey(aRestHandler, *args, **kwargs)
+
+                def ldelete():
+                    # read inside the transaction, so what's uncounted is what's deleted
+                    lmodel = cls.Wait(lstorage.GetByIdAsync(lmodelClass, lId, lownerKey))
+
+                    if lmodel and cls.MethodExists(aRestHandler, "IsAuthorized"): 
+                        if not aRestHandler.IsAuthorized(lmodel, *args, **kwargs):
+                            lmodel = None
+
+                    ldeletemodels = []
+                    if lmodel:
+                        ldeletemodels = cls.GetDeleteList(lmodel)
+                        cls.WriteChanges(aRestHandler, [], ldeletemodels)
+                    return ldeletemodels
+
+                ldeletemodels = lstorage.RunInTransaction(ldelete)
+                    
+                if ldeletemodels:
+                    cls.ChangesWritten(aRestHandler, [], ldeletemodels)
+
+                    cls.ReturnNone(aRestHandler)
+                else:
+                    cls.ReturnNotFound(aRestHandler)
+            elif cls.UseBulkOperations(aRestHandler):
+                ltemplate = None
+                if cls.MethodExists(aRestHandler, "GetTemplate"):
+                    ltemplate = aRestHandler.GetTemplate()
+                cls.BulkHandler(aRestHandler, lmodelClass, ltemplate, "delete", *args, **kwargs)
+            else:
+                raise KeyError("id is required")
+        except Exception, ex:
+            logging.exception(ex)
+            cls.ReturnException(aRestHandler, ex)
+
+    # most operations (reads plus writes) accepted by one POST to the _batch resource.
+    # datastore puts and deletes take at most 500 entities per call.
+    MAXBATCHSIZE = 500
+
+    @classmethod
+    def BatchHandler(cls, aRestHandler, aModelClass, aTemplate, *args, **kwargs):
+        """
+        Handles POST to the special _batch resource, eg: POST /todos/_batch
+        
+        The body is a Jsonable like this:
+        
+        {
+            "read": [1, 2, 3],
+            "ops": [
+                {"method": "create", "data": {...}},
+                {"method": "update", "id": 4, "data": {...}},
+                {"method": "delete", "id": 5}
+            ]
+        }
+        
+        All ids mentioned are resolved with one datastore get, then all writes are applied with one put and
+        one delete, which run concurrently. IsAuthorized, DecorateModel and GetDeleteList are respected as for the single item handlers.
+        
+        The response contains the entities named in "read" (as they are after the writes, None if not found),
+        and a result per op, in order, each with an http style "status" and either "data" or "error".
+        An op that fails changes nothing.
+        """
+        lincomingJsonable = cls.GetIncomingJsonable(aRestHandler)
+        if not isinstance(lincomingJsonable, dict):
+            raise ValueError("batch body must be an object")
+
+        lreadIds = lincomingJsonable.get("read") or []
+        lops = lincomingJsonable.get("ops") or []
+        if not isinstance(lreadIds, list) or not isinstance(lops, list):
+            raise ValueError("read and ops must be lists")
+        if len(lreadIds) + len(lops) > cls.MAXBATCHSIZE:
+            raise ValueError("at most %s reads and ops are allowed per batch" % cls.MAXBATCHSIZE)
+
+        lreadIds = [cls.ParseId(lid) for lid in lreadIds]
+
+        # gather every id referenced, so we can get them all in one go.
+        lids = set(lreadIds)
+        for lop in lops:
+            if isinstance(lop, dict) and lop.get("method") in ["update", "delete"]:
+                try:
+                    lids.add(cls.ParseId(lop.get("id")))
+                except ValueError:
+                    pass # reported against the op below
+
+        lmodelsById = cls.GetModelsById(aRestHandler, aModelClass, lids, *args, **kwargs)
+        lbackend = GetBackend(aModelClass)
+
+        lresults = []
+        lsaves = [] # triples of result index, model, list of models to put
+        ldeletemodels = []
+        lcreatedModels = []
+        
+        for lop in lops:
+            try:
+                if not isinstance(lop, dict):
+                    raise ValueError("op must be an object")
+
+                lmethod = lop.get("method")
+                if lmethod in ["create", "update"]:
+                    # fail on a fresh model first, so a bad op can't leave another op's model half changed
+                    cls.JsonableToModel(lop.get("data"), aModelClass(), aTemplate)
+
+                if lmethod == "create":
+                    lmodel = cls.NewModel(aRestHandler, aModelClass, *args, **kwargs)
+                    lcreatedModels.append(lmodel)
+                elif lmethod in ["update", "delete"]:
+                    lmodel = lmodelsById.get(cls.ParseId(lop.get("id")))
+                else:
+                    raise ValueError("method must be one of create, update, delete")
+
+                if lmethod == "create" or lmodel:
+                    if lmethod == "delete":
+                        ldeletemodels.extend(cls.GetDeleteList(lmodel))
+                        del lmodelsById[lbackend.Id(lmodel)]
+                        # if an earlier op in this batch updated the model, it mustn't be saved now
+                        lsaves = [(lindex, lsavemodel, [lsave for lsave in lsavemodels if lsave is not lmodel])
+                                    for lindex, lsavemodel, lsavemodels in lsaves]
+                        lresults.append({"status": 200})
+                    else:
+                        lsaveanddeletearrays = cls.JsonableToModel(lop.get("data"), lmodel, aTemplate)
+    
+                        lsavemodels = lsaveanddeletearrays[0]
+                        ldeletemodels.extend(lsaveanddeletearrays[1])
+    
+                        if cls.MethodExists(lmodel, "DecorateModel"):
+                            lsavemodels = map(lmodel.DecorateModel, lsavemodels)
+
+                        lsaves.append((len(lresults), lmodel, lsavemodels))
+                        lresults.append({"status": 200})
+                else:
+                    lresults.append({"status": 404})
+            except Exception, ex:
+                lresults.append({"status": 400, "error": "%s: %s" % (ex.__class__.__name__, str(ex))})
+
+        lsavemodels = []
+        for _, _, lmodels in lsaves:
+            lsavemodels.extend(lmodels)
+
+        # new models go on the end of the list, in the order they were created
+        cls.AssignRanks(aRestHandler, aModelClass, lcreatedModels, *args, **kwargs)
+
+        cls.CommitChanges(aRestHandler, lsavemodels, ldeletemodels)
+
+        for lindex, lmodel, lmodels in lsaves:
+            if [lsave for lsave in lmodels if lsave is lmodel]:
+                lresults[lindex]["data"] = cls.ModelToJsonable(lmodel, aTemplate)
+            else:
+                # deleted again later in the batch
+                lresults[lindex] = {"status": 404}
+
+        lresultJsonable = {
+            "read": [cls.ModelToJsonable(lmodelsById.get(lid), aTemplate) for lid in lreadIds],
+            "results": lresults
+        }
+        
+        cls.ReturnJsonable(aRestHandler, lresultJsonable)
+
+    @classmethod
+    def UseBulkOperations(cls, aRestHandler):
+        """
+        Handlers allow DELETE and PUT on the whole collection by implementing UseBulkOperations() to return True.
+        See BulkHandler
+        """
+        return cls.MethodExists(aRestHandler, "UseBulkOperations") and aRestHandler.UseBulkOperations()
+
+    # query string arguments that make no sense for bulk operations
+    BULKREJECTEDARGS = ["limit", "cursor", "since", "order_by", "q"]
+
+    @classmethod
+    def BulkHandler(cls, aRestHandler, aModelClass, aTemplate, aOperation, *args, **kwargs):
+        """
+        Starts a bulk operation on everything in the collection matching the query string's filters (see 
+        GetFiltersAndOrders), eg:
+        
+        DELETE /todos?done=true
+        PUT /todos?done=false with a body of {"done": true}
+        
+        aOperation is "delete" or "update". Updates apply the body to each entity, as PUT <id> does.
+        
+        The work is done by a deferred task (see RunBulkJob), so this takes the same time however many entities
+        match. It returns 202 with the job (see JobToJsonable); clients poll <resource>/_jobs/<id> for progress.
+        
+        The task has no request, so handlers which implement IsAuthorized can't use bulk operations, and 
+        ModifyQuery only gets the route's arguments. It works on the caller's owner's entities (see GetOwnerKey).
+        """
+        if cls.MethodExists(aRestHandler, "IsAuthorized"):
+            raise KeyError("bulk operations are not supported for handlers with IsAuthorized")
+
+        lfilters, lincomingJsonable = cls.GetBulkArgs(aRestHandler, aModelClass, aTemplate, aOperation)
+
+        lownerKey = cls.GetOwnerKey(aRestHandler, *args, **kwargs)
+        ljob = SleepyJob(parent = ToNdbKey(lownerKey), kind_name = GetBackend(aModelClass).Kind(aModelClass), 
+                         operation = aOperation, status = "running")
+        ljob.put()
+        cls.DeferBulkPage(type(aRestHandler), lownerKey, ljob.key.id(), lfilters, lincomingJsonable, None, *args, **kwargs)
+
+        aRestHandler.response.set_status(202)
+        aRestHandler.response.headers["Location"] = "%s/_jobs/%s" % (aRestHandler.request.path.rstrip("/"), ljob.key.id())
+        cls.ReturnJsonable(aRestHandler, cls.JobToJsonable(ljob))
+
+    @classmethod
+    def GetBulkArgs(cls, aRestHandler, aModelClass, aTemplate, aOperation):
+        """
+        Checks the arguments of a bulk operation, and returns a pair: its filters, and for updates the body (None
+        for deletes). See BulkHandler
+        """
+        for lname in cls.BULKREJECTEDARGS:
+            if aRestHandler.request.get(lname):
+                raise ValueError("%s is not supported for bulk operations" % lname)
+
+        lfilters, _ = cls.GetFiltersAndOrders(aRestHandler, aModelClass)
+        if not lfilters:
+            raise ValueError("bulk operations need at least one filter")
+
+        lincomingJsonable = None
+        if aOperation == "update":
+            lincomingJsonable = cls.GetIncomingJsonable(aRestHandler)
+            if not isinstance(lincomingJsonable, dict):
+                raise ValueError("update body must be an object")
+            # fail now, rather than part way through, if the body doesn't fit the model
+            cls.JsonableToModel(lincomingJsonable, aModelClass(), aTemplate)
+
+        return lfilters, lincomingJsonable
+
+    @classmethod
+    def RunBulkJob(cls, aRestHandlerClass, aOwnerKey, aJobId, aFilters, aJsonable, aCursor, *args, **kwargs):
+        """
+        Does one page (MAXBATCHSIZE entities) of a bulk operation started by BulkHandler, then defers itself
+        for the next. The page's keys come from a keys only query, the entities from one get, and the changes 
+        are written with CommitChanges, so they leave tombstones, update counters and invalidate the cache 
+        as any other write does.
+        
+        Tasks can run more than once, so the job keeps its place: the ids of the page being worked on are 
+        saved before it's written, and the cursor after it once it's committed. A retry before the commit 
+        redoes the same ids (entities are reread, so counters see what's already been written); a retry after
+        it finds the page done and just queues the next, which is named so it's only queued once.
+        """
+        ljob = SleepyJob.get_by_id(aJobId, parent = ToNdbKey(aOwnerKey))
+        if not ljob or ljob.status != "running":
+            return
+
+        if ljob.cursor != aCursor:
+            # this page was committed by an earlier run of this task
+            cls.DeferBulkPage(aRestHandlerClass, aOwnerKey, aJobId, aFilters, aJsonable, ljob.cursor, *args, **kwargs)
+            return
+
+        lrestHandler = cls.MakeTaskHandler(aRestHandlerClass, aOwnerKey)
+        lmodelClass = lrestHandler.GetModelClass()
+        lstorage = cls.GetStorage(lrestHandler)
+        ltemplate = None
+        if cls.MethodExists(lrestHandler, "GetTemplate"):
+            ltemplate = lrestHandler.GetTemplate()
+
+        if ljob.page_ids is None:
+            lqry = lstorage.Query(lmodelClass, aKeysOnly = True, aAncestor = aOwnerKey)
+            if cls.MethodExists(lrestHandler, "ModifyQuery"):
+                lqry = lrestHandler.ModifyQuery(lqry, *args, **kwargs)
+            for lfield, loperator, lvalue in aFilters:
+                lqry = lstorage.Filter(lmodelClass, lqry, lfield, loperator, lvalue)
+
+            lkeys, lcursor, lmore = cls.Wait(lstorage.FetchPageAsync(lqry, cls.MAXBATCHSIZE, aCursor))
+            ljob.page_ids = [KeyIdOrName(lkey) for lkey in lkeys]
+            ljob.page_cursor = lcursor if lmore and lkeys else None
+            ljob.put()
+
+        lmodels = cls.GetModelsById(lrestHandler, lmodelClass, ljob.page_ids, *args, **kwargs).values()
+
+        try:
+            lsaveModels = []
+            ldeleteModels = []
+            for lmodel in lmodels:
+                if aJsonable is None:
+                    ldeleteModels.extend(cls.GetDeleteList(lmodel))
+                else:
+                    lmodelSaves, lmodelDeletes = cls.JsonableToModel(aJsonable, lmodel, ltemplate)
+                    if cls.MethodExists(lmodel, "DecorateModel"):
+                        lmodelSaves = map(lmodel.DecorateModel, lmodelSaves)
+                    lsaveModels.extend(lmodelSaves)
+                    ldeleteModels.extend(lmodelDeletes)
+        except Exception, ex:
+            # the data won't get any better by retrying
+            logging.exception(ex)
+            ljob.status = "failed"
+            ljob.error = "%s: %s" % (ex.__class__.__name__, str(ex))
+            ljob.put()
+            raise deferred.PermanentTaskFailure(str(ex))
+
+        if lsaveModels or ldeleteModels:
+            cls.CommitChanges(lrestHandler, lsaveModels, ldeleteModels)
+
+        # entities deleted by an earlier try of this page are gone now, but still count
+        ljob.processed += len(ljob.page_ids)
+        ljob.cursor = ljob.page_cursor
+        ljob.page_ids = None
+        ljob.page_cursor = None
+        if not ljob.cursor:
+            ljob.status = "done"
+        ljob.put()
+
+        if ljob.cursor:
+            cls.DeferBulkPage(aRestHandlerClass, aOwnerKey, aJobId, aFilters, aJsonable, ljob.cursor, *args, **kwargs)
+
+    @classmethod
+    def DeferBulkPage(cls, aRestHandlerClass, aOwnerKey, aJobId, aFilters, aJsonable, aCursor, *args, **kwargs):
+        """
+        Queues RunBulkJob for the page of a job starting at aCursor, unless it has been queued already.
+        """
+        lname = "sleepyjob-%s" % hashlib.md5("%s|%s|%s" % (KeyString(aOwnerKey), aJobId, aCursor)).hexdigest()
+        try:
+            deferred.defer(cls.RunBulkJob, aRestHandlerClass, aOwnerKey, aJobId, aFilters, aJsonable, aCursor, 
+                           _name = lname, *args, **kwargs)
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+
+    @classmethod
+    def ReturnJob(cls, aRestHandler, aKind, aOwnerKey, aJobIdArg):
+        """
+        Handles GET <resource>/_jobs/<id>, returning the job (see JobToJsonable), or 404 if the caller has no such job
+        """
+        ljob = None
+        try:
+            ljob = SleepyJob.get_by_id(int(aJobIdArg), parent = ToNdbKey(aOwnerKey))
+        except ValueError:
+            raise ValueError("job id must be an integer")
+        if ljob and ljob.kind_name == aKind:
+            cls.ReturnJsonable(aRestHandler, cls.JobToJsonable(ljob))
+        else:
+            cls.ReturnNotFound(aRestHandler)
+
+    @classmethod
+    def JobToJsonable(cls, aJob):
+        return {
+            "id": aJob.key.id(),
+            "operation": aJob.operation,
+            "status": aJob.status,
+            "processed": aJob.processed,
+            "error": aJob.error,
+            "created": sleepycodec.FormatDateOrDateTime(aJob.created) if aJob.created else None,
+            "modified": sleepycodec.FormatDateOrDateTime(aJob.modified) if aJob.modified else None
+        }
+
+    # most lines returned by one GET to the _export resource. Responses are buffered, so this bounds their size.
+    MAXEXPORTLINES = 10000
+
+    # query string arguments that make no sense for exports
+    EXPORTREJECTEDARGS = ["limit", "since", "q"]
+
+    @classmethod
+    def ExportHandler(cls, aRestHandler, aModelClass, aTemplate, *args, **kwargs):
+        """
+        Handles GET to the special _export resource, eg: GET /todos/_export
+        
+        Returns the collection as newline delimited json (one entity per line, encoded as for a GET), which 
+        POST _import reads back. Filters, order_by and fields work as for a collection GET.
+        
+        Entities are fetched a page at a time (see FetchPages) and written as they arrive, but the response is
+        buffered (see ReturnJsonableStream), so each one has at most MAXEXPORTLINES lines; if there may be more,
+        the X-Sleepy-Next-Cursor header has a cursor to pass as ?cursor= for the rest.
+        
+        Exports aren't cached, and don't use projection queries.
+        """
+        for lname in cls.EXPORTREJECTEDARGS:
+            if aRestHandler.request.get(lname):
+                raise ValueError("%s is not supported for exports" % lname)
+
+        lfilters, lorders = cls.GetFiltersAndOrders(aRestHandler, aModelClass)
+
+        lstorage = cls.GetStorage(aRestHandler)
+        lqry = lstorage.Query(aModelClass, aAncestor = cls.GetOwnerKey(aRestHandler, *args, **kwargs))
+
+        if cls.MethodExists(aRestHandler, "ModifyQuery"):
+            lqry = aRestHandler.ModifyQuery(lqry, *args, **kwargs)
+
+        for lfield, loperator, lvalue in lfilters:
+            lqry = lstorage.Filter(aModelClass, lqry, lfield, loperator, lvalue)
+        for lfield, ldescending in lorders:
+            lqry = lstorage.Order(aModelClass, lqry, lfield, ldescending)
+
+        lisAuthorizedMethod = None
+        if cls.MethodExists(aRestHandler, "IsAuthorized"):
+            lisAuthorizedMethod = aRestHandler.IsAuthorized
+
+        lstate = {}
+        lresults = cls.FetchPages(aModelClass, lqry, cls.MAXEXPORTLINES, aRestHandler.request.get("cursor"), lstate, lstorage)
+
+        lencode = SleepyStats.Timed("serialize", cls.GetCodec(aModelClass, aTemplate).Encode)
+
+        def lresultsJsonable():
+            for lmodel in lresults:
+                if (lisAuthorizedMethod is None) or lisAuthorizedMethod(lmodel, *args, **kwargs):
+                    yield lencode(lmodel)
+
+        cls.ReturnJsonLinesStream(aRestHandler, lresultsJsonable())
+
+        if lstate.get("more") and lstate.get("cursor"):
+            aRestHandler.response.headers["X-Sleepy-Next-Cursor"] = lstate["cursor"]
+
+    # an import stops at the first batch boundary after this many seconds, leaving time to respond before the
+    # request deadline. See ImportHandler
+    IMPORTTIMEBUDGET = 40
+
+    @classmethod
+    def ImportHandler(cls, aRestHandler, aModelClass, aTemplate, *args, **kwargs):
+        """
+        Handles POST to the special _import resource, eg: POST /todos/_import
+        
+        The body is newline delimited json, as GET _export returns. Each line creates a new entity (ids in 
+        the lines are ignored), decoded as for a POST; blank lines are skipped. Entities are written MAXBATCHSIZE 
+        at a time with CommitChanges, so they update counters and invalidate the cache as any other write does.
+        Ranks are kept as exported, so importing into a collection that already has entities interleaves them.
+        
+        The request holds the whole body in memory, but it's parsed a line at a time, so at most one batch of
+        entities is held at once. 
+        
+        An import is a job (see SleepyJob), which keeps its place on the server. One that runs out of time 
+        (IMPORTTIMEBUDGET) stops after the batch it's on, and the client resends the same body with ?job=<job> 
+        until the response says it's done:
+        
+        {"job": 12, "imported": 500, "line": 1000, "done": false}
+        
+        "imported" is the number of entities written by this request, "line" the number of lines done so far.
+        Resending is safe whether or not the last response arrived: a batch's ids are allocated and saved on the
+        job before it's written, so writing it again overwrites the same entities, and the job moves on past it 
+        only once it has been written. Once the job is done, resending writes nothing.
+        
+        A line that can't be decoded fails the request, after the lines before it are written. The error names 
+        the line and the job; once the line is fixed, resending the body with ?job= carries on from there.
+        """
+        lstorage = cls.GetStorage(aRestHandler)
+        lownerKey = cls.GetOwnerKey(aRestHandler, *args, **kwargs)
+        lkind = lstorage.Kind(aModelClass)
+
+        ljob = None
+        # from the query string only; request.get would read the body as a form
+        ljobArg = aRestHandler.request.GET.get("job")
+        if ljobArg:
+            try:
+                ljob = SleepyJob.get_by_id(int(ljobArg), parent = ToNdbKey(lownerKey))
+            except ValueError:
+                raise ValueError("job must be an integer")
+            if not ljob or ljob.kind_name != lkind or ljob.operation != "import":
+                raise KeyError("no such import job")
+        else:
+            ljob = SleepyJob(parent = ToNdbKey(lownerKey), kind_name = lkind, operation = "import", status = "running", line = 0)
+            ljob.put()
+
+        ldeadline = time.time() + cls.IMPORTTIMEBUDGET
+
+        limported = 0
+        llinesRead = ljob.line
+        ljsonables = []
+
+        def lcommit():
+            if ljob.page_ids is None or len(ljob.page_ids) != len(ljsonables):
+                # saved before the write, so that if this request's response is lost, the retry reuses them
+                ljob.page_ids = lstorage.AllocateIds(aModelClass, len(ljsonables), lownerKey) if ljsonables else []
+                ljob.put()
+
+            lkeys = [lstorage.MakeKey(aModelClass, lid, lownerKey) for lid in ljob.page_ids]
+            # anything an earlier try wrote is counted already
+            lexisting = dict((KeyString(KeyOf(lmodel)), lmodel) for lmodel in cls.Wait(lstorage.GetMultiAsync(lkeys)) if lmodel)
+            cls.SnapshotCounters(aRestHandler, lexisting.values())
+
+            lmodels = []
+            lsaveModels = []
+            ldeleteModels = []
+            for ljsonable, lkey in zip(ljsonables, lkeys):
+                lmodel = lstorage.New(aModelClass, lkey)
+                lmodel._sleepyCounted = getattr(lexisting.get(KeyString(lkey)), "_sleepyCounted", frozenset())
+                lmodelSaves, lmodelDeletes = cls.JsonableToModel(ljsonable, lmodel, aTemplate)
+                if cls.MethodExists(lmodel, "DecorateModel"):
+                    lmodelSaves = map(lmodel.DecorateModel, lmodelSaves)
+                lmodels.append(lmodel)
+                lsaveModels.extend(lmodelSaves)
+                ldeleteModels.extend(lmodelDeletes)
+
+            cls.AssignRanks(aRestHandler, aModelClass, lmodels, *args, **kwargs)
+            if lsaveModels or ldeleteModels:
+                cls.CommitChanges(aRestHandler, lsaveModels, ldeleteModels)
+
+            ljob.processed += len(lmodels)
+            ljob.line = llinesRead
+            ljob.page_ids = None
+            ljob.put()
+            return len(lmodels)
+
+        if ljob.status == "running":
+            ldone = True
+            for llineNumber, lline in enumerate(aRestHandler.request.body_file):
+                if llineNumber < ljob.line:
+                    continue
+                llinesRead = llineNumber + 1
+                lline = lline.strip()
+                if lline:
+                    try:
+                        ljsonable = json.loads(lline)
+                        if not isinstance(ljsonable, dict):
+                            raise ValueError("line must be an object")
+                        # fail now, rather than part way through writing a batch
+                        cls.JsonableToModel(ljsonable, aModelClass(), aTemplate)
+                    except Exception, ex:
+                        llinesRead = llineNumber
+                        limported += lcommit()
+                        raise ValueError("line %s of job %s: %s: %s" % (llineNumber, ljob.key.id(), ex.__class__.__name__, str(ex)))
+                    ljsonables.append(ljsonable)
+    
+                if len(ljsonables) >= cls.MAXBATCHSIZE:
+                    limported += lcommit()
+                    ljsonables = []
+                    if time.time() > ldeadline:
+                        ldone = False
+                        break
+    
+            if ldone:
+                limported += lcommit()
+                ljob.status = "done"
+                ljob.put()
+
+        cls.ReturnJsonable(aRestHandler, {"job": ljob.key.id(), "imported": limported, "line": ljob.line, "done": ljob.status == "done"})
+
+    # ranks longer than this make a move schedule a rebalance, see RebalanceRanks
+    MAXRANKLENGTH = 24
+
+    @classmethod
+    def GetRankField(cls, aRestHandler):
+        """
+        Handlers keep their entities in a user defined order by implementing GetRankField(), returning the name
+        of an indexed StringProperty to hold each entity's rank (see sleepyrank). Listing in that order is then
+        ?order_by=<rank field>, and the order is changed a move at a time with POST <id>/move, which writes just
+        the one entity. New entities are ranked after all the others.
+        
+        Returns None if the handler doesn't use ranks.
+        """
+        retval = None
+        if cls.MethodExists(aRestHandler, "GetRankField"):
+            retval = aRestHandler.GetRankField()
+        return retval
+
+    @classmethod
+    def AssignRanks(cls, aRestHandler, aModelClass, aModels, *args, **kwargs):
+        """
+        Gives models that don't have a rank yet successive ranks at the end of the list, if the handler uses ranks.
+        """
+        lrankField = cls.GetRankField(aRestHandler)
+        if lrankField:
+            lunranked = [lmodel for lmodel in aModels if not getattr(lmodel, lrankField)]
+            if lunranked:
+                llastRank = cls.GetNeighbourRank(aRestHandler, aModelClass, None, True, None, *args, **kwargs)
+                for lmodel, lrank in zip(lunranked, sleepyrank.RanksAfter(llastRank, len(lunranked))):
+                    setattr(lmodel, lrankField, lrank)
+
+    @classmethod
+    def GetNeighbourRank(cls, aRestHandler, aModelClass, aRank, aDescending, aExcludeModel, *args, **kwargs):
+        """
+        The rank of the next entity after aRank (or before it if aDescending) in the handler's list, skipping
+        aExcludeModel. aRank None means from the start (or end). Returns None if there's no such entity.
+        """
+        lrankField = cls.GetRankField(aRestHandler)
+        lstorage = cls.GetStorage(aRestHandler)
+        lqry = lstorage.Query(aModelClass, aAncestor = cls.GetOwnerKey(aRestHandler, *args, **kwargs))
+        if cls.MethodExists(aRestHandler, "ModifyQuery"):
+            lqry = aRestHandler.ModifyQuery(lqry, *args, **kwargs)
+        if aRank is not None:
+            lqry = lstorage.Filter(aModelClass, lqry, lrankField, "<" if aDescending else ">", aRank)
+        lqry = lstorage.Order(aModelClass, lqry, lrankField, aDescending)
+
+        lexcludeId = lstorage.Id(aExcludeModel) if aExcludeModel else None
+        for lmodel in cls.Wait(lstorage.FetchPageAsync(lqry, 2))[0]:
+            if lstorage.Id(lmodel) != lexcludeId:
+                return getattr(lmodel, lrankField)
+        return None
+
+    @classmethod
+    def MoveHandler(cls, aRestHandler, aModelClass, aTemplate, aIdArg, *args, **kwargs):
+        """
+        Handles POST <id>/move, which moves an entity to a new place in the handler's list (see GetRankField).
+        
+        The body says where, as the ids of the entities it should come after and / or before:
+        
+        {"after": 4, "before": 7}
+        
+        Either can be null, meaning the start or end of the list, or left out, in which case it's looked up.
+        Only the moved entity is written. The response is the moved entity, as for PUT.
+        """
+        lrankField = cls.GetRankField(aRestHandler)
+        lId, lincomingJsonable, lneighbourIds = cls.GetMoveArgs(aRestHandler, aIdArg)
+
+        lmodelsById = cls.GetModelsById(aRestHandler, aModelClass, set([lId]) | set(lneighbourIds.values()), *args, **kwargs)
+        lmodel = lmodelsById.get(lId)
+        if not lmodel:
+            cls.ReturnNotFound(aRestHandler)
+            return
+
+        lranks = {}
+        for lname, lneighbourId in lneighbourIds.items():
+            lneighbour = lmodelsById.get(lneighbourId)
+            if not lneighbour:
+                raise ValueError("%s: item %s not found" % (lname, lneighbourId))
+            lranks[lname] = getattr(lneighbour, lrankField)
+
+        # the rank to come after, and the rank to come before
+        llowRank = lranks.get("after")
+        lhighRank = lranks.get("before")
+        if not "after" in lincomingJsonable:
+            llowRank = cls.GetNeighbourRank(aRestHandler, aModelClass, lhighRank, True, lmodel, *args, **kwargs)
+        elif not "before" in lincomingJsonable:
+            lhighRank = cls.GetNeighbourRank(aRestHandler, aModelClass, llowRank, False, lmodel, *args, **kwargs)
+
+        lrank = getattr(lmodel, lrankField)
+        if not (lrank and (llowRank is None or llowRank < lrank) and (lhighRank is None or lrank < lhighRank)):
+            # it isn't already there
+            if llowRank is not None and lhighRank is not None and llowRank >= lhighRank:
+                # this happens if two entities got the same rank, eg: created at the same time.
+                deferred.defer(cls.RebalanceRanks, aRestHandler.__class__, cls.GetOwnerKey(aRestHandler, *args, **kwargs), *args, **kwargs)
+                raise Conflict("neighbours are out of order, try again shortly")
+
+            lrank = sleepyrank.RankBetween(llowRank, lhighRank)
+            setattr(lmodel, lrankField, lrank)
+
+            lsavemodels = [lmodel]
+            if cls.MethodExists(lmodel, "DecorateModel"):
+                lsavemodels = map(lmodel.DecorateModel, lsavemodels)
+            cls.CommitChanges(aRestHandler, lsavemodels, [])
+
+            if len(lrank) > cls.MAXRANKLENGTH:
+                deferred.defer(cls.RebalanceRanks, aRestHandler.__class__, cls.GetOwnerKey(aRestHandler, *args, **kwargs), *args, **kwargs)
+
+        lcodec = cls.GetCodec(aModelClass, aTemplate)
+
+        if cls.UseETags(aRestHandler):
+            aRestHandler.response.headers["ETag"] = lcodec.ETag(lmodel)
+
+        cls.ReturnJsonable(aRestHandler, SleepyStats.Timed("serialize", lcodec.Encode)(lmodel))
+
+    @classmethod
+    def GetMoveArgs(cls, aRestHandler, aIdArg):
+        """
+        Checks a move (see MoveHandler), and returns a triple: the id of the entity to move, the request body, and
+        a dictionary of "after" and / or "before" to the ids of the neighbours it names.
+        """
+        if not cls.GetRankField(aRestHandler):
+            raise KeyError("move is not supported for this resource")
+
+        lId = cls.ParseId(aIdArg)
+        lincomingJsonable = cls.GetIncomingJsonable(aRestHandler)
+        if not isinstance(lincomingJsonable, dict) or not ("after" in lincomingJsonable or "before" in lincomingJsonable):
+            raise ValueError("move needs after and / or before")
+
+        lneighbourIds = {}
+        for lname in ["after", "before"]:
+            if lincomingJsonable.get(lname) is not None:
+                lneighbourIds[lname] = cls.ParseId(lincomingJsonable[lname])
+                if lneighbourIds[lname] == lId:
+                    raise ValueError("can't move an item relative to itself")
+
+        return lId, lincomingJsonable, lneighbourIds
+
+    @classmethod
+    def RebalanceRanks(cls, aRestHandlerClass, aOwnerKey = None, *args, **kwargs):
+        """
+        Gives every entity in a handler's list a fresh, short rank, keeping their order. Run with deferred.
+        
+        Moves into the same gap lengthen ranks, so MoveHandler schedules this when they get long. It also ranks
+        entities which don't have ranks (eg: from before the handler used them), putting them after the ranked
+        ones, ordered by the handler's first order field (see GetOrderFields).
+        
+        Every entity in the list is read, and those whose ranks change are written. If the handler partitions
+        by owner (see GetOwnerKey) this does aOwnerKey's list, or every owner's if it's None.
+        """
+        lrestHandler = cls.MakeTaskHandler(aRestHandlerClass, aOwnerKey)
+        lmodelClass = lrestHandler.GetModelClass()
+        lrankField = cls.GetRankField(lrestHandler)
+        lstorage = cls.GetStorage(lrestHandler)
+
+        lqry = lstorage.Query(lmodelClass, aAncestor = aOwnerKey)
+        if cls.MethodExists(lrestHandler, "ModifyQuery"):
+            lqry = lrestHandler.ModifyQuery(lqry, *args, **kwargs)
+        lmodelsByOwner = {}
+        for lmodel in cls.FetchPages(lmodelClass, lqry, aBackend = lstorage):
+            lmodelsByOwner.setdefault(KeyString(ParentOf(lmodel)), []).append(lmodel)
+
+        lsortKey = cls.GetRankSortKey(lrestHandler, lmodelClass)
+
+        lchangedModels = []
+        for lmodels in lmodelsByOwner.values():
+            lmodels.sort(key = lsortKey)
+            for lmodel, lrank in zip(lmodels, sleepyrank.RanksAfter(None, len(lmodels))):
+                if getattr(lmodel, lrankField) != lrank:
+                    setattr(lmodel, lrankField, lrank)
+                    lchangedModels.append(lmodel)
+
+        for lindex in range(0, len(lchangedModels), cls.MAXBATCHSIZE):
+            cls.CommitChanges(lrestHandler, lchangedModels[lindex:lindex + cls.MAXBATCHSIZE], [])
+
+    @classmethod
+    def GetRankSortKey(cls, aRestHandler, aModelClass):
+        """
+        A sort key function for models, putting them in the order RebalanceRanks keeps: by rank, then unranked
+        ones by the handler's first order field (see GetOrderFields) and id.
+        """
+        lrankField = cls.GetRankField(aRestHandler)
+        lbackend = GetBackend(aModelClass)
+        lfallbackFields = [lfield for lfield in cls.GetOrderFields(aRestHandler, aModelClass) if lfield != lrankField]
+        lfallbackField = lfallbackFields[0] if lfallbackFields else None
+        def lsortKey(aModel):
+            lrank = getattr(aModel, lrankField)
+            return (lrank is None, lrank, getattr(aModel, lfallbackField) if lfallbackField else None, lbackend.Id(aModel))
+        return lsortKey
+
+    @classmethod
+    def GetModelsById(cls, aRestHandler, aModelClass, aIds, *args, **kwargs):
+        """
+        Gets all the models with the given ids in one datastore call.
+        
+        Returns a dictionary of id to model, which only includes models that exist and are authorized.
+        """
+        retval = {}
+        
+        if aIds:
+            lids = list(aIds)
+            lstorage = cls.GetStorage(aRestHandler)
+            lownerKey = cls.GetOwnerKey(aRestHandler, *args, **kwargs)
+            lmodels = cls.Wait(lstorage.GetMultiAsync([lstorage.MakeKey(aModelClass, lid, lownerKey) for lid in lids]))
+            cls.SnapshotCounters(aRestHandler, lmodels)
+
+            lcheckAuthorized = cls.MethodExists(aRestHandler, "IsAuthorized")
+            for lid, lmodel in zip(lids, lmodels):
+                if lmodel and lcheckAuthorized and not aRestHandler.IsAuthorized(lmodel, *args, **kwargs):
+                    lmodel = None
+                if lmodel:
+                    retval[lid] = lmodel
+                    
+        return retval
+
+    @classmethod
+    def GetDeleteList(cls, aModel):
+        """
+        The list of models to delete when deleting aModel; aModel itself, plus anything
+        the model asks for via GetDeleteList()
+        """
+        retval = [aModel]
+        if cls.MethodExists(aModel, "GetDeleteList"):
+            retval.extend(aModel.GetDeleteList())
+        return retval
+
+    @classmethod
+    def CommitChanges(cls, aRestHandler, aSaveModels, aDeleteModels):
+        """
+        Writes a set of changes to the datastore. All writes made by the handlers go through here.
+        
+        This is WriteChanges followed by ChangesWritten. Handlers which need the write to happen inside
+        a transaction call WriteChanges in the transaction, and ChangesWritten once it has committed.
+        
+        If the handler has counters (see GetCounters), the entities are written in transactions with the counter
+        updates, so the counts always match what's stored. A transaction can only touch so much, so big writes are 
+        split into pieces (see SplitForTransactions), each committed with its own counter updates; if one fails,
+        the pieces before it stay written and counted. 
+        
+        Counters are ndb entities, and can't be in a db transaction. For db model classes the counters are updated
+        by ChangesWritten, after the entities are written, and marked dirty until then, so that if the write fails
+        in between RepairDirtyCounters puts them right.
+        
+        With list storage (see UseListStorage) the pieces are transactions whether or not there are counters,
+        so each rewrites a list once, with its puts and deletes together.
+        """
+        lstorage = cls.GetStorage(aRestHandler)
+        if lstorage is DbBackend or ndb.in_transaction() or not (cls.GetCounters(aRestHandler) or lstorage is ListBackend):
+            cls.WriteChanges(aRestHandler, aSaveModels, aDeleteModels)
+            cls.ChangesWritten(aRestHandler, aSaveModels, aDeleteModels)
+        else:
+            for lsaveModels, ldeleteModels in cls.SplitForTransactions(aRestHandler, aSaveModels, aDeleteModels):
+                lstorage.RunInTransaction(lambda: cls.WriteChanges(aRestHandler, lsaveModels, ldeleteModels))
+                cls.ChangesWritten(aRestHandler, lsaveModels, ldeleteModels)
+
+    # a cross group transaction can write to this many entity groups
+    MAXTRANSACTIONGROUPS = 25
+
+    # a put or delete can write this many entities
+    MAXWRITESPERCALL = 500
+
+    @classmethod
+    def SplitForTransactions(cls, aRestHandler, aSaveModels, aDeleteModels):
+        """
+        Splits a write into pieces small enough to each be written in one transaction with its counter updates.
+        Returns a list of (save models, delete models) pairs.
+        
+        A piece touches at most MAXTRANSACTIONGROUPS entity groups: those of its entities and their tombstones,
+        and a counter shard (each its own group) for every counter of every owner it has entities of. It writes
+        at most MAXWRITESPERCALL entities, tombstones included. Entities of one owner are one group, so a write
+        to a single owner's list is only split by size.
+        """
+        lcounterCount = len(cls.GetCounters(aRestHandler) or {})
+        ltombstones = cls.UseDeltaSync(aRestHandler)
+
+        retval = []
+        lgroups = set()
+        lowners = set()
+        lwrites = 0
+        for lmodel, ldelete in [(lmodel, False) for lmodel in aSaveModels] + [(lmodel, True) for lmodel in aDeleteModels]:
+            lroot = RootOf(lmodel)
+            lmodelGroups = set([KeyString(lroot) if lroot is not None else id(lmodel)])
+            lmodelWrites = 1
+            if ldelete and ltombstones:
+                lmodelWrites = 2
+                if ParentOf(lmodel) is None:
+                    # a tombstone for a root entity is a root entity too
+                    lmodelGroups.add(("tombstone", id(lmodel)))
+            lowner = KeyString(ParentOf(lmodel))
+
+            lgroupCount = len(lgroups | lmodelGroups) + len(lowners | set([lowner])) * lcounterCount
+            if not retval or (lwrites and (lgroupCount > cls.MAXTRANSACTIONGROUPS or lwrites + lmodelWrites > cls.MAXWRITESPERCALL)):
+                retval.append(([], []))
+                lgroups = set()
+                lowners = set()
+                lwrites = 0
+            retval[-1][1 if ldelete else 0].append(lmodel)
+            lgroups |= lmodelGroups
+            lowners.add(lowner)
+            lwrites += lmodelWrites
+        return retval
+
+    @classmethod
+    def WriteChanges(cls, aRestHandler, aSaveModels, aDeleteModels):
+        """
+        The datastore part of CommitChanges. Safe to call inside a (cross group) transaction.
+        
+        If the handler uses delta sync, deleting entities of its model class leaves tombstones (see MakeTombstones).
+        
+        Models (and keys) can be db or ndb ones. Those of the handler's model class go to its storage (see 
+        GetStorage), the rest to their own backend. The puts and deletes for each are started together, then 
+        waited on, so they overlap rather than running one after another.
+        
+        If the handler has counters, they're updated too, or for db model classes marked dirty until ChangesWritten
+        updates them. See UpdateCounters and CommitChanges. If it's searchable, the search terms of the models being
+        saved are brought up to date. See GetSearchIndex
+        """
+        cls.SetSearchTerms(aRestHandler, aSaveModels)
+        lcounterDeltas = cls.GetCounterDeltas(aRestHandler, aSaveModels, aDeleteModels)
+        if lcounterDeltas and GetBackend(aRestHandler.GetModelClass()) is DbBackend:
+            # a retried transaction marks them again, ChangesWritten deletes all the marks
+            aRestHandler._sleepyDirtyCounters = getattr(aRestHandler, "_sleepyDirtyCounters", []) + \
+                cls.MarkCountersDirty(aRestHandler, aSaveModels, aDeleteModels)
+            lcounterDeltas = None
+
+        lputModels = list(aSaveModels)
+        if GetBackend(aRestHandler.GetModelClass()) is not DbBackend:
+            lputModels.extend(cls.MakeTombstones(aRestHandler, aDeleteModels))
+
+        lmodelClass = aRestHandler.GetModelClass()
+        lstorage = cls.GetStorage(aRestHandler)
+        lkind = lstorage.Kind(lmodelClass)
+        lputsByBackend = {}
+        for lmodel in lputModels:
+            lputsByBackend.setdefault(lstorage if isinstance(lmodel, lmodelClass) else GetBackendOf(lmodel), []).append(lmodel)
+        ldeletesByBackend = {}
+        for lmodelOrKey in aDeleteModels:
+            lbackend = lstorage if KeyOf(lmodelOrKey).kind() == lkind else GetBackendOf(lmodelOrKey)
+            ldeletesByBackend.setdefault(lbackend, []).append(lmodelOrKey)
+
+        lfutures = [lbackend.PutMultiAsync(lmodels) for lbackend, lmodels in lputsByBackend.items()]
+        lfutures.extend([lbackend.DeleteMultiAsync(lmodels) for lbackend, lmodels in ldeletesByBackend.items()])
+        if lcounterDeltas:
+            for lownerString, ldeltas in lcounterDeltas.items():
+                cls.UpdateCounters(lkind, lownerString, ldeltas)
+        for lfuture in lfutures:
+            cls.Wait(lfuture)
+
+    @classmethod
+    def ChangesWritten(cls, aRestHandler, aSaveModels, aDeleteModels):
+        """
+        Housekeeping after changes are committed: cached responses for anything written are invalidated,
+        which also changes collection ETags. For db model classes, tombstones are written and counters updated
+        now (see MakeTombstones and CommitChanges).
+        """
+        if GetBackend(aRestHandler.GetModelClass()) is DbBackend:
+            ltombstones = cls.MakeTombstones(aRestHandler, aDeleteModels)
+            if ltombstones:
+                cls.Wait(NdbBackend.PutMultiAsync(ltombstones))
+
+        SleepyCache.Invalidate(list(aSaveModels) + list(aDeleteModels))
+
+        lcounters = cls.GetCounters(aRestHandler)
+        if lcounters:
+            lmodelClass = aRestHandler.GetModelClass()
+            if GetBackend(lmodelClass) is DbBackend:
+                lkind = DbBackend.Kind(lmodelClass)
+                for lownerString, ldeltas in cls.GetCounterDeltas(aRestHandler, aSaveModels, aDeleteModels).items():
+                    cls.UpdateCounters(lkind, lownerString, ldeltas)
+                ndb.delete_multi(getattr(aRestHandler, "_sleepyDirtyCounters", []))
+                aRestHandler._sleepyDirtyCounters = []
+
+            # what's been written is now what's counted
+            for lmodel in aSaveModels:
+                if isinstance(lmodel, lmodelClass):
+                    lmodel._sleepyCounted = cls.GetCounterMembership(lcounters, lmodel)
+
+    @classmethod
+    def MakeTombstones(cls, aRestHandler, aDeleteModels):
+        """
+        Tombstones for the entities of the handler's model class among aDeleteModels, if it uses delta sync.
+        
+        A tombstone is in the same entity group as its entity, so for ndb model classes it's written in the delete's
+        transaction. It's an ndb entity, which can't be in a db transaction, and writing it outside the transaction
+        would collide with it; so for db model classes it's written once the delete has committed.
+        """
+        retval = []
+        if aDeleteModels and cls.UseDeltaSync(aRestHandler):
+            lmodelClass = aRestHandler.GetModelClass()
+            lkind = GetBackend(lmodelClass).Kind(lmodelClass)
+            for lmodelOrKey in aDeleteModels:
+                lkey = KeyOf(lmodelOrKey)
+                if lkey.kind() == lkind:
+                    retval.append(SleepyTombstone(parent = ToNdbKey(lkey.parent()), kind_name = lkind, entity_id = lkey.id()))
+        return retval
+
+    # shards per counter. More shards allow more concurrent writes, but make reading the counter bigger.
+    COUNTERSHARDS = 20
+
+    @classmethod
+    def GetCounters(cls, aRestHandler):
+        """
+        Handlers keep counts of their entities by implementing GetCounters(), returning a dictionary of counter
+        name to a dictionary of field: value that an entity must match to be counted, eg:
+        
+        {"total": {}, "done": {"done": True}}
+        
+        GET <resource>/meta/stats returns the counts, without a query. They're kept in sharded counters
+        (SleepyCounterShard), updated by every write through Sleepy; see CommitChanges. RepairCounters recomputes them.
+        
+        Returns None if the handler doesn't have counters.
+        """
+        retval = None
+        if cls.MethodExists(aRestHandler, "GetCounters"):
+            retval = aRestHandler.GetCounters()
+        return retval
+
+    @classmethod
+    def GetCounterMembership(cls, aCounters, aModel):
+        """
+        The names of the counters aModel is counted in
+        """
+        return frozenset(lname for lname, lfilters in aCounters.items()
+                         if all(getattr(aModel, lfield, None) == lvalue for lfield, lvalue in lfilters.items()))
+
+    @classmethod
+    def SnapshotCounters(cls, aRestHandler, aModels):
+        """
+        Notes which counters models are counted in as they're loaded, so a write can work out what it changes.
+        """
+        lcounters = cls.GetCounters(aRestHandler)
+        if lcounters:
+            for lmodel in aModels:
+                if lmodel:
+                    lmodel._sleepyCounted = cls.GetCounterMembership(lcounters, lmodel)
+
+    @classmethod
+    def GetCounterDeltas(cls, aRestHandler, aSaveModels, aDeleteModels):
+        """
+        Works out how a write changes the handler's counters. Returns a dictionary of owner (as a KeyString, see
+        GetOwnerKey) to a dictionary of counter name to change.
+        
+        Saved models are compared with their snapshots (see SnapshotCounters). Models which have been saved
+        before but weren't snapshotted when they were loaded are assumed not to change any counts.
+        """
+        retval = {}
+        lcounters = cls.GetCounters(aRestHandler)
+        if lcounters:
+            lmodelClass = aRestHandler.GetModelClass()
+            lbackend = GetBackend(lmodelClass)
+
+            def ladd(aModel, aNames, aDelta):
+                ldeltas = retval.setdefault(KeyString(ParentOf(aModel)), {})
+                for lname in aNames:
+                    ldeltas[lname] = ldeltas.get(lname, 0) + aDelta
+
+            for lmodel in aSaveModels:
+                if isinstance(lmodel, lmodelClass):
+                    lbefore = getattr(lmodel, "_sleepyCounted", None)
+                    if lbefore is None:
+                        if lbackend.IsSaved(lmodel):
+                            continue
+                        # a new model. Snapshot it now, so that if a transaction retries, it isn't counted twice.
+                        lbefore = lmodel._sleepyCounted = frozenset()
+                    lafter = cls.GetCounterMembership(lcounters, lmodel)
+                    ladd(lmodel, lafter - lbefore, 1)
+                    ladd(lmodel, lbefore - lafter, -1)
+
+            for lmodel in aDeleteModels:
+                if isinstance(lmodel, lmodelClass):
+                    lbefore = getattr(lmodel, "_sleepyCounted", None)
+                    if lbefore is None:
+                        lbefore = cls.GetCounterMembership(lcounters, lmodel)
+                    ladd(lmodel, lbefore, -1)
+
+        for lowner, ldeltas in retval.items():
+            retval[lowner] = dict((lname, ldelta) for lname, ldelta in ldeltas.items() if ldelta)
+        return dict((lowner, ldeltas) for lowner, ldeltas in retval.items() if ldeltas)
+
+    @classmethod
+    def UpdateCounters(cls, aKind, aOwner, aDeltas):
+        """
+        Adds aDeltas (counter name to change) to one randomly chosen shard of each of aOwner's counters.
+        
+        Inside an ndb transaction this is part of it; otherwise it runs its own.
+        """
+        lshard = random.randint(0, cls.COUNTERSHARDS - 1)
+        lnames = list(aDeltas)
+        lkeys = [SleepyCounterShard.GetShardKey(aKind, aOwner, lname, lshard) for lname in lnames]
+
+        def lupdate():
+            lshards = ndb.get_multi(lkeys)
+            for lindex, lname in enumerate(lnames):
+                if lshards[lindex] is None:
+                    lshards[lindex] = SleepyCounterShard(key = lkeys[lindex])
+                lshards[lindex].count += aDeltas[lname]
+            ndb.put_multi(lshards)
+
+        if ndb.in_transaction():
+            lupdate()
+        else:
+            ndb.transaction(lupdate, xg = True)
+
+    @classmethod
+    def MarkCountersDirty(cls, aRestHandler, aSaveModels, aDeleteModels):
+        """
+        Marks the counters of the owners of a write's entities as dirty, for a write that can't update them in the
+        same transaction (see CommitChanges). Returns the keys of the marks, to delete once the counters are updated.
+        """
+        lmodelClass = aRestHandler.GetModelClass()
+        lkind = GetBackend(lmodelClass).Kind(lmodelClass)
+        lowners = {}
+        for lmodel in list(aSaveModels) + list(aDeleteModels):
+            lowner = ToNdbKey(ParentOf(lmodel))
+            lowners[KeyString(lowner)] = lowner
+        return ndb.put_multi([SleepyDirtyCounters(kind_name = lkind, owner = lowner) for lowner in lowners.values()])
+
+    # marks younger than this may belong to writes still going, so RepairDirtyCounters leaves them.
+    # It's the longest a task can run.
+    DIRTYCOUNTERSAGE = datetime.timedelta(minutes = 10)
+
+    @classmethod
+    def RepairDirtyCounters(cls, aRestHandlerClass):
+        """
+        Repairs the counters of the owners whose counters were marked dirty by writes which didn't finish (see
+        MarkCountersDirty), then deletes the marks. Run with deferred, regularly, eg: from cron.
+        """
+        lrestHandler = aRestHandlerClass()
+        lmodelClass = lrestHandler.GetModelClass()
+        lbackend = GetBackend(lmodelClass)
+        lqry = SleepyDirtyCounters.query(SleepyDirtyCounters.kind_name == lbackend.Kind(lmodelClass),
+                                         SleepyDirtyCounters.created < datetime.datetime.utcnow() - cls.DIRTYCOUNTERSAGE)
+        lownerMarks = {}
+        for lmark in lqry:
+            lownerMarks.setdefault(KeyString(lmark.owner), (lmark.owner, []))[1].append(lmark.key)
+
+        for lowner, lmarkKeys in lownerMarks.values():
+            if lowner is not None and lbackend is DbBackend:
+                lowner = lowner.to_old_key()
+            cls.RepairCounters(aRestHandlerClass, lowner)
+            ndb.delete_multi(lmarkKeys)
+
+    @classmethod
+    def GetCounterValues(cls, aRestHandler, aModelClass, *args, **kwargs):
+        """
+        The caller's counters, as a dictionary of name to count. All shards are read with one get.
+        """
+        lkind = GetBackend(aModelClass).Kind(aModelClass)
+        lowner = KeyString(cls.GetOwnerKey(aRestHandler, *args, **kwargs))
+        lnames = sorted(cls.GetCounters(aRestHandler))
+        lkeys = []
+        for lname in lnames:
+            lkeys.extend(SleepyCounterShard.GetShardKeys(lkind, lowner, lname, cls.COUNTERSHARDS))
+        lshards = cls.Wait(GetBackend(SleepyCounterShard).GetMultiAsync(lkeys))
+
+        retval = {}
+        for lindex, lname in enumerate(lnames):
+            lnameShards = lshards[lindex * cls.COUNTERSHARDS:(lindex + 1) * cls.COUNTERSHARDS]
+            retval[lname] = sum(lshard.count for lshard in lnameShards if lshard)
+        return retval
+
+    @classmethod
+    def RepairCounters(cls, aRestHandlerClass, aOwnerKey = None, *args, **kwargs):
+        """
+        Recomputes a handler's counters from scratch, with keys only queries. Run with deferred.
+        
+        If the handler partitions by owner (see GetOwnerKey) this does aOwnerKey's counters, or those of every
+        owner which has entities if it's None.
+        
+        Writes made while it runs may be counted twice or not at all, so run it when things are quiet.
+        """
+        lrestHandler = cls.MakeTaskHandler(aRestHandlerClass, aOwnerKey)
+        lmodelClass = lrestHandler.GetModelClass()
+        lstorage = cls.GetStorage(lrestHandler)
+        lkind = lstorage.Kind(lmodelClass)
+        lcounters = cls.GetCounters(lrestHandler)
+
+        def lcount(aFilters):
+            lqry = lstorage.Query(lmodelClass, aKeysOnly = True, aAncestor = aOwnerKey)
+            if cls.MethodExists(lrestHandler, "ModifyQuery"):
+                lqry = lrestHandler.ModifyQuery(lqry, *args, **kwargs)
+            for lfield, lvalue in sorted(aFilters.items()):
+                lqry = lstorage.Filter(lmodelClass, lqry, lfield, "=", lvalue)
+            retval = {}
+            for lkey in cls.FetchPages(lmodelClass, lqry, aBackend = lstorage):
+                lowner = KeyString(lkey.parent())
+                retval[lowner] = retval.get(lowner, 0) + 1
+            return retval
+
+        # owners with no entities matching a counter still need it zeroed
+        lowners = set(lcount({}))
+        lowners.add(KeyString(aOwnerKey))
+
+        for lname, lfilters in lcounters.items():
+            lcounts = lcount(lfilters)
+            for lowner in lowners:
+                lshards = [SleepyCounterShard(key = lkey) for lkey in SleepyCounterShard.GetShardKeys(lkind, lowner, lname, cls.COUNTERSHARDS)]
+                lshards[0].count = lcounts.get(lowner, 0)
+                ndb.transaction(lambda: ndb.put_multi(lshards), xg = True)
+
+    @classmethod
+    def Wait(cls, aFuture):
+        """
+        Waits for a datastore future and returns its result. The wait counts as "datastore" time in SleepyStats.
+        """
+        return SleepyStats.Timed("datastore", aFuture.get_result)()
+
+    @classmethod
+    def ParseId(cls, aId):
+        try:
+            return int(aId)
+        except:
+            raise ValueError("id must be an integer")
+
+    @classmethod
+    def UseETags(cls, aRestHandler):
+        """
+        Handlers opt in to ETags and conditional requests by implementing UseETags() to return True.
+        
+        Collection ETags depend on every write to the model class going through Sleepy.
+        """
+        return cls.MethodExists(aRestHandler, "UseETags") and aRestHandler.UseETags()
+
+    @classmethod
+    def ETagMatches(cls, aHeaderValue, aETag):
+        """
+        True if aETag is matched by an If-None-Match or If-Match header value
+        """
+        retval = False
+        if aHeaderValue and aETag:
+            for lcandidate in aHeaderValue.split(","):
+                lcandidate = lcandidate.strip()
+                if lcandidate.startswith("W/"):
+                    lcandidate = lcandidate[2:]
+                if lcandidate == "*" or lcandidate == aETag:
+                    retval = True
+                    break
+        return retval
+
+    @classmethod
+    def ReturnJsonOrNotModified(cls, aRestHandler, aJson, aETag):
+        """
+        http response with an ETag, and either the Json, or 304 if the caller already has it.
+        """
+        if cls.ETagMatches(aRestHandler.request.headers.get("If-None-Match"), aETag):
+            cls.ReturnNotModified(aRestHandler, aETag)
+        else:
+            aRestHandler.response.headers["ETag"] = aETag
+            cls.ReturnJson(aRestHandler, aJson)
+
+    @classmethod
+    def WeakETag(cls, aETag):
+        """
+        aETag as a weak ETag, for a body which means the same as the one aETag was made for, but differs in its bytes
+        """
+        if aETag.startswith("W/"):
+            return aETag
+        return "W/%s" % aETag
+
+    @classmethod
+    def ReturnNotModified(cls, aRestHandler, aETag):
+        aRestHandler.response.set_status(304)
+        # the caller holds a weak ETag if its copy was compressed; hand back the one it has
+        if ("W/%s" % aETag) in aRestHandler.request.headers.get("If-None-Match", ""):
+            aETag = cls.WeakETag(aETag)
+        aRestHandler.response.headers["ETag"] = aETag
+        aRestHandler.response.body = ""
+
+    @classmethod
+    def ReturnException(cls, aRestHandler, aException):
+        """ 
+        http response with json representation of an exception
+        
+        Exceptions can carry their own http status in a status attribute, otherwise it's 400.
+        """ 
+        aRestHandler.response.set_status(getattr(aException, "status", 400))
+        aRestHandler.response.body = "%s: %s" % (aException.__class__.__name__, str(aException))
+       
+    @classmethod
+    def ReturnJsonable(cls, aRestHandler, aJsonable):
+        """ 
+        http response with string representation of Json structure
+        """ 
+        cls.ReturnJson(aRestHandler, SleepyStats.Timed("json", cls.JsonableToJson)(aJsonable, cls.IsPretty(aRestHandler)))
+
+    JSONCONTENTTYPE = "application/json; charset=utf-8"
+
+    @classmethod
+    def ReturnJson(cls, aRestHandler, aJson):
+        """ 
+        http response with an already serialized Json string
+        """ 
+        aRestHandler.response.headers["Content-Type"] = cls.JSONCONTENTTYPE
+        aRestHandler.response.out.write(aJson)
+
+    @classmethod
+    def JsonableToJson(cls, aJsonable, aPretty = False):
+        """
+        Serializes a Jsonable. Output is compact unless aPretty is True.
+        """
+        if aPretty:
+            return json.dumps(aJsonable, sort_keys=True, indent=4)
+        else:
+            return json.dumps(aJsonable, separators=(',', ':'))
+
+    @classmethod
+    def IsPretty(cls, aRestHandler):
+        """
+        Clients can ask for indented, sorted json with ?pretty=1, for debugging.
+        """
+        return aRestHandler.request.get("pretty") in ["1", "true"]
+
+    @classmethod
+    def ReturnJsonableStream(cls, aRestHandler, aJsonables):
+        """
+        http response with a Json array, built from an iterable of Jsonables.
+        
+        Elements are encoded as they arrive, and written to the response in chunks of STREAMBATCHSIZE, so the
+        Jsonables (and the models they come from, see FetchPages) aren't all held at once. The response itself
+        isn't streamed, though: webapp2 buffers response.out until the handler returns, CompressResponse gzips
+        the whole body, and cached collections are stored whole. So the body is held in memory, and the client
+        gets none of it until it's complete; both grow with the page, which ?limit= and MAXLIMIT bound.
+        
+        Returns the number of elements written.
+        """
+        lcount = 0
+        lchunk = []
+        lpretty = cls.IsPretty(aRestHandler)
+        lseparator = ", " if lpretty else ","
+        ltoJson = SleepyStats.Timed("json", cls.JsonableToJson)
+        
+        aRestHandler.response.headers["Content-Type"] = cls.JSONCONTENTTYPE
+        aRestHandler.response.out.write("[")
+        for ljsonable in aJsonables:
+            if lcount:
+                lchunk.append(lseparator)
+            lchunk.append(ltoJson(ljsonable, lpretty))
+            lcount += 1
+            if len(lchunk) >= cls.STREAMBATCHSIZE:
+                aRestHandler.response.out.write("".join(lchunk))
+                lchunk = []
+        lchunk.append("]")
+        aRestHandler.response.out.write("".join(lchunk))
+        
+        return lcount
+
+    NDJSONCONTENTTYPE = "application/x-ndjson; charset=utf-8"
+
+    @classmethod
+    def ReturnJsonLinesStream(cls, aRestHandler, aJsonables):
+        """
+        http response with newline delimited json, one line per Jsonable in an iterable. Like ReturnJsonableStream,
+        lines are written in chunks of STREAMBATCHSIZE as they arrive.
+        
+        Returns the number of lines written.
+        """
+        lcount = 0
+        lchunk = []
+        ltoJson = SleepyStats.Timed("json", cls.JsonableToJson)
+
+        aRestHandler.response.headers["Content-Type"] = cls.NDJSONCONTENTTYPE
+        for ljsonable in aJsonables:
+            lchunk.append(ltoJson(ljsonable))
+            lchunk.append("\n")
+            lcount += 1
+            if len(lchunk) >= cls.STREAMBATCHSIZE * 2:
+                aRestHandler.response.out.write("".join(lchunk))
+                lchunk = []
+        aRestHandler.response.out.write("".join(lchunk))
+
+        return lcount
+
+    @classmethod
+    def ReturnNotFound(cls, aRestHandler):
+        aRestHandler.response.set_status(404)
+        aRestHandler.response.body = ""
+    
+    @classmethod
+    def ReturnNone(cls, aRestHandler):
+        aRestHandler.response.body = ""
+
+    @classmethod
+    def GetLimitArg(cls, aRestHandler):
+        """
+        Parse the optional ?limit= argument. Returns None if there isn't one.
+        """
+        llimit = None
+        llimitArg = aRestHandler.request.get("limit")
+        if llimitArg:
+            try:
+                llimit = int(llimitArg)
+            except:
+                raise ValueError("limit must be an integer")
+            if llimit < 1 or llimit > cls.MAXLIMIT:
+                raise ValueError("limit must be between 1 and %s" % cls.MAXLIMIT)
+        return llimit
 
     @classmethod        
     def GetIncomingJsonable(cls, aRestHandler):
@@ -0,0 +1,85 @@
+from google.appengine.ext import deferred
+from google.appengine.ext import webapp
+from sleepy import Sleepy
+from sleepycache import SleepyCache
+from sleepystats import SleepyStats
+
+class CollectTombstonesHandler(webapp.RequestHandler):
+    """
+    Deletes old tombstones. Run from cron, see cron.yaml
+    """
+    def get(self):
+        Sleepy.CollectTombstones()
+
+class StatsHandler(webapp.RequestHandler):
+    """
+    Request timing and RPC statistics for this instance, as json. See SleepyStats
+    """
+    def get(self):
+        Sleepy.ReturnJsonable(self, {
+            "enabled": SleepyStats.enabled,
+            "routes": SleepyStats.GetStats(),
+            "cache": SleepyCache.GetStats()
+        })
+
+class RebalanceRanksHandler(webapp.RequestHandler):
+    """
+    Rebalances the ranks of every handler in restHandlers, which also ranks any unranked entities.
+    Run it once after adding ranks to an existing model. See Sleepy.RebalanceRanks
+    """
+    restHandlers = []
+
+    def get(self):
+        for lrestHandler in self.restHandlers:
+            deferred.defer(Sleepy.RebalanceRanks, lrestHandler)
+
+class RepairCountersHandler(webapp.RequestHandler):
+    """
+    Recomputes the counters of every handler in restHandlers which has them. Run it after adding counters to
+    an existing model, or if they've drifted. See Sleepy.RepairCounters
+
+    With ?dirty=1 it only repairs counters left dirty by writes which failed part way. Run that from cron,
+    see cron.yaml and Sleepy.RepairDirtyCounters
+    """
+    restHandlers = []
+
+    def get(self):
+        for lrestHandler in self.restHandlers:
+            if Sleepy.GetCounters(lrestHandler()):
+                if self.request.get("dirty"):
+                    deferred.defer(Sleepy.RepairDirtyCounters, lrestHandler)
+                else:
+                    deferred.defer(Sleepy.RepairCounters, lrestHandler)
+
+class BackfillSearchTermsHandler(webapp.RequestHandler):
+    """
+    Sets the search terms of every entity of every handler in restHandlers which is searchable. Run it after
+    making a model searchable. See Sleepy.BackfillSearchTerms
+
+    Every entity whose terms change is written, and neither db nor ndb can put an entity without setting its 
+    auto_now properties, so each one gets a new modified time. That drops the cached lists, and every client's
+    next delta sync downloads all those entities again, which for a first backfill is the whole collection.
+    Run it when that traffic is acceptable.
+    """
+    restHandlers = []
+
+    def get(self):
+        for lrestHandler in self.restHandlers:
+            if Sleepy.GetSearchIndex(lrestHandler()):
+                deferred.defer(Sleepy.BackfillSearchTerms, lrestHandler)
+
+class AdoptRootEntitiesHandler(webapp.RequestHandler):
+    """
+    Moves the entities of every handler in restHandlers which were made before it partitioned them by owner, and
+    so can't be seen by anyone, into the list of the admin calling this. See Sleepy.AdoptRootEntities
+    """
+    restHandlers = []
+
+    def get(self):
+        for lrestHandlerClass in self.restHandlers:
+            # the rest handler answers this request, so its owner is the caller's
+            lrestHandler = lrestHandlerClass()
+            lrestHandler.initialize(self.request, self.response)
+            lownerKey = Sleepy.GetOwnerKey(lrestHandler)
+            if lownerKey:
+                deferred.defer(Sleepy.AdoptRootEntities, lrestHandlerClass, lownerKey)
@@ -0,0 +1,407 @@
+'''
+Datastore backends for Sleepy.
+
+Sleepy works with model classes built on either the old db API or ndb. Everything Sleepy needs from the
+datastore goes through one of the backend classes here, chosen by GetBackend(aModelClass), so the handlers
+don't need to know which API a model uses.
+
+Reads and writes are asynchronous where the API allows it: methods ending in Async return an object with
+get_result(), so callers can start several RPCs and then wait on them together. db has no async queries,
+so DbBackend.FetchPageAsync does its work up front.
+'''
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import db
+from google.appengine.ext import ndb
+
+class DoneFuture:
+    """
+    A future whose result is already known
+    """
+    def __init__(self, aResult):
+        self._result = aResult
+
+    def get_result(self):
+        return self._result
+
+class ListFuture:
+    """
+    Waits on a list of futures, the result is the list of their results
+    """
+    def __init__(self, aFutures):
+        self._futures = aFutures
+
+    def get_result(self):
+        return [lfuture.get_result() for lfuture in self._futures]
+
+class MappedFuture:
+    """
+    The result of another future, passed through a function
+    """
+    def __init__(self, aFuture, aFunc):
+        self._future = aFuture
+        self._func = aFunc
+
+    def get_result(self):
+        return self._func(self._future.get_result())
+
+# filter operators Sleepy uses, as python operator methods on ndb properties
+NDBOPERATORS = {
+    "=": "__eq__",
+    "!=": "__ne__",
+    "<": "__lt__",
+    "<=": "__le__",
+    ">": "__gt__",
+    ">=": "__ge__"
+}
+
+class DbBackend:
+    SUPPORTEDTYPES = [
+            db.IntegerProperty,
+            db.FloatProperty,
+            db.BooleanProperty,
+            db.StringProperty,
+            db.DateTimeProperty,
+            db.DateProperty
+    ]
+    DATETIMETYPE = db.DateTimeProperty
+    DATETYPE = db.DateProperty
+
+    @classmethod
+    def Handles(cls, aModelClass):
+        return issubclass(aModelClass, db.Model)
+
+    @classmethod
+    def Kind(cls, aModelClass):
+        return aModelClass.kind()
+
+    @classmethod
+    def Properties(cls, aModelClass):
+        return aModelClass.properties()
+
+    @classmethod
+    def IsIndexed(cls, aProperty):
+        return aProperty.indexed
+
+    @classmethod
+    def IsAutoNow(cls, aProperty):
+        return getattr(aProperty, "auto_now", False)
+
+    @classmethod
+    def IsAutoNowAdd(cls, aProperty):
+        return getattr(aProperty, "auto_now_add", False)
+
+    @classmethod
+    def MetaTypeName(cls, aProperty):
+        if "data_type" in type(aProperty).__dict__:
+            return type(aProperty).__dict__["data_type"]. __name__.replace("basestring", "string")
+        else:
+            return type(aProperty).__name__
+
+    @classmethod
+    def Id(cls, aModel):
+        return aModel.key().id()
+
+    @classmethod
+    def IsSaved(cls, aModel):
+        return aModel.is_saved()
+
+    @classmethod
+    def MakeKey(cls, aModelClass, aId, aParent = None):
+        return db.Key.from_path(aModelClass.kind(), aId, parent = aParent)
+
+    @classmethod
+    def AllocateIds(cls, aModelClass, aCount, aParent = None):
+        lfirst, llast = db.allocate_ids(cls.MakeKey(aModelClass, 1, aParent), aCount)
+        return range(lfirst, llast + 1)
+
+    @classmethod
+    def New(cls, aModelClass, aKey):
+        """
+        A new model with the key aKey
+        """
+        return aModelClass(key = aKey)
+
+    @classmethod
+    def Copy(cls, aModel, aKey):
+        """
+        A new model with the key aKey, and the same property values as aModel
+        """
+        return type(aModel)(key = aKey, **dict((lname, getattr(aModel, lname)) for lname in cls.Properties(type(aModel))))
+
+    @classmethod
+    def GetByIdAsync(cls, aModelClass, aId, aParent = None):
+        return db.get_async(cls.MakeKey(aModelClass, aId, aParent))
+
+    @classmethod
+    def GetMultiAsync(cls, aKeys):
+        return db.get_async(aKeys)
+
+    @classmethod
+    def PutMultiAsync(cls, aModels):
+        return db.put_async(aModels)
+
+    @classmethod
+    def DeleteMultiAsync(cls, aModelsOrKeys):
+        return db.delete_async(aModelsOrKeys)
+
+    @classmethod
+    def Query(cls, aModelClass, aProjection = None, aKeysOnly = False, aAncestor = None):
+        if aProjection:
+            retval = db.Query(aModelClass, projection = aProjection)
+        else:
+            retval = db.Query(aModelClass, keys_only = aKeysOnly)
+        if aAncestor:
+            retval.ancestor(aAncestor)
+        return retval
+
+    @classmethod
+    def Filter(cls, aModelClass, aQuery, aPropertyName, aOperator, aValue):
+        return aQuery.filter("%s %s" % (aPropertyName, aOperator), aValue)
+
+    @classmethod
+    def Order(cls, aModelClass, aQuery, aPropertyName, aDescending = False):
+        return aQuery.order("-%s" % aPropertyName if aDescending else aPropertyName)
+
+    @classmethod
+    def FetchPageAsync(cls, aQuery, aPageSize, aCursor = None):
+        """
+        Fetches a page of results. The future's result is a triple of list of results, cursor string for the next page,
+        and whether there may be more.
+        """
+        if aCursor:
+            aQuery.with_cursor(aCursor)
+        lresults = aQuery.fetch(aPageSize)
+        return DoneFuture((lresults, aQuery.cursor(), len(lresults) >= aPageSize))
+
+    @classmethod
+    def RunInTransaction(cls, aFunc):
+        return db.run_in_transaction_options(db.create_transaction_options(xg = True), aFunc)
+
+class NdbBackend:
+    SUPPORTEDTYPES = [
+            ndb.IntegerProperty,
+            ndb.FloatProperty,
+            ndb.BooleanProperty,
+            ndb.StringProperty,
+            ndb.DateTimeProperty,
+            ndb.DateProperty
+    ]
+    DATETIMETYPE = ndb.DateTimeProperty
+    DATETYPE = ndb.DateProperty
+
+    METATYPENAMES = {
+        ndb.IntegerProperty: "int",
+        ndb.FloatProperty: "float",
+        ndb.BooleanProperty: "bool",
+        ndb.StringProperty: "string",
+        ndb.DateTimeProperty: "datetime",
+        ndb.DateProperty: "date"
+    }
+
+    _properties = {}
+
+    @classmethod
+    def Handles(cls, aModelClass):
+        return issubclass(aModelClass, ndb.Model)
+
+    @classmethod
+    def Kind(cls, aModelClass):
+        return aModelClass._get_kind()
+
+    @classmethod
+    def Properties(cls, aModelClass):
+        # ndb keys _properties by datastore name, we want python attribute names
+        retval = cls._properties.get(aModelClass)
+        if retval is None:
+            retval = dict((lprop._code_name, lprop) for lprop in aModelClass._properties.values())
+            cls._properties[aModelClass] = retval
+        return retval
+
+    @classmethod
+    def IsIndexed(cls, aProperty):
+        return aProperty._indexed
+
+    @classmethod
+    def IsAutoNow(cls, aProperty):
+        return getattr(aProperty, "_auto_now", False)
+
+    @classmethod
+    def IsAutoNowAdd(cls, aProperty):
+        return getattr(aProperty, "_auto_now_add", False)
+
+    @classmethod
+    def MetaTypeName(cls, aProperty):
+        return cls.METATYPENAMES.get(type(aProperty), type(aProperty).__name__)
+
+    @classmethod
+    def Id(cls, aModel):
+        return aModel.key.id()
+
+    @classmethod
+    def IsSaved(cls, aModel):
+        # new models with a parent have an incomplete key
+        return aModel.key is not None and aModel.key.id() is not None
+
+    @classmethod
+    def MakeKey(cls, aModelClass, aId, aParent = None):
+        return ndb.Key(aModelClass._get_kind(), aId, parent = aParent)
+
+    @classmethod
+    def AllocateIds(cls, aModelClass, aCount, aParent = None):
+        lfirst, llast = aModelClass.allocate_ids(size = aCount, parent = aParent)
+        return range(lfirst, llast + 1)
+
+    @classmethod
+    def New(cls, aModelClass, aKey):
+        """
+        A new model with the key aKey
+        """
+        return aModelClass(key = aKey)
+
+    @classmethod
+    def Copy(cls, aModel, aKey):
+        """
+        A new model with the key aKey, and the same property values as aModel
+        """
+        retval = cls.New(type(aModel), aKey)
+        retval.populate(**dict((lname, getattr(aModel, lname)) for lname, lprop in cls.Properties(type(aModel)).items()
+                                    if not isinstance(lprop, ndb.ComputedProperty)))
+        return retval
+
+    @classmethod
+    def GetByIdAsync(cls, aModelClass, aId, aParent = None):
+        return aModelClass.get_by_id_async(aId, parent = aParent)
+
+    @classmethod
+    def GetMultiAsync(cls, aKeys):
+        return ListFuture(ndb.get_multi_async(aKeys))
+
+    @classmethod
+    def PutMultiAsync(cls, aModels):
+        return ListFuture(ndb.put_multi_async(aModels))
+
+    @classmethod
+    def DeleteMultiAsync(cls, aModelsOrKeys):
+        return ListFuture(ndb.delete_multi_async([KeyOf(lmodelOrKey) for lmodelOrKey in aModelsOrKeys]))
+
+    @classmethod
+    def Query(cls, aModelClass, aProjection = None, aKeysOnly = False, aAncestor = None):
+        if aProjection:
+            return aModelClass.query(ancestor = aAncestor, projection = aProjection)
+        elif aKeysOnly:
+            return aModelClass.query(ancestor = aAncestor, default_options = ndb.QueryOptions(keys_only = True))
+        else:
+            return aModelClass.query(ancestor = aAncestor)
+
+    @classmethod
+    def Filter(cls, aModelClass, aQuery, aPropertyName, aOperator, aValue):
+        lproperty = cls.Properties(aModelClass)[aPropertyName]
+        return aQuery.filter(getattr(lproperty, NDBOPERATORS[aOperator])(aValue))
+
+    @classmethod
+    def Order(cls, aModelClass, aQuery, aPropertyName, aDescending = False):
+        lproperty = cls.Properties(aModelClass)[aPropertyName]
+        return aQuery.order(-lproperty if aDescending else lproperty)
+
+    @classmethod
+    def FetchPageAsync(cls, aQuery, aPageSize, aCursor = None):
+        """
+        Fetches a page of results. The future's result is a triple of list of results, cursor string for the next page,
+        and whether there may be more.
+        """
+        lcursor = None
+        if aCursor:
+            lcursor = Cursor(urlsafe = aCursor)
+        return MappedFuture(
+            aQuery.fetch_page_async(aPageSize, start_cursor = lcursor),
+            lambda lresult: (lresult[0], lresult[1].urlsafe() if lresult[1] else None, lresult[2]))
+
+    @classmethod
+    def RunInTransaction(cls, aFunc):
+        return ndb.transaction(aFunc, xg = True)
+
+BACKENDS = [NdbBackend, DbBackend]
+
+def GetBackend(aModelClass):
+    """
+    The backend class for aModelClass
+    """
+    for lbackend in BACKENDS:
+        if lbackend.Handles(aModelClass):
+            return lbackend
+    raise TypeError("%s is not a db or ndb model class" % aModelClass.__name__)
+
+def GetBackendOf(aModelOrKey):
+    """
+    The backend class for a model instance or key
+    """
+    if isinstance(aModelOrKey, (ndb.Key, ndb.Model)):
+        return NdbBackend
+    else:
+        return DbBackend
+
+def KeyOf(aModelOrKey):
+    """
+    The key of a db or ndb model, or the key itself if it's already a key.
+
+    db and ndb keys both have kind().
+    """
+    if isinstance(aModelOrKey, (db.Key, ndb.Key)):
+        return aModelOrKey
+    elif isinstance(aModelOrKey, ndb.Model):
+        return aModelOrKey.key
+    else:
+        return aModelOrKey.key()
+
+def KeyIdOrName(aKey):
+    """
+    The id or name of a db or ndb key
+    """
+    if isinstance(aKey, ndb.Key):
+        return aKey.id()
+    else:
+        return aKey.id_or_name()
+
+def ParentOf(aModelOrKey):
+    """
+    The parent key of a db or ndb model or key, or None. Works for models which haven't been saved yet.
+    """
+    if isinstance(aModelOrKey, ndb.Model):
+        return aModelOrKey.key.parent() if aModelOrKey.key else None
+    elif isinstance(aModelOrKey, db.Model):
+        return aModelOrKey.parent_key()
+    else:
+        return aModelOrKey.parent()
+
+def RootOf(aModelOrKey):
+    """
+    The key of the root of a db or ndb model or key's entity group. None for a model with no parent which hasn't
+    been saved yet, as it will be the root of a new group.
+    """
+    lparent = ParentOf(aModelOrKey)
+    if lparent is None:
+        if isinstance(aModelOrKey, (db.Key, ndb.Key)) or GetBackendOf(aModelOrKey).IsSaved(aModelOrKey):
+            return KeyOf(aModelOrKey)
+        return None
+    while lparent.parent() is not None:
+        lparent = lparent.parent()
+    return lparent
+
+def KeyString(aKey):
+    """
+    A string which identifies a db or ndb key, for building other keys (memcache, key names) from. "" for None.
+    """
+    if aKey is None:
+        return ""
+    elif isinstance(aKey, ndb.Key):
+        return aKey.urlsafe()
+    else:
+        return str(aKey)
+
+def ToNdbKey(aKey):
+    """
+    aKey as an ndb key, for making Sleepy's own (ndb) entities children of db entities
+    """
+    if aKey is None or isinstance(aKey, ndb.Key):
+        return aKey
+    return ndb.Key.from_old_key(aKey)
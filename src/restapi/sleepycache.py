@@ -0,0 +1,179 @@
+'''
+Memcache read-through cache for Sleepy resources.
+
+Two kinds of entry are cached:
+
+- single entities, under a key per entity. The value is a dictionary of variant to (ETag, serialized json), where the
+  variant identifies the template (and caller scope) used to serialize it. Writes delete the key, with a lock period
+  so that a reader which fetched the old entity before the write can't put it back.
+
+- collection responses, under a key which includes a generation number for the model class. Any write bumps
+  the generation, which drops every collection entry for the class in one shot without having to find them.
+
+Entities partitioned by owner (see Sleepy.GetOwnerKey) are cached per owner: the kind passed in is Scope(kind, owner),
+so one owner's writes don't drop everyone else's collections.
+'''
+import hashlib
+import logging
+import time
+import urllib
+from google.appengine.api import memcache
+from sleepybackend import KeyOf, KeyIdOrName, KeyString
+
+class SleepyCache:
+    # seconds after an invalidation during which stale entity entries can't be re-added
+    LOCKSECONDS = 5
+
+    # largest value we'll try to cache. Memcache values are limited to 1MB.
+    MAXVALUESIZE = 900000
+
+    # hit / miss counters, by kind. These are per instance.
+    _stats = {}
+
+    @classmethod
+    def GetTtl(cls, aRestHandler, *args, **kwargs):
+        """
+        The number of seconds to cache responses for aRestHandler, or None if it doesn't cache.
+
+        Handlers turn caching on by implementing GetCacheTtl(). As cached responses are served without
+        calling IsAuthorized, a handler which implements IsAuthorized must also implement GetCacheScope(*args, **kwargs),
+        returning a string which distinguishes callers that can see different things; otherwise it isn't cached.
+        """
+        retval = None
+        if hasattr(aRestHandler, "GetCacheTtl"):
+            retval = aRestHandler.GetCacheTtl()
+            if retval and hasattr(aRestHandler, "IsAuthorized") and not hasattr(aRestHandler, "GetCacheScope"):
+                retval = None
+        return retval or None
+
+    @classmethod
+    def GetVariant(cls, aRestHandler, aTemplate, *args, **kwargs):
+        """
+        A short string identifying how a handler serializes its entities for this caller.
+        """
+        lscope = ""
+        if hasattr(aRestHandler, "GetCacheScope"):
+            lscope = aRestHandler.GetCacheScope(*args, **kwargs) or ""
+        lfields = ",".join(sorted(aTemplate)) if aTemplate else ""
+        return hashlib.md5((u"%s|%s" % (lscope, lfields)).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def Scope(cls, aKind, aOwnerKey):
+        """
+        The kind to cache entities of aKind under, for the owner aOwnerKey (which may be None)
+        """
+        if aOwnerKey is None:
+            return aKind
+        return "%s|%s" % (aKind, KeyString(aOwnerKey))
+
+    @classmethod
+    def EntityKey(cls, aKind, aId):
+        return "sleepy|e|%s|%s" % (aKind, aId)
+
+    @classmethod
+    def GenerationKey(cls, aKind):
+        return "sleepy|g|%s" % aKind
+
+    @classmethod
+    def CollectionKey(cls, aKind, aGeneration, aVariant, aRequest):
+        lquery = urllib.urlencode(sorted((lname.encode("utf-8"), lvalue.encode("utf-8")) for lname, lvalue in aRequest.GET.items()))
+        return "sleepy|c|%s|%s|%s" % (aKind, aGeneration, hashlib.md5("%s|%s" % (aVariant, lquery)).hexdigest())
+
+    @classmethod
+    def CollectionETag(cls, aKind, aGeneration, aVariant, aRequest):
+        """
+        An ETag for a collection response. It changes whenever the generation does, so it needs no query to compute.
+        """
+        return '"%s"' % hashlib.md5(cls.CollectionKey(aKind, aGeneration, aVariant, aRequest)).hexdigest()
+
+    @classmethod
+    def GetGeneration(cls, aKind):
+        """
+        The current generation number for aKind. This changes whenever any entity of aKind is written.
+
+        If the number has been evicted it's restarted from the clock, so it won't repeat an old value.
+        Returns None if memcache can't be reached; then there's nothing to tell one generation from the next,
+        so collection ETags and cached collections mustn't be used.
+        """
+        lkey = cls.GenerationKey(aKind)
+        retval = memcache.get(lkey)
+        if retval is None:
+            memcache.add(lkey, int(time.time() * 1000))
+            retval = memcache.get(lkey)
+        return retval
+
+    @classmethod
+    def GetEntity(cls, aKind, aId, aVariant):
+        """
+        Returns the cached (ETag, json) pair for an entity, or None.
+        """
+        lentry = memcache.get(cls.EntityKey(aKind, aId))
+        retval = lentry.get(aVariant) if lentry else None
+        cls.Count(aKind, retval is not None)
+        return retval
+
+    @classmethod
+    def SetEntity(cls, aKind, aId, aVariant, aETagAndJson, aTtl):
+        if len(aETagAndJson[1]) > cls.MAXVALUESIZE:
+            return
+        lkey = cls.EntityKey(aKind, aId)
+        lclient = memcache.Client()
+        lentry = lclient.gets(lkey)
+        if lentry is None:
+            # add rather than set, so this fails while the key is locked after a write
+            lclient.add(lkey, {aVariant: aETagAndJson}, time = aTtl)
+        else:
+            # if someone else got in first, don't worry about it
+            lentry[aVariant] = aETagAndJson
+            lclient.cas(lkey, lentry, time = aTtl)
+
+    @classmethod
+    def GetCollection(cls, aKey, aKind):
+        """
+        Returns a cached collection response as a pair of headers dict, body, or None.
+        """
+        retval = memcache.get(aKey)
+        cls.Count(aKind, retval is not None)
+        return retval
+
+    @classmethod
+    def SetCollection(cls, aKey, aHeaders, aBody, aTtl):
+        if len(aBody) > cls.MAXVALUESIZE:
+            return
+        try:
+            memcache.set(aKey, (aHeaders, aBody), time = aTtl)
+        except Exception, ex:
+            logging.warning("couldn't cache collection: %s" % ex)
+
+    @classmethod
+    def Invalidate(cls, aModelsOrKeys):
+        """
+        Drops cached entries for a set of written or deleted models (or keys), db or ndb.
+
+        Must be called after the datastore write, not before.
+        """
+        lentityKeys = []
+        lkinds = set()
+        for lmodelOrKey in aModelsOrKeys:
+            lkey = KeyOf(lmodelOrKey)
+            lkind = cls.Scope(lkey.kind(), lkey.parent())
+            lkinds.add(lkind)
+            lentityKeys.append(cls.EntityKey(lkind, KeyIdOrName(lkey)))
+
+        if lentityKeys:
+            memcache.delete_multi(lentityKeys, seconds = cls.LOCKSECONDS)
+        for lkind in lkinds:
+            memcache.incr(cls.GenerationKey(lkind), initial_value = int(time.time() * 1000))
+
+    @classmethod
+    def Count(cls, aKind, aHit):
+        # counted by kind, not by owner
+        lstats = cls._stats.setdefault(aKind.split("|", 1)[0], {"hits": 0, "misses": 0})
+        lstats["hits" if aHit else "misses"] += 1
+
+    @classmethod
+    def GetStats(cls):
+        """
+        Hit and miss counts by kind, since this instance started.
+        """
+        return dict((lkind, dict(lstats)) for lkind, lstats in cls._stats.items())
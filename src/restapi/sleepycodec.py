@@ -0,0 +1,208 @@
+'''
+Compiled converters between models and Jsonables, used by Sleepy.
+
+Working out how to convert a model means reflecting over its properties and its template, which is
+far more expensive than the conversion itself. A SleepyCodec does that work once per
+(model class, template) and keeps the result, so converting each row is straight line code.
+'''
+import calendar
+import datetime
+import hashlib
+from sleepybackend import GetBackend
+
+DATETIMEFORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+DATETIMEFORMATNOFRACTION = '%Y-%m-%dT%H:%M:%SZ'
+DATEFORMAT = '%Y-%m-%dZ'
+
+def FormatDateOrDateTime(aValue):
+    ldateString = aValue.isoformat()
+    # kludgy fix
+    if not hasattr(aValue, "utcoffset") or not aValue.utcoffset():
+        ldateString = ("%sZ" % ldateString)
+    return ldateString
+
+def ParseDateTimeString(aString):
+    try:
+        return datetime.datetime.strptime(aString, DATETIMEFORMAT)
+    except ValueError:
+        # isoformat() leaves out the fraction when microseconds are 0, so accept that too
+        return datetime.datetime.strptime(aString, DATETIMEFORMATNOFRACTION)
+
+def ParseDateString(aString):
+    return datetime.datetime.strptime(aString, DATEFORMAT).date()
+
+class SleepyCodec:
+    # parsers for incoming values, by property type. Other supported types are passed through.
+    PARSERS = {
+        "datetime": ParseDateTimeString,
+        "date": ParseDateString
+    }
+
+    # formatters for outgoing values, by property type. Other supported types are passed through.
+    FORMATTERS = {
+        "datetime": FormatDateOrDateTime,
+        "date": FormatDateOrDateTime
+    }
+
+    _codecs = {}
+
+    @classmethod
+    def Get(cls, aModelClass, aTemplate, aDefaultTemplateFunc):
+        """
+        Returns the codec for aModelClass and aTemplate, compiling it the first time it's asked for.
+
+        Only the keys of a template matter, so templates with the same keys share a codec.
+        aDefaultTemplateFunc is called (once) to make a template if aTemplate is None.
+        """
+        lcacheKey = (aModelClass, tuple(sorted(aTemplate)) if aTemplate else None)
+
+        retval = cls._codecs.get(lcacheKey)
+        if not retval:
+            ltemplate = aTemplate
+            if not ltemplate:
+                ltemplate = aDefaultTemplateFunc(aModelClass)
+            retval = SleepyCodec(aModelClass, ltemplate)
+            cls._codecs[lcacheKey] = retval
+        return retval
+
+    def __init__(self, aModelClass, aTemplate):
+        self.modelClass = aModelClass
+        self.backend = GetBackend(aModelClass)
+        self.fields = list(aTemplate)
+        # distinguishes representations made with different templates
+        self.signature = hashlib.md5(",".join(sorted(self.fields))).hexdigest()[:8]
+
+        # datastore properties: lists of (key, converter or None)
+        self._encoders = []
+        self._decoders = []
+        # datastore properties of types we can't convert: key, type name
+        self._unsupported = {}
+        # anything else in the template which isn't a datastore property
+        self._attributes = []
+
+        lproperties = self.backend.Properties(aModelClass)
+
+        # a property which changes on every put, if there is one, gives a cheap version for ETags
+        self.versionKey = None
+        for lkey, lprop in sorted(lproperties.items()):
+            if type(lprop) is self.backend.DATETIMETYPE and self.backend.IsAutoNow(lprop):
+                self.versionKey = lkey
+                break
+
+        for lkey in self.fields:
+            lprop = lproperties.get(lkey)
+            if lprop is None:
+                self._attributes.append(lkey)
+            elif not type(lprop) in self.backend.SUPPORTEDTYPES:
+                self._unsupported[lkey] = type(lprop).__name__
+            else:
+                ltypeName = self.backend.MetaTypeName(lprop)
+                self._encoders.append((lkey, self.FORMATTERS.get(ltypeName)))
+                self._decoders.append((lkey, self.PARSERS.get(ltypeName)))
+
+        self._meta = None
+
+    def Encode(self, aModel):
+        """
+        Creates the Jsonable representation of aModel. See Sleepy.ModelToJsonable
+        """
+        if self._unsupported:
+            raise TypeError("%s not supported" % self._unsupported.values()[0])
+
+        ljsonable = {'id': self.backend.Id(aModel)} # We're going to work with numeric ids as resource identifiers
+
+        for lkey, lformat in self._encoders:
+            lvalue = getattr(aModel, lkey)
+            if lformat and lvalue is not None:
+                lvalue = lformat(lvalue)
+            ljsonable[lkey] = lvalue
+
+        for lkey in self._attributes:
+            # it's some other kind of property.
+            # just guess that it's ok for now
+            if hasattr(aModel, lkey):
+                ljsonable[lkey] = getattr(aModel, lkey)
+
+        return ljsonable
+
+    def Decode(self, aJsonable, aModel):
+        """
+        Updates aModel from the fields in aJsonable. See Sleepy.JsonableToModel
+        
+        Returns the names of the fields whose values changed.
+        """
+        lchanged = []
+
+        for lkey in self._unsupported:
+            if lkey in aJsonable:
+                raise TypeError("Error assigning '%s': %s not supported" % (lkey, self._unsupported[lkey]))
+
+        for lkey, lparse in self._decoders:
+            if lkey in aJsonable:
+                try:
+                    lvalue = aJsonable[lkey]
+                    if lparse and lvalue is not None:
+                        lvalue = lparse(lvalue)
+                    loldValue = getattr(aModel, lkey)
+                    setattr(aModel, lkey, lvalue)
+                    if getattr(aModel, lkey) != loldValue:
+                        lchanged.append(lkey)
+                except Exception, ex:
+                    raise ex.__class__("Error assigning '%s': %s" % (lkey, str(ex)))
+
+        for lkey in self._attributes:
+            if lkey in aJsonable and hasattr(aModel, lkey):
+                try:
+                    loldValue = getattr(aModel, lkey)
+                    setattr(aModel, lkey, aJsonable[lkey])
+                    if getattr(aModel, lkey) != loldValue:
+                        lchanged.append(lkey)
+                except Exception, ex:
+                    raise ex.__class__("Error assigning '%s': %s" % (lkey, str(ex)))
+
+        return lchanged
+
+    def ETag(self, aModel):
+        """
+        A strong ETag for the representation of aModel. 
+        
+        If the model class has an auto_now DateTimeProperty (eg: modified) the ETag is made from that, which is cheap; 
+        otherwise it's a hash of the representation.
+        """
+        if self.versionKey:
+            lversion = getattr(aModel, self.versionKey)
+            if lversion:
+                lversion = calendar.timegm(lversion.utctimetuple()) * 1000000 + lversion.microsecond
+        else:
+            lversion = hashlib.md5(repr(sorted(self.Encode(aModel).items()))).hexdigest()
+        return '"%s-%s-%s"' % (self.backend.Id(aModel), lversion, self.signature)
+
+    def Meta(self):
+        """
+        Describes the schema of the model class, as restricted by the template. See Sleepy.ModelClassToMeta
+        """
+        if self._meta is None:
+            lmeta = {}
+
+            # it'll be convenient to have a blank model instance
+            lmodel = self.modelClass()
+            lproperties = self.backend.Properties(self.modelClass)
+
+            for lkey in self.fields:
+                if not hasattr(lmodel, lkey):
+                    raise ValueError("Incompatible template, field '%s' does not exist in model" % lkey)
+
+                if lkey in lproperties:
+                    lmeta[lkey] = self.backend.MetaTypeName(lproperties[lkey])
+                else:
+                    lpropTypeMethodName = "proptype_%s" % lkey
+                    if hasattr(lmodel, lpropTypeMethodName):
+                        lpropTypeMethod = getattr(lmodel, lpropTypeMethodName)
+                        lpropType = lpropTypeMethod()
+                        lmeta[lkey] = lpropType.__name__.replace("str","string").replace("unicode","string")
+                    else:
+                        lmeta[lkey] = None # not a db field. Don't know anything about it.
+
+            self._meta = lmeta
+
+        return dict(self._meta)
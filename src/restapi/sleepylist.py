@@ -0,0 +1,444 @@
+'''
+List storage: a whole collection kept as one document, rather than as an entity per item. See Sleepy.UseListStorage
+
+ListBackend stores models of ndb model classes this way, behind the same interface as the backends in
+sleepybackend, so Sleepy's handlers read and write lists just as they do entities. Each owner (see
+Sleepy.GetOwnerKey) has a list of each kind, a SleepyList: its items are the models' properties as json, in a
+zlib compressed json array, in a SleepyListChunk. Reading the whole list is then one datastore get, which for
+the few hundred small items of a typical list is much cheaper than a query returning an entity each.
+
+Any write rewrites the document, so writes cost more as the list grows, and as it's one entity group, a list
+takes about one write a second. Lists too big for one entity spill into more chunks, each holding at most
+MAXCHUNKBYTES of json before compression, so they're always under the datastore's 1MB limit. Chunk 0 says how
+many there are, so a list that has spilled takes a second get for the rest.
+'''
+import base64
+import datetime
+import json
+import operator
+import zlib
+from google.appengine.ext import ndb
+from sleepybackend import NdbBackend, DoneFuture, KeyOf, ParentOf, KeyString, ToNdbKey
+from sleepycodec import SleepyCodec, FormatDateOrDateTime
+from sleepymodels import SleepyListChunk
+
+MAXCHUNKBYTES = 900000
+
+# the parent of the chunks of lists with no owner
+ROOTKIND = "SleepyListRoot"
+
+# filter operators Sleepy uses, as python functions
+LISTOPERATORS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge
+}
+
+class SleepyList:
+    def __init__(self, aKind, aOwnerKey):
+        self.kind = aKind
+        self.ownerKey = ToNdbKey(aOwnerKey)
+        # without an owner, all the chunks still need a common parent
+        self.parent = self.ownerKey or ndb.Key(ROOTKIND, aKind)
+        # bumped on every save, 0 if the list has never been saved
+        self.version = 0
+        self._chunksJson = []
+        self._items = None
+        # item id: index in Items(), None until it's needed
+        self._index = None
+
+    def ChunkKey(self, aIndex):
+        return ndb.Key(SleepyListChunk, "%s|%s" % (self.kind, aIndex), parent = self.parent)
+
+    @classmethod
+    def Load(cls, aKind, aOwnerKey):
+        """
+        Reads a list. An empty list (version 0) if it's never been saved.
+        """
+        retval = cls(aKind, aOwnerKey)
+        lhead = retval.ChunkKey(0).get()
+        if lhead:
+            retval.version = lhead.version
+            lchunks = [lhead]
+            if lhead.chunk_count > 1:
+                lchunks.extend(ndb.get_multi([retval.ChunkKey(lindex) for lindex in range(1, lhead.chunk_count)]))
+            retval._chunksJson = [zlib.decompress(lchunk.data) for lchunk in lchunks]
+        return retval
+
+    @classmethod
+    def OwnerKeys(cls, aKind):
+        """
+        The owner keys of the saved lists of aKind, ordered by KeyString. None, for the list with no owner, always
+        comes first, whether or not it's been saved. The rest are found by a query, so are eventually consistent.
+        """
+        lheadKeys = SleepyListChunk.query(SleepyListChunk.kind_name == aKind).fetch(keys_only = True)
+        lownerKeys = [lheadKey.parent() for lheadKey in lheadKeys if lheadKey.parent().kind() != ROOTKIND]
+        return [None] + sorted(lownerKeys, key = KeyString)
+
+    def Items(self):
+        """
+        The items, as a list of Jsonables in id order. Change them with Put() and Remove(), then Save().
+        """
+        if self._items is None:
+            self._items = []
+            for ljson in self._chunksJson:
+                self._items.extend(json.loads(ljson))
+        return self._items
+
+    def Find(self, aId):
+        """
+        The index in Items() of the item with id aId, or None
+        """
+        if self._index is None:
+            self._index = dict((litem["id"], lindex) for lindex, litem in enumerate(self.Items()))
+        return self._index.get(aId)
+
+    def Put(self, aItem):
+        """
+        Adds aItem, or replaces the item with its id
+        """
+        litems = self.Items()
+        lindex = self.Find(aItem["id"])
+        if lindex is not None:
+            litems[lindex] = aItem
+        elif not litems or litems[-1]["id"] < aItem["id"]:
+            # new ids are usually the highest yet
+            self._index[aItem["id"]] = len(litems)
+            litems.append(aItem)
+        else:
+            litems.append(aItem)
+            litems.sort(key = lambda litem: litem["id"])
+            self._index = None
+
+    def Remove(self, aId):
+        """
+        Removes the item with id aId, if there is one
+        """
+        lindex = self.Find(aId)
+        if lindex is not None:
+            self.Items().pop(lindex)
+            self._index = None
+
+    def Save(self):
+        """
+        Writes the list. Only chunks whose content has changed are put, along with chunk 0, and chunks the list
+        no longer needs are deleted. Call it in a transaction, with the Load() it follows.
+        """
+        lchunksJson = []
+        lcurrent = []
+        # the brackets, and a comma after each item but the last
+        lsize = 1
+        for litem in self.Items():
+            ljson = json.dumps(litem, separators = (',', ':'))
+            if len(ljson) > MAXCHUNKBYTES:
+                raise ValueError("item is too big to store")
+            if lcurrent and lsize + len(ljson) + 1 > MAXCHUNKBYTES:
+                lchunksJson.append("[%s]" % ",".join(lcurrent))
+                lcurrent = []
+                lsize = 1
+            lcurrent.append(ljson)
+            lsize += len(ljson) + 1
+        lchunksJson.append("[%s]" % ",".join(lcurrent))
+
+        self.version += 1
+        lputChunks = []
+        for lindex, ljson in enumerate(lchunksJson):
+            if lindex == 0 or lindex >= len(self._chunksJson) or self._chunksJson[lindex] != ljson:
+                lputChunks.append(SleepyListChunk(key = self.ChunkKey(lindex), data = zlib.compress(ljson)))
+        lputChunks[0].kind_name = self.kind
+        lputChunks[0].chunk_count = len(lchunksJson)
+        lputChunks[0].version = self.version
+
+        lfutures = ndb.put_multi_async(lputChunks)
+        if len(self._chunksJson) > len(lchunksJson):
+            lfutures.extend(ndb.delete_multi_async([self.ChunkKey(lindex) for lindex in range(len(lchunksJson), len(self._chunksJson))]))
+        for lfuture in lfutures:
+            lfuture.get_result()
+
+        self._chunksJson = lchunksJson
+
+class ListQuery:
+    """
+    A query on lists, see ListBackend.Query
+    """
+    def __init__(self, aModelClass, aKeysOnly, aAncestor):
+        self.modelClass = aModelClass
+        self.keysOnly = aKeysOnly
+        self.ancestor = aAncestor
+        # (property name, operator, value)
+        self.filters = []
+        # (property name, descending)
+        self.orders = []
+
+class ListBackend(NdbBackend):
+    """
+    Stores models of ndb model classes in lists (see SleepyList) rather than as entities. Models keep the keys
+    they'd have as entities, under their owner, and ids are allocated as they would be, but the models are never
+    put: their properties are encoded into their list, and decoded from it when they're read. So ndb's hooks
+    don't run, and auto_now and auto_now_add properties are set here, as a put would set them. Only properties
+    of SUPPORTEDTYPES can be kept.
+
+    Writes are done in a transaction, their own if they're not already in one. Lists read in a transaction are
+    kept until it ends, so that everything it does sees its own writes. The first time a list is read it's made
+    from the entities of its kind under its owner, if there are any.
+
+    Queries are answered from the lists in memory, with the datastore's semantics for filters and orders,
+    including on repeated properties; projections are ignored. A query with an ancestor reads its list. One
+    without, which Sleepy's tasks run across every owner, reads every list of the kind, one at a time (see
+    SleepyList.OwnerKeys), and is only ordered within each. Cursors hold the place of the last result, rather
+    than its position, so a query carries on from the right place whatever's been written since.
+    """
+    _templates = {}
+
+    @classmethod
+    def Codec(cls, aModelClass):
+        """
+        The codec items are kept as: every property of a type it supports
+        """
+        ltemplate = cls._templates.get(aModelClass)
+        if ltemplate is None:
+            ltemplate = dict((lname, None) for lname, lprop in cls.Properties(aModelClass).items()
+                                if type(lprop) in cls.SUPPORTEDTYPES)
+            cls._templates[aModelClass] = ltemplate
+        return SleepyCodec.Get(aModelClass, ltemplate, None)
+
+    @classmethod
+    def ToModel(cls, aModelClass, aOwnerKey, aItem):
+        retval = aModelClass(key = cls.MakeKey(aModelClass, aItem["id"], aOwnerKey))
+        cls.Codec(aModelClass).Decode(aItem, retval)
+        return retval
+
+    @classmethod
+    def Stamp(cls, aModel, aNow):
+        """
+        Sets aModel's auto_now properties, and its auto_now_add ones if they aren't set, to aNow
+        """
+        for lname, lprop in cls.Properties(type(aModel)).items():
+            if cls.IsAutoNow(lprop) or (cls.IsAutoNowAdd(lprop) and getattr(aModel, lname) is None):
+                setattr(aModel, lname, aNow.date() if type(lprop) is cls.DATETYPE else aNow)
+
+    @classmethod
+    def GetList(cls, aModelClass, aOwnerKey):
+        """
+        The list of aModelClass under aOwnerKey. In a transaction it's read once, and the same list is returned
+        until the transaction ends.
+        """
+        if not ndb.in_transaction():
+            return cls.LoadList(aModelClass, aOwnerKey)
+        # each try of a transaction has a context of its own
+        lcontext = ndb.get_context()
+        llists = getattr(lcontext, "_sleepyLists", None)
+        if llists is None:
+            llists = lcontext._sleepyLists = {}
+        lkey = (cls.Kind(aModelClass), KeyString(aOwnerKey))
+        retval = llists.get(lkey)
+        if retval is None:
+            retval = llists[lkey] = cls.LoadList(aModelClass, aOwnerKey)
+        return retval
+
+    @classmethod
+    def LoadList(cls, aModelClass, aOwnerKey):
+        """
+        Reads a list. One that has never been saved is made from the entities of aModelClass under aOwnerKey
+        (with no parent if it's None), and saved, even if it's empty, so that's only done once. The entities
+        are left as they are.
+        """
+        lkind = cls.Kind(aModelClass)
+        retval = SleepyList.Load(lkind, aOwnerKey)
+        if retval.version:
+            return retval
+
+        def lmake():
+            llist = SleepyList.Load(lkind, aOwnerKey)
+            if not llist.version:
+                lcodec = cls.Codec(aModelClass)
+                if aOwnerKey is None:
+                    # not an ancestor query, so it can't be in the transaction
+                    lentities = ndb.non_transactional(aModelClass.query().fetch)()
+                    lentities = [lentity for lentity in lentities if lentity.key.parent() is None]
+                else:
+                    lentities = aModelClass.query(ancestor = aOwnerKey).fetch()
+                for lentity in lentities:
+                    llist.Put(lcodec.Encode(lentity))
+                llist.Save()
+            return llist
+
+        if ndb.in_transaction():
+            return lmake()
+        return cls.RunInTransaction(lmake)
+
+    @classmethod
+    def Write(cls, aFunc):
+        if ndb.in_transaction():
+            return DoneFuture(aFunc())
+        return DoneFuture(cls.RunInTransaction(aFunc))
+
+    @classmethod
+    def GetByIdAsync(cls, aModelClass, aId, aParent = None):
+        llist = cls.GetList(aModelClass, aParent)
+        lindex = llist.Find(aId)
+        return DoneFuture(None if lindex is None else cls.ToModel(aModelClass, aParent, llist.Items()[lindex]))
+
+    @classmethod
+    def GetMultiAsync(cls, aKeys):
+        retval = []
+        for lkey in aKeys:
+            lmodelClass = ndb.Model._lookup_model(lkey.kind())
+            retval.append(cls.GetByIdAsync(lmodelClass, lkey.id(), lkey.parent()).get_result())
+        return DoneFuture(retval)
+
+    @classmethod
+    def PutMultiAsync(cls, aModels):
+        def lput():
+            # new models, by model class and parent, so each group's ids are allocated together
+            lnew = {}
+            for lmodel in aModels:
+                if not cls.IsSaved(lmodel):
+                    lnew.setdefault((type(lmodel), KeyString(ParentOf(lmodel))), []).append(lmodel)
+            for lmodels in lnew.values():
+                lmodelClass = type(lmodels[0])
+                lparent = ParentOf(lmodels[0])
+                # the datastore's allocator, which can't run in the transaction, so a retry can't reuse an id
+                lids = ndb.non_transactional(cls.AllocateIds)(lmodelClass, len(lmodels), lparent)
+                for lmodel, lid in zip(lmodels, lids):
+                    lmodel.key = cls.MakeKey(lmodelClass, lid, lparent)
+
+            lnow = datetime.datetime.utcnow()
+            llists = {}
+            for lmodel in aModels:
+                llist = cls.GetList(type(lmodel), ParentOf(lmodel))
+                cls.Stamp(lmodel, lnow)
+                llist.Put(cls.Codec(type(lmodel)).Encode(lmodel))
+                llists[id(llist)] = llist
+            for llist in llists.values():
+                llist.Save()
+            return [lmodel.key for lmodel in aModels]
+        return cls.Write(lput)
+
+    @classmethod
+    def DeleteMultiAsync(cls, aModelsOrKeys):
+        def ldelete():
+            llists = {}
+            for lkey in [KeyOf(lmodelOrKey) for lmodelOrKey in aModelsOrKeys]:
+                llist = cls.GetList(ndb.Model._lookup_model(lkey.kind()), lkey.parent())
+                llist.Remove(lkey.id())
+                llists[id(llist)] = llist
+            for llist in llists.values():
+                llist.Save()
+            return [None] * len(aModelsOrKeys)
+        return cls.Write(ldelete)
+
+    @classmethod
+    def Query(cls, aModelClass, aProjection = None, aKeysOnly = False, aAncestor = None):
+        return ListQuery(aModelClass, aKeysOnly, aAncestor)
+
+    @classmethod
+    def Filter(cls, aModelClass, aQuery, aPropertyName, aOperator, aValue):
+        # a KeyError for an unknown property, as from NdbBackend
+        cls.Properties(aModelClass)[aPropertyName]
+        aQuery.filters.append((aPropertyName, LISTOPERATORS[aOperator], aValue))
+        return aQuery
+
+    @classmethod
+    def Order(cls, aModelClass, aQuery, aPropertyName, aDescending = False):
+        # a KeyError for an unknown property, as from NdbBackend
+        cls.Properties(aModelClass)[aPropertyName]
+        aQuery.orders.append((aPropertyName, aDescending))
+        return aQuery
+
+    @classmethod
+    def Matches(cls, aValue, aOperator, aFilterValue):
+        # like the datastore, a filter matches a repeated property if it matches any of its values
+        if isinstance(aValue, list):
+            return any(aOperator(lvalue, aFilterValue) for lvalue in aValue)
+        return aOperator(aValue, aFilterValue)
+
+    @classmethod
+    def CompareSortKeys(cls, aQuery, aSortKey, aOtherSortKey):
+        """
+        Compares sort keys, (values of the query's orders, id), in the query's order. Ties go by id, as ties in
+        datastore queries go by key.
+        """
+        for lvalue, lotherValue, (_, ldescending) in zip(aSortKey[0], aOtherSortKey[0], aQuery.orders):
+            retval = cmp(lvalue, lotherValue)
+            if retval:
+                return -retval if ldescending else retval
+        return cmp(aSortKey[1], aOtherSortKey[1])
+
+    @classmethod
+    def Select(cls, aQuery, aOwnerKey):
+        """
+        The models in aOwnerKey's list which match aQuery, in its order, as a list of (sort key, model)
+        """
+        llist = cls.GetList(aQuery.modelClass, aOwnerKey)
+        retval = []
+        for litem in llist.Items():
+            lmodel = cls.ToModel(aQuery.modelClass, aOwnerKey, litem)
+            if all(cls.Matches(getattr(lmodel, lname), loperator, lvalue) for lname, loperator, lvalue in aQuery.filters):
+                lsortKey = (tuple(getattr(lmodel, lname) for lname, _ in aQuery.orders), litem["id"])
+                retval.append((lsortKey, lmodel))
+        retval.sort(cmp = lambda lselected, lother: cls.CompareSortKeys(aQuery, lselected[0], lother[0]))
+        return retval
+
+    @classmethod
+    def MakeCursor(cls, aOwnerKey, aSortKey):
+        lvalues = [FormatDateOrDateTime(lvalue) if hasattr(lvalue, "isoformat") else lvalue for lvalue in aSortKey[0]]
+        return base64.urlsafe_b64encode(json.dumps([KeyString(aOwnerKey), lvalues, aSortKey[1]]))
+
+    @classmethod
+    def ParseCursor(cls, aQuery, aCursor):
+        """
+        The owner's KeyString and the sort key in a cursor from MakeCursor. Raises ValueError if it isn't one, or
+        isn't for aQuery's orders.
+        """
+        try:
+            lowner, lvalues, lid = json.loads(base64.urlsafe_b64decode(str(aCursor)))
+            if len(lvalues) != len(aQuery.orders):
+                raise ValueError()
+            lproperties = cls.Properties(aQuery.modelClass)
+            for lindex, (lname, _) in enumerate(aQuery.orders):
+                lparse = SleepyCodec.PARSERS.get(cls.MetaTypeName(lproperties[lname]))
+                if lparse and lvalues[lindex] is not None:
+                    lvalues[lindex] = lparse(lvalues[lindex])
+            return lowner, (tuple(lvalues), lid)
+        except (TypeError, ValueError):
+            raise ValueError("invalid cursor")
+
+    @classmethod
+    def FetchPageAsync(cls, aQuery, aPageSize, aCursor = None):
+        """
+        Fetches a page of results. The future's result is a triple of list of results, cursor string for the next page,
+        and whether there may be more.
+        """
+        lafterOwner, lafter = "", None
+        if aCursor:
+            lafterOwner, lafter = cls.ParseCursor(aQuery, aCursor)
+
+        if aQuery.ancestor is not None:
+            lownerKeys = [aQuery.ancestor]
+        else:
+            # lists before the cursor's are done
+            lownerKeys = [lownerKey for lownerKey in SleepyList.OwnerKeys(cls.Kind(aQuery.modelClass))
+                            if KeyString(lownerKey) >= lafterOwner]
+
+        lselected = []
+        lmore = False
+        for lindex, lownerKey in enumerate(lownerKeys):
+            lownerSelected = [(lownerKey, lsortKey, lmodel) for lsortKey, lmodel in cls.Select(aQuery, lownerKey)]
+            if lafter and KeyString(lownerKey) == lafterOwner:
+                lownerSelected = [lselection for lselection in lownerSelected if cls.CompareSortKeys(aQuery, lselection[1], lafter) > 0]
+            lselected.extend(lownerSelected)
+            if len(lselected) >= aPageSize:
+                lmore = len(lselected) > aPageSize or lindex < len(lownerKeys) - 1
+                lselected = lselected[:aPageSize]
+                break
+
+        lcursor = aCursor
+        if lselected:
+            lownerKey, lsortKey, _ = lselected[-1]
+            lcursor = cls.MakeCursor(lownerKey, lsortKey)
+        lresults = [lmodel.key if aQuery.keysOnly else lmodel for _, _, lmodel in lselected]
+        return DoneFuture((lresults, lcursor, lmore))
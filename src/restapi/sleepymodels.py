@@ -0,0 +1,83 @@
+'''
+Datastore models Sleepy uses for its own bookkeeping.
+'''
+from google.appengine.ext import ndb
+
+class SleepyTombstone(ndb.Model):
+    """
+    Records that an entity was deleted, so delta syncs (GET ?since=) can report it.
+
+    Tombstones are only needed until every client has synced past them; see Sleepy.CollectTombstones
+    
+    A tombstone's parent is the deleted entity's parent, so that owners (see Sleepy.GetOwnerKey) only see their own.
+    """
+    kind_name = ndb.StringProperty()
+    entity_id = ndb.IntegerProperty(indexed = False)
+    deleted = ndb.DateTimeProperty(auto_now_add = True)
+
+class SleepyCounterShard(ndb.Model):
+    """
+    One shard of a counter kept by Sleepy (see Sleepy.GetCounters). A counter's value is the sum of its shards,
+    which are separate entity groups, so that writes to the counter don't contend.
+    
+    Counters are per owner (see Sleepy.GetOwnerKey). aOwner is the owner's KeyString, "" if there isn't one.
+    """
+    count = ndb.IntegerProperty(default = 0, indexed = False)
+
+    @classmethod
+    def GetShardKeys(cls, aKind, aOwner, aCounter, aShards):
+        """
+        Keys of all the shards of a counter of entities of aKind
+        """
+        return [cls.GetShardKey(aKind, aOwner, aCounter, lshard) for lshard in range(aShards)]
+
+    @classmethod
+    def GetShardKey(cls, aKind, aOwner, aCounter, aShard):
+        return ndb.Key(cls, "%s|%s|%s|%s" % (aKind, aOwner, aCounter, aShard))
+
+class SleepyDirtyCounters(ndb.Model):
+    """
+    Marks an owner's counters (see Sleepy.GetCounters) as possibly wrong. It's written before a write which can't
+    update the counters in the same transaction as its entities, and deleted once it's done. One left behind means
+    the write failed part way; Sleepy.RepairDirtyCounters finds them and repairs the counters.
+    """
+    kind_name = ndb.StringProperty()
+    # None if the handler doesn't partition by owner
+    owner = ndb.KeyProperty(indexed = False)
+    created = ndb.DateTimeProperty(auto_now_add = True)
+
+class SleepyJob(ndb.Model):
+    """
+    A bulk operation running in the background, eg: DELETE /todos?done=true. See Sleepy.BulkHandler
+
+    Clients poll it at <resource>/_jobs/<id>. Its parent is the owner of the entities it works on, if they have one.
+    """
+    kind_name = ndb.StringProperty(indexed = False)
+    operation = ndb.StringProperty(indexed = False)
+    status = ndb.StringProperty(indexed = False)
+    processed = ndb.IntegerProperty(default = 0, indexed = False)
+    error = ndb.TextProperty()
+    # where the next page starts; every page before it has been committed
+    cursor = ndb.StringProperty(indexed = False)
+    # the ids in the page being worked on, and where the page after it starts, kept until the page is committed
+    # so that a retry redoes the same page
+    page_ids = ndb.JsonProperty()
+    page_cursor = ndb.StringProperty(indexed = False)
+    # for imports, the number of lines of the body done
+    line = ndb.IntegerProperty(indexed = False)
+    created = ndb.DateTimeProperty(auto_now_add = True, indexed = False)
+    modified = ndb.DateTimeProperty(auto_now = True, indexed = False)
+
+class SleepyListChunk(ndb.Model):
+    """
+    Part of a collection kept in list storage (see Sleepy.UseListStorage and sleepylist): a zlib compressed json
+    array of items. Chunk 0 also holds the list's bookkeeping.
+    
+    A list's chunks share a parent, the owner's key if there is one (see Sleepy.GetOwnerKey), so they're one
+    entity group and can be written in a transaction.
+    """
+    data = ndb.BlobProperty()
+    # the rest are only set on chunk 0. kind_name is indexed so that queries across owners can find every list
+    kind_name = ndb.StringProperty()
+    chunk_count = ndb.IntegerProperty(default = 1, indexed = False)
+    version = ndb.IntegerProperty(default = 0, indexed = False)
@@ -0,0 +1,169 @@
+'''
+Rank strings, for keeping entities in a user defined order that can be changed with one write per move.
+
+A rank is a string. Ranks sort lexicographically (which is how the datastore sorts strings), and there's
+always room for another rank between any two, so moving an item between two others only rewrites the item
+itself, however long the list.
+
+The scheme is the usual "fractional indexing" one. A rank is a base 62 integer part, whose first character
+encodes its length, followed by an optional fraction:
+
+- appending or prepending increments or decrements the integer part, which grows by one character for
+  every factor of 62 in the length of the list
+- inserting between two neighbours takes the midpoint of their fractions, which grows by one character
+  about every six inserts into the same gap. Rebalancing (see Sleepy.RebalanceRanks) resets those.
+'''
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+# the smallest integer part; nothing can be put before a rank starting with it without a fraction
+SMALLESTINTEGER = "A" + DIGITS[0] * 26
+
+def RankBetween(aBefore, aAfter):
+    """
+    A rank which sorts after aBefore and before aAfter. Either can be None, meaning the start or end of the list.
+    """
+    if aBefore is not None:
+        ValidateRank(aBefore)
+    if aAfter is not None:
+        ValidateRank(aAfter)
+    if aBefore is not None and aAfter is not None and aBefore >= aAfter:
+        raise ValueError("ranks out of order: %s >= %s" % (aBefore, aAfter))
+
+    if aBefore is None:
+        if aAfter is None:
+            return "a" + DIGITS[0]
+        lintegerAfter = GetIntegerPart(aAfter)
+        lfractionAfter = aAfter[len(lintegerAfter):]
+        if lintegerAfter == SMALLESTINTEGER:
+            return lintegerAfter + Midpoint("", lfractionAfter)
+        if lintegerAfter < aAfter:
+            return lintegerAfter
+        retval = DecrementInteger(lintegerAfter)
+        if retval is None:
+            raise ValueError("can't rank before %s" % aAfter)
+        return retval
+
+    lintegerBefore = GetIntegerPart(aBefore)
+    lfractionBefore = aBefore[len(lintegerBefore):]
+
+    if aAfter is None:
+        lincremented = IncrementInteger(lintegerBefore)
+        if lincremented is None:
+            return lintegerBefore + Midpoint(lfractionBefore, None)
+        return lincremented
+
+    lintegerAfter = GetIntegerPart(aAfter)
+    lfractionAfter = aAfter[len(lintegerAfter):]
+    if lintegerBefore == lintegerAfter:
+        return lintegerBefore + Midpoint(lfractionBefore, lfractionAfter)
+    lincremented = IncrementInteger(lintegerBefore)
+    if lincremented is None:
+        raise ValueError("can't rank after %s" % aBefore)
+    if lincremented < aAfter:
+        return lincremented
+    return lintegerBefore + Midpoint(lfractionBefore, None)
+
+def RanksAfter(aRank, aCount):
+    """
+    aCount successive ranks after aRank (which can be None for the start of the list)
+    """
+    retval = []
+    lrank = aRank
+    for _ in xrange(aCount):
+        lrank = RankBetween(lrank, None)
+        retval.append(lrank)
+    return retval
+
+def ValidateRank(aRank):
+    if not isinstance(aRank, basestring) or not aRank:
+        raise ValueError("invalid rank: %r" % aRank)
+    if aRank == SMALLESTINTEGER:
+        raise ValueError("invalid rank: %s" % aRank)
+    for lchar in aRank:
+        if not lchar in DIGITS:
+            raise ValueError("invalid rank: %s" % aRank)
+    linteger = GetIntegerPart(aRank)
+    if aRank[len(linteger):][-1:] == DIGITS[0]:
+        raise ValueError("invalid rank: %s" % aRank)
+
+def GetIntegerLength(aHead):
+    if "a" <= aHead <= "z":
+        return ord(aHead) - ord("a") + 2
+    elif "A" <= aHead <= "Z":
+        return ord("Z") - ord(aHead) + 2
+    raise ValueError("invalid rank head: %s" % aHead)
+
+def GetIntegerPart(aRank):
+    llength = GetIntegerLength(aRank[0])
+    if llength > len(aRank):
+        raise ValueError("invalid rank: %s" % aRank)
+    return aRank[:llength]
+
+def Midpoint(aLow, aHigh):
+    """
+    A fraction between aLow and aHigh (None meaning the top). Neither may end in a zero digit.
+    """
+    if aHigh is not None:
+        # skip any common prefix
+        lcommon = 0
+        while (aLow[lcommon] if lcommon < len(aLow) else DIGITS[0]) == aHigh[lcommon]:
+            lcommon += 1
+        if lcommon > 0:
+            return aHigh[:lcommon] + Midpoint(aLow[lcommon:], aHigh[lcommon:])
+
+    ldigitLow = DIGITS.index(aLow[0]) if aLow else 0
+    ldigitHigh = DIGITS.index(aHigh[0]) if aHigh is not None else len(DIGITS)
+    if ldigitHigh - ldigitLow > 1:
+        return DIGITS[(ldigitLow + ldigitHigh + 1) // 2]
+    elif aHigh and len(aHigh) > 1:
+        return aHigh[:1]
+    else:
+        return DIGITS[ldigitLow] + Midpoint(aLow[1:], None)
+
+def IncrementInteger(aInteger):
+    lhead = aInteger[0]
+    ldigits = list(aInteger[1:])
+    lcarry = True
+    for lindex in reversed(xrange(len(ldigits))):
+        ldigit = DIGITS.index(ldigits[lindex]) + 1
+        if ldigit == len(DIGITS):
+            ldigits[lindex] = DIGITS[0]
+        else:
+            ldigits[lindex] = DIGITS[ldigit]
+            lcarry = False
+            break
+    if lcarry:
+        if lhead == "Z":
+            return "a" + DIGITS[0]
+        if lhead == "z":
+            return None
+        lhead = chr(ord(lhead) + 1)
+        if lhead > "a":
+            ldigits.append(DIGITS[0])
+        else:
+            ldigits.pop()
+    return lhead + "".join(ldigits)
+
+def DecrementInteger(aInteger):
+    lhead = aInteger[0]
+    ldigits = list(aInteger[1:])
+    lborrow = True
+    for lindex in reversed(xrange(len(ldigits))):
+        ldigit = DIGITS.index(ldigits[lindex]) - 1
+        if ldigit == -1:
+            ldigits[lindex] = DIGITS[-1]
+        else:
+            ldigits[lindex] = DIGITS[ldigit]
+            lborrow = False
+            break
+    if lborrow:
+        if lhead == "a":
+            return "Z" + DIGITS[-1]
+        if lhead == "A":
+            return None
+        lhead = chr(ord(lhead) - 1)
+        if lhead < "Z":
+            ldigits.append(DIGITS[-1])
+        else:
+            ldigits.pop()
+    return lhead + "".join(ldigits)
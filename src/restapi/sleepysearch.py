@@ -0,0 +1,90 @@
+'''
+Search terms, for finding entities by the words in their text fields with GET <resource>?q=
+
+Text is split into words, which are lower cased and stripped of accents, so "cafe" finds "Cafe" with an acute. Each
+entity keeps its distinct words in a repeated string property (see Sleepy.GetSearchIndex), written along with
+it. A search for several words is an equality filter on that property per word, so only entities with all
+of them match. The datastore answers that by merge joining the property's built in index, without a composite
+index, and its cost depends on the number of matches rather than the size of the list.
+
+The matches are then ranked in memory (see Score), so the number of them ranked is bounded (see
+Sleepy.MAXSEARCHRESULTS). Only whole words match; there's no prefix or fuzzy matching.
+'''
+import re
+import unicodedata
+
+WORDPATTERN = re.compile(r"\w+", re.UNICODE)
+
+# longer words are cut short. Indexed strings are limited to 500 bytes.
+MAXTERMLENGTH = 50
+
+# most terms kept per entity. Each is two index rows, written whenever the entity is.
+MAXTERMS = 200
+
+# most words accepted in a search. Each is another index to merge.
+MAXQUERYWORDS = 8
+
+def Normalize(aText):
+    """
+    aText lower cased, with accents removed
+    """
+    if not isinstance(aText, unicode):
+        aText = aText.decode("utf-8")
+    ldecomposed = unicodedata.normalize("NFKD", aText)
+    return u"".join(lchar for lchar in ldecomposed if not unicodedata.combining(lchar)).lower()
+
+def Words(aText):
+    """
+    The normalized words of aText, in order, repeats included
+    """
+    return [lword[:MAXTERMLENGTH] for lword in WORDPATTERN.findall(Normalize(aText))]
+
+def Distinct(aWords):
+    lseen = set()
+    return [lword for lword in aWords if not (lword in lseen or lseen.add(lword))]
+
+def Terms(aTexts):
+    """
+    The search terms for an entity whose searchable fields have the values aTexts (Nones are skipped): its
+    distinct words, sorted. If there are more than MAXTERMS, the first ones are kept.
+    """
+    lwords = []
+    for ltext in aTexts:
+        if ltext:
+            lwords.extend(Words(ltext))
+    return sorted(Distinct(lwords)[:MAXTERMS])
+
+def QueryWords(aQuery):
+    """
+    The distinct words to search for in a ?q= argument. Raises ValueError if there are none, or too many.
+    """
+    retval = Distinct(Words(aQuery))
+    if not retval:
+        raise ValueError("q must contain at least one word")
+    if len(retval) > MAXQUERYWORDS:
+        raise ValueError("q can have at most %s words" % MAXQUERYWORDS)
+    return retval
+
+def Score(aQuery, aQueryWords, aTexts):
+    """
+    How well an entity whose searchable fields have the values aTexts matches a search, higher being better.
+
+    Every match contains all of the search's words, so this favours texts where they make up more of the text,
+    and texts containing the query as a phrase.
+    """
+    # padded, so the phrase only matches whole words
+    lphrase = u" %s " % u" ".join(Words(aQuery))
+    lquerySet = set(aQueryWords)
+    retval = 0.0
+    lwordCount = 0
+    lmatchCount = 0
+    for ltext in aTexts:
+        if ltext:
+            lwords = Words(ltext)
+            lwordCount += len(lwords)
+            lmatchCount += len([lword for lword in lwords if lword in lquerySet])
+            if lphrase in u" %s " % u" ".join(lwords):
+                retval += 1.0
+    if lwordCount:
+        retval += float(lmatchCount) / lwordCount
+    return retval
@@ -0,0 +1,179 @@
+'''
+Per-request instrumentation: phase timings, RPC counts, and rolling latency histograms by route.
+
+It's off unless the SLEEPYSTATS environment variable is "1" (see env_variables in app.yaml). When it's
+off, main.py doesn't install the middleware, no RPC hook is registered, and SleepyStats.Timed hands back
+the function it's given, so the instrumented code runs as it would without it.
+
+When it's on, SleepyStatsMiddleware wraps the WSGI application. For each request it:
+
+- accumulates time spent in named phases: "datastore" (waiting on datastore RPCs), "serialize" (models to
+  Jsonables), "json" (Jsonables to json) and "render" (page templates)
+- counts RPCs by service, with an API proxy hook
+- adds a Server-Timing header with the above
+- records it all in a history per route and method, which /_stats summarizes (see sleepyadmin)
+'''
+import collections
+import math
+import os
+import threading
+import time
+from google.appengine.api import apiproxy_stub_map
+
+class SleepyStats:
+    enabled = os.environ.get("SLEEPYSTATS") == "1"
+
+    # number of recent requests kept per route and method
+    HISTORYSIZE = 1000
+
+    _local = threading.local()
+    _history = {}
+    _historyLock = threading.Lock()
+    _hookInstalled = False
+
+    @classmethod
+    def Current(cls):
+        """
+        The stats record for the request being handled on this thread, or None if there isn't one.
+        """
+        return getattr(cls._local, "current", None)
+
+    @classmethod
+    def Timed(cls, aPhase, aFunc):
+        """
+        Returns a function which calls aFunc, adding the time it takes to aPhase for the current request.
+
+        If no request is being instrumented it returns aFunc itself, so there's no overhead.
+        """
+        lcurrent = cls.Current()
+        if lcurrent is None:
+            return aFunc
+
+        lphases = lcurrent["phases"]
+        def ltimed(*args, **kwargs):
+            lstart = time.time()
+            try:
+                return aFunc(*args, **kwargs)
+            finally:
+                lphases[aPhase] = lphases.get(aPhase, 0.0) + time.time() - lstart
+        return ltimed
+
+    @classmethod
+    def CountRpc(cls, service, call, request, response):
+        lcurrent = cls.Current()
+        if lcurrent is not None:
+            lrpcs = lcurrent["rpcs"]
+            lrpcs[service] = lrpcs.get(service, 0) + 1
+
+    @classmethod
+    def InstallHook(cls):
+        if not cls._hookInstalled:
+            apiproxy_stub_map.apiproxy.GetPreCallHooks().Append("sleepystats", cls.CountRpc)
+            cls._hookInstalled = True
+
+    @classmethod
+    def GetRoute(cls, aPath):
+        """
+        Groups request paths for the histograms: the first path segment, plus "/:arg" if there's more.
+        eg: /todos/123 and /todos/456 are both /todos/:arg
+        """
+        lparts = aPath.strip("/").split("/", 1)
+        retval = "/" + lparts[0]
+        if len(lparts) > 1 and lparts[1]:
+            retval += "/:arg"
+        return retval
+
+    @classmethod
+    def Begin(cls):
+        cls._local.current = {"phases": {}, "rpcs": {}, "start": time.time()}
+
+    @classmethod
+    def End(cls, aMethod, aPath):
+        """
+        Finishes the current request's record, adds it to the history and returns it.
+        """
+        lcurrent = cls.Current()
+        cls._local.current = None
+        lcurrent["total"] = time.time() - lcurrent.pop("start")
+
+        lkey = (aMethod, cls.GetRoute(aPath))
+        lhistory = cls._history.get(lkey)
+        if lhistory is None:
+            with cls._historyLock:
+                lhistory = cls._history.setdefault(lkey, collections.deque(maxlen = cls.HISTORYSIZE))
+        lhistory.append(lcurrent)
+        return lcurrent
+
+    @classmethod
+    def ServerTiming(cls, aRecord):
+        """
+        A Server-Timing header value for a request record. Durations are in milliseconds.
+        """
+        lmetrics = ["total;dur=%.1f" % (aRecord["total"] * 1000.0)]
+        for lphase, lseconds in sorted(aRecord["phases"].items()):
+            lmetrics.append("%s;dur=%.1f" % (lphase, lseconds * 1000.0))
+        for lservice, lcount in sorted(aRecord["rpcs"].items()):
+            lmetrics.append('rpc-%s;desc="%s calls"' % (lservice, lcount))
+        return ", ".join(lmetrics)
+
+    @classmethod
+    def GetStats(cls):
+        """
+        Summarizes the recent history of each route and method: request count, latency percentiles, and mean
+        phase times and RPC counts. Times are in milliseconds.
+        """
+        retval = {}
+        for (lmethod, lroute), lhistory in cls._history.items():
+            lrecords = list(lhistory)
+            if not lrecords:
+                continue
+            ltotals = sorted(lrecord["total"] for lrecord in lrecords)
+            lphases = {}
+            lrpcs = {}
+            for lrecord in lrecords:
+                for lphase, lseconds in lrecord["phases"].items():
+                    lphases[lphase] = lphases.get(lphase, 0.0) + lseconds
+                for lservice, lcount in lrecord["rpcs"].items():
+                    lrpcs[lservice] = lrpcs.get(lservice, 0) + lcount
+            lcount = float(len(lrecords))
+            retval["%s %s" % (lmethod, lroute)] = {
+                "requests": len(lrecords),
+                "p50": cls.Percentile(ltotals, 50) * 1000.0,
+                "p95": cls.Percentile(ltotals, 95) * 1000.0,
+                "p99": cls.Percentile(ltotals, 99) * 1000.0,
+                "max": ltotals[-1] * 1000.0,
+                "phases": dict((lphase, lseconds * 1000.0 / lcount) for lphase, lseconds in lphases.items()),
+                "rpcs": dict((lservice, lrpcCount / lcount) for lservice, lrpcCount in lrpcs.items())
+            }
+        return retval
+
+    @classmethod
+    def Percentile(cls, aSortedValues, aPercent):
+        # nearest rank
+        lindex = int(math.ceil(aPercent / 100.0 * len(aSortedValues))) - 1
+        return aSortedValues[max(0, min(lindex, len(aSortedValues) - 1))]
+
+class SleepyStatsMiddleware(object):
+    """
+    WSGI middleware which instruments every request to the application it wraps. See SleepyStats.
+    """
+    def __init__(self, aApp):
+        self.app = aApp
+        SleepyStats.InstallHook()
+
+    def __call__(self, environ, start_response):
+        SleepyStats.Begin()
+        lended = [False]
+
+        def lstartResponse(status, headers, exc_info = None):
+            # webapp2 finishes the handler before it starts the response, so the record is complete here
+            lrecord = SleepyStats.End(environ.get("REQUEST_METHOD"), environ.get("PATH_INFO", "/"))
+            lended[0] = True
+            headers = list(headers) + [("Server-Timing", SleepyStats.ServerTiming(lrecord))]
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.app(environ, lstartResponse)
+        finally:
+            if not lended[0]:
+                SleepyStats.End(environ.get("REQUEST_METHOD"), environ.get("PATH_INFO", "/"))
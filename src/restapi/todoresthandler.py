@@ -1,4 +1,6 @@
 #import os
+from google.appengine.api import users
+from google.appengine.ext import ndb
 from google.appengine.ext import webapp
 from sleepy import Sleepy
 from datamodel import ToDo
@@ -10,6 +12,9 @@ class ToDoRestHandler(webapp.RequestHandler):
     def put(self, aResource, aResourceArg, *args, **kwargs):
         Sleepy.PutHandler(self, aResource, aResourceArg, *args, **kwargs)
 
+    def patch(self, aResource, aResourceArg, *args, **kwargs):
+        Sleepy.PatchHandler(self, aResource, aResourceArg, *args, **kwargs)
+
     def post(self, aResource, aResourceArg, *args, **kwargs):
         Sleepy.PostHandler(self, aResource, aResourceArg, *args, **kwargs)
     
@@ -18,11 +23,62 @@ class ToDoRestHandler(webapp.RequestHandler):
     
     def GetModelClass(self):
         return ToDo
+
+    def GetOwnerKey(self, *args, **kwargs):
+        # each user has their own list. app.yaml makes everyone sign in; anyone who gets here without
+        # a user has no list, and is refused.
+        luser = users.get_current_user()
+        return ndb.Key("ToDoOwner", luser.user_id()) if luser else None
+
+    def UseETags(self):
+        return True
+
+    def UseDeltaSync(self):
+        return True
+
+    def UseBulkOperations(self):
+        # eg: DELETE /todos?done=true to clear completed todos
+        return True
+
+    def GetProjections(self):
+        # field sets which have composite indexes (see index.yaml), so ?fields= can use projection queries
+        return [("text", "done")]
+
+    def GetQueryFields(self):
+        # eg: GET /todos?done=false. See index.yaml for the indexes these need
+        return ["done"]
+
+    def GetOrderFields(self):
+        # eg: GET /todos?order_by=-modified
+        return ["order", "rank", "created", "modified"]
+
+    def GetRankField(self):
+        # todos can be moved with POST /todos/<id>/move
+        return "rank"
+
+    def GetCounters(self):
+        # served by GET /todos/meta/stats
+        return {
+            "total": {},
+            "done": {"done": True},
+            "remaining": {"done": False}
+        }
+
+    def GetCacheTtl(self):
+        # writes invalidate the cache, so this only bounds how long unused entries hang around
+        return 600
     
-#    def GetTemplate(self):
-#        return {
-#            "text": None,
-#            "order": None,
-#            "done": None,
-#            "modified": None
-#        }
+    def GetTemplate(self):
+        # everything but search_terms, which is for searches only
+        return {
+            "text": None,
+            "order": None,
+            "rank": None,
+            "done": None,
+            "created": None,
+            "modified": None
+        }
+
+    def GetSearchIndex(self):
+        # eg: GET /todos?q=milk
+        return "search_terms", ["text"]
@@ -0,0 +1,94 @@
+'''
+Asset bundles and the built page, see tools/buildassets.py and htmlui.ToDoHandler.GetPage
+'''
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+import testutil
+from htmlui import ToDoHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import buildassets
+
+HTMLUIPATH = os.path.join(testutil.SRCPATH, "htmlui")
+
+class BuildTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        shutil.copy(os.path.join(HTMLUIPATH, "todos.html"), self.path)
+        shutil.copytree(os.path.join(HTMLUIPATH, "todos_files"), os.path.join(self.path, "todos_files"))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def Built(self):
+        with open(os.path.join(self.path, "todos.built.html")) as lfile:
+            return lfile.read()
+
+    def testBundles(self):
+        lbundles = buildassets.Build(self.path)
+        lnames = [lname for lname, _, _ in lbundles]
+        self.assertEqual(len(lnames), 2)
+        self.assertTrue(re.match(r"todos\.[0-9a-f]{12}\.js$", lnames[0]))
+        self.assertTrue(re.match(r"todos\.[0-9a-f]{12}\.css$", lnames[1]))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.path, "static"))), sorted(lnames))
+        self.assertTrue(all(lsize < lsourceSize for _, lsourceSize, lsize in lbundles))
+
+        lpage = self.Built()
+        self.assertTrue('<script src="/static/%s"></script>' % lnames[0] in lpage)
+        self.assertTrue('<link href="/static/%s"' % lnames[1] in lpage)
+        self.assertFalse("todos_files" in lpage)
+        self.assertFalse("<style>" in lpage)
+        self.assertEqual(lpage.count("<script src="), 1)
+
+        # the stylesheet's urls still lead to its images
+        with open(os.path.join(self.path, "static", lnames[1])) as lfile:
+            self.assertTrue("url(/todos_files/destroy.png)" in lfile.read())
+
+    def testRebuildReplacesOldBundles(self):
+        lold = [lname for lname, _, _ in buildassets.Build(self.path)]
+        with open(os.path.join(self.path, "todos_files", "todos.css"), "a") as lfile:
+            lfile.write("\nbody { color: red; }\n")
+        lnew = [lname for lname, _, _ in buildassets.Build(self.path)]
+
+        self.assertEqual(lnew[0], lold[0])
+        self.assertNotEqual(lnew[1], lold[1])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.path, "static"))), sorted(lnew))
+        self.assertTrue(lnew[1] in self.Built())
+
+class PageTest(testutil.SleepyTestCase):
+    def setUp(self):
+        testutil.SleepyTestCase.setUp(self)
+        self.path = tempfile.mkdtemp()
+        self.page, self.builtPagePath = ToDoHandler._page, ToDoHandler.BUILTPAGEPATH
+        ToDoHandler._page = None
+        ToDoHandler.BUILTPAGEPATH = os.path.join(self.path, "todos.built.html")
+
+    def tearDown(self):
+        ToDoHandler._page, ToDoHandler.BUILTPAGEPATH = self.page, self.builtPagePath
+        shutil.rmtree(self.path)
+        testutil.SleepyTestCase.tearDown(self)
+
+    def testBuiltPageIsServed(self):
+        with open(ToDoHandler.BUILTPAGEPATH, "w") as lfile:
+            lfile.write("<html>%s</script></html>" % ToDoHandler.BOOTSTRAPMARKER)
+        self.assertEqual(ToDoHandler.GetPage(), ("<html>%s" % ToDoHandler.BOOTSTRAPMARKER, "</script></html>"))
+
+    def testUnbuiltPageIsWarnedAbout(self):
+        lwarnings = []
+        class lhandler(logging.Handler):
+            def emit(self, aRecord):
+                lwarnings.append(aRecord.getMessage())
+        llogHandler = lhandler(logging.WARNING)
+        logging.getLogger().addHandler(llogHandler)
+        try:
+            lbefore, lafter = ToDoHandler.GetPage()
+        finally:
+            logging.getLogger().removeHandler(llogHandler)
+
+        self.assertTrue("./todos_files/todos.js" in lbefore)
+        self.assertTrue(any("buildassets" in lwarning for lwarning in lwarnings))
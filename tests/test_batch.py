@@ -0,0 +1,83 @@
+'''
+POST _batch, see Sleepy.BatchHandler
+'''
+import testutil
+from restapi import Sleepy
+
+class BatchTest(testutil.SleepyTestCase):
+    def Batch(self, aJsonable, aStatus = 200):
+        return self.CallJson("POST", "/todos/_batch", aJsonable, aStatus = aStatus)
+
+    def Texts(self):
+        return [litem["text"] for litem in self.CallJson("GET", "/todos")]
+
+    def testOps(self):
+        lmilk = self.Create("milk")
+        lbread = self.Create("bread")
+        lresult = self.Batch({
+            "read": [lmilk["id"], 999],
+            "ops": [
+                {"method": "create", "data": {"text": "eggs"}},
+                {"method": "update", "id": lmilk["id"], "data": {"done": True}},
+                {"method": "delete", "id": lbread["id"]},
+                {"method": "delete", "id": 999}
+            ]
+        })
+        self.assertEqual([lop["status"] for lop in lresult["results"]], [200, 200, 200, 404])
+        self.assertEqual(lresult["results"][0]["data"]["text"], "eggs")
+        self.assertTrue(lresult["results"][1]["data"]["done"])
+        # reads are as things are after the writes
+        self.assertTrue(lresult["read"][0]["done"])
+        self.assertEqual(lresult["read"][1], None)
+        self.assertEqual(self.Texts(), ["milk", "eggs"])
+
+    def testFailedOpChangesNothing(self):
+        lmilk = self.Create("milk")
+        lresult = self.Batch({
+            "read": [lmilk["id"]],
+            "ops": [
+                {"method": "update", "id": lmilk["id"], "data": {"text": "oat milk", "done": "nope"}},
+                {"method": "create", "data": {"text": "eggs", "done": "nope"}},
+                {"method": "explode"},
+                "nope"
+            ]
+        })
+        self.assertEqual([lop["status"] for lop in lresult["results"]], [400, 400, 400, 400])
+        self.assertTrue(all(lop["error"] for lop in lresult["results"]))
+        # the update's text isn't half applied, in the response or the datastore
+        self.assertEqual(lresult["read"][0]["text"], "milk")
+        self.assertEqual(self.Texts(), ["milk"])
+
+    def testOtherOpsStillApply(self):
+        lresult = self.Batch({"ops": [
+            {"method": "create", "data": {"done": "nope"}},
+            {"method": "create", "data": {"text": "eggs"}}
+        ]})
+        self.assertEqual([lop["status"] for lop in lresult["results"]], [400, 200])
+        self.assertEqual(self.Texts(), ["eggs"])
+
+    def testUpdateThenDelete(self):
+        lmilk = self.Create("milk")
+        lresult = self.Batch({"ops": [
+            {"method": "update", "id": lmilk["id"], "data": {"done": True}},
+            {"method": "delete", "id": lmilk["id"]}
+        ]})
+        # the update's result is gone with the entity, and it isn't saved again after the delete
+        self.assertEqual([lop["status"] for lop in lresult["results"]], [404, 200])
+        self.assertEqual(self.Texts(), [])
+
+    def testBadBodiesAreRefused(self):
+        self.Create("milk")
+        for lbody in [[], {"ops": {"method": "create"}}, {"read": "1"}, {"read": ["x"]},
+                      {"ops": [{"method": "create", "data": {"text": "eggs"}}] * (Sleepy.MAXBATCHSIZE + 1)}]:
+            self.assertEqual(self.Call("POST", "/todos/_batch", lbody).status_int, 400, lbody)
+        self.assertEqual(self.Texts(), ["milk"])
+
+    def testBatchesArePerOwner(self):
+        lmilk = self.Create("milk")
+        self.SignIn("2")
+        lresult = self.Batch({"read": [lmilk["id"]], "ops": [{"method": "delete", "id": lmilk["id"]}]})
+        self.assertEqual(lresult["read"], [None])
+        self.assertEqual(lresult["results"], [{"status": 404}])
+        self.SignIn("1")
+        self.assertEqual(self.Texts(), ["milk"])
@@ -0,0 +1,52 @@
+'''
+Bulk PUT and DELETE on a query, run as jobs, see Sleepy.BulkHandler
+'''
+import testutil
+
+class BulkTest(testutil.SleepyTestCase):
+    def Bulk(self, aMethod, aPath, aBody = None):
+        """
+        Starts a bulk operation, runs it, and returns the job's path and the job as it ends up
+        """
+        lresponse = self.Call(aMethod, aPath, aBody)
+        self.assertEqual(lresponse.status_int, 202, lresponse.body)
+        ljobPath = lresponse.headers["Location"].replace("http://localhost", "")
+        self.RunTasks()
+        return ljobPath, self.CallJson("GET", ljobPath)
+
+    def testBulkDelete(self):
+        self.Create("milk", done = True)
+        self.Create("eggs", done = True)
+        lbread = self.Create("bread")
+
+        _, ljob = self.Bulk("DELETE", "/todos?done=true")
+        self.assertEqual((ljob["operation"], ljob["status"], ljob["processed"]), ("delete", "done", 2))
+        self.assertEqual(self.CallJson("GET", "/todos"), [lbread])
+        self.assertEqual(self.CallJson("GET", "/todos/meta/stats"), {"total": 1, "done": 0, "remaining": 1})
+
+    def testBulkUpdate(self):
+        self.Create("milk")
+        self.Create("eggs")
+        self.Create("bread", done = True)
+
+        _, ljob = self.Bulk("PUT", "/todos?done=false", {"done": True})
+        self.assertEqual(ljob["processed"], 2)
+        self.assertTrue(all(litem["done"] for litem in self.CallJson("GET", "/todos")))
+
+    def testBulkIsPerOwner(self):
+        self.Create("milk", done = True)
+        self.SignIn("2")
+        self.Create("eggs", done = True)
+        self.Bulk("DELETE", "/todos?done=true")
+        self.SignIn("1")
+        self.assertEqual(len(self.CallJson("GET", "/todos")), 1)
+
+    def testJobsArePerOwner(self):
+        ljobPath, _ = self.Bulk("DELETE", "/todos?done=true")
+        self.SignIn("2")
+        self.assertEqual(self.Call("GET", ljobPath).status_int, 404)
+
+    def testFilterIsRequired(self):
+        self.Create("milk")
+        self.assertEqual(self.Call("DELETE", "/todos").status_int, 400)
+        self.assertEqual(len(self.CallJson("GET", "/todos")), 1)
@@ -0,0 +1,52 @@
+'''
+Sleepy's memcache read-through cache, see sleepycache
+'''
+import testutil
+from restapi.sleepycache import SleepyCache
+
+class CacheTest(testutil.SleepyTestCase):
+    def Hits(self):
+        return SleepyCache.GetStats().get("ToDo", {}).get("hits", 0)
+
+    def testCollectionIsCached(self):
+        self.Create("milk")
+        lhits = self.Hits()
+        lfirst = self.Call("GET", "/todos")
+        lsecond = self.Call("GET", "/todos")
+        self.assertEqual(self.Hits(), lhits + 1)
+        self.assertEqual(lsecond.body, lfirst.body)
+
+    def testWriteInvalidatesCollection(self):
+        lmilk = self.Create("milk")
+        self.CallJson("GET", "/todos")
+        self.CallJson("PUT", "/todos/%s" % lmilk["id"], {"text": "oat milk"})
+        self.assertEqual([litem["text"] for litem in self.CallJson("GET", "/todos")], ["oat milk"])
+
+        self.Create("bread")
+        self.assertEqual(len(self.CallJson("GET", "/todos")), 2)
+
+    def testEntityIsCachedUntilWritten(self):
+        lmilk = self.Create("milk")
+        lhits = self.Hits()
+        self.CallJson("GET", "/todos/%s" % lmilk["id"])
+        self.CallJson("GET", "/todos/%s" % lmilk["id"])
+        self.assertEqual(self.Hits(), lhits + 1)
+
+        self.CallJson("PATCH", "/todos/%s" % lmilk["id"], {"done": True})
+        self.assertTrue(self.CallJson("GET", "/todos/%s" % lmilk["id"])["done"])
+
+    def testDeleteInvalidatesEntity(self):
+        lmilk = self.Create("milk")
+        self.CallJson("GET", "/todos/%s" % lmilk["id"])
+        self.Call("DELETE", "/todos/%s" % lmilk["id"])
+        self.assertEqual(self.Call("GET", "/todos/%s" % lmilk["id"]).status_int, 404)
+        self.assertEqual(self.CallJson("GET", "/todos"), [])
+
+    def testOwnersAreCachedApart(self):
+        self.Create("milk")
+        self.CallJson("GET", "/todos")
+        self.SignIn("2")
+        self.CallJson("GET", "/todos")
+        self.Create("bread")
+        self.SignIn("1")
+        self.assertEqual([litem["text"] for litem in self.CallJson("GET", "/todos")], ["milk"])
@@ -0,0 +1,109 @@
+'''
+Counters and GET meta/stats, see Sleepy.GetCounters
+'''
+import datetime
+import testutil
+from google.appengine.ext import ndb
+from datamodel import ToDo
+from restapi import Sleepy, ToDoRestHandler
+from restapi.sleepymodels import SleepyCounterShard, SleepyDirtyCounters
+
+class CounterTest(testutil.SleepyTestCase):
+    def Stats(self):
+        return self.CallJson("GET", "/todos/meta/stats")
+
+    def testCountsFollowWrites(self):
+        self.assertEqual(self.Stats(), {"total": 0, "done": 0, "remaining": 0})
+        lmilk = self.Create("milk")
+        self.Create("bread")
+        self.Create("eggs", done = True)
+        self.assertEqual(self.Stats(), {"total": 3, "done": 1, "remaining": 2})
+
+        self.CallJson("PATCH", "/todos/%s" % lmilk["id"], {"done": True})
+        self.assertEqual(self.Stats(), {"total": 3, "done": 2, "remaining": 1})
+
+        # no change, so no count changes either
+        self.CallJson("PATCH", "/todos/%s" % lmilk["id"], {"done": True})
+        self.Call("DELETE", "/todos/%s" % lmilk["id"])
+        self.assertEqual(self.Stats(), {"total": 2, "done": 1, "remaining": 1})
+
+    def testCountsArePerOwner(self):
+        self.Create("milk")
+        self.SignIn("2")
+        self.assertEqual(self.Stats(), {"total": 0, "done": 0, "remaining": 0})
+
+    def testBatchIsCounted(self):
+        self.CallJson("POST", "/todos/_batch", {"ops": [
+            {"method": "create", "data": {"text": "milk"}},
+            {"method": "create", "data": {"text": "eggs", "done": True}}
+        ]})
+        self.assertEqual(self.Stats(), {"total": 2, "done": 1, "remaining": 1})
+
+    def testRepairCounters(self):
+        self.Create("milk")
+        self.Create("eggs", done = True)
+        lshards = SleepyCounterShard.query().fetch()
+        for lshard in lshards:
+            lshard.count = 7
+        ndb.put_multi(lshards)
+
+        Sleepy.RepairCounters(self.restHandlerClass, self.OwnerKey())
+        self.assertEqual(self.Stats(), {"total": 2, "done": 1, "remaining": 1})
+
+    def testBigWritesAreSplitAndCounted(self):
+        Sleepy.MAXWRITESPERCALL = 3
+        lresult = self.CallJson("POST", "/todos/_batch", {"ops": [{"method": "create", "data": {"text": "todo %s" % lindex, "done": lindex < 3}} for lindex in range(8)]})
+        self.assertEqual(self.Stats(), {"total": 8, "done": 3, "remaining": 5})
+
+        # deletes leave tombstones, so each is two writes
+        self.CallJson("POST", "/todos/_batch", {"ops": [{"method": "delete", "id": lop["data"]["id"]} for lop in lresult["results"][:5]]})
+        self.assertEqual(self.Stats(), {"total": 3, "done": 0, "remaining": 3})
+        self.assertEqual(len(self.CallJson("GET", "/todos")), 3)
+
+    def testSplitForTransactions(self):
+        # each owner is an entity group, plus one for each of its 3 counters' shards
+        lmodels = [ToDo(parent = self.OwnerKey(str(lindex)), text = "todo") for lindex in range(10)]
+        lpieces = Sleepy.SplitForTransactions(ToDoRestHandler(), lmodels, [])
+        self.assertEqual([len(lsaveModels) for lsaveModels, _ in lpieces], [6, 4])
+
+        # one owner's entities are one group, however many there are
+        lmodels = [ToDo(parent = self.OwnerKey(), text = "todo") for _ in range(Sleepy.MAXWRITESPERCALL + 1)]
+        lpieces = Sleepy.SplitForTransactions(ToDoRestHandler(), lmodels, [])
+        self.assertEqual([len(lsaveModels) for lsaveModels, _ in lpieces], [Sleepy.MAXWRITESPERCALL, 1])
+
+class DbCounterTest(testutil.SleepyTestCase):
+    # ndb counters can't be in a db transaction
+    restHandlerClass = testutil.DbToDoRestHandler
+
+    def Stats(self):
+        return self.CallJson("GET", "/todos/meta/stats")
+
+    def testCountsFollowWrites(self):
+        lmilk = self.Create("milk")
+        self.Create("eggs", done = True)
+        self.Call("DELETE", "/todos/%s" % lmilk["id"])
+        self.assertEqual(self.Stats(), {"total": 1, "done": 1, "remaining": 0})
+        self.assertEqual(SleepyDirtyCounters.query().count(), 0)
+
+    def testFailedWritesAreRepaired(self):
+        self.Create("milk")
+        lupdateCounters = Sleepy.UpdateCounters
+        def lfail(*args):
+            raise ValueError("no counters today")
+        Sleepy.UpdateCounters = staticmethod(lfail)
+        self.Call("POST", "/todos", {"text": "eggs"})
+        Sleepy.UpdateCounters = lupdateCounters
+
+        # the todo was written, but not counted
+        self.assertEqual(len(self.CallJson("GET", "/todos")), 2)
+        self.assertEqual(self.Stats()["total"], 1)
+        self.assertEqual(SleepyDirtyCounters.query().count(), 1)
+
+        # recent marks may be for writes still going
+        Sleepy.RepairDirtyCounters(testutil.DbToDoRestHandler)
+        self.assertEqual(self.Stats()["total"], 1)
+
+        Sleepy.DIRTYCOUNTERSAGE = datetime.timedelta(0)
+        Sleepy.RepairDirtyCounters(testutil.DbToDoRestHandler)
+        self.assertEqual(self.Stats(), {"total": 2, "done": 0, "remaining": 2})
+        self.assertEqual(SleepyDirtyCounters.query().count(), 0)
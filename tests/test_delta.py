@@ -0,0 +1,93 @@
+'''
+Delta syncs (GET ?since=) and tombstones, see Sleepy.ReturnDelta
+'''
+import datetime
+import testutil
+from restapi import Sleepy
+from restapi.sleepymodels import SleepyTombstone
+
+# before TOMBSTONEMAXAGE, so a sync since then is a full one
+LONGAGO = "2000-01-01T00:00:00Z"
+
+class DeltaTest(testutil.SleepyTestCase):
+    def setUp(self):
+        testutil.SleepyTestCase.setUp(self)
+        # so watermarks are now, and the writes a test has just made are reported
+        Sleepy.SYNCOVERLAP = datetime.timedelta(0)
+
+    def Sync(self, aSince, aArgs = ""):
+        return self.CallJson("GET", "/todos?since=%s%s" % (aSince, aArgs))
+
+    def testFullSync(self):
+        self.Create("milk")
+        self.Create("bread")
+        ldelta = self.Sync(LONGAGO)
+        self.assertTrue(ldelta["full"])
+        self.assertFalse(ldelta["more"])
+        self.assertEqual(sorted(litem["text"] for litem in ldelta["items"]), ["bread", "milk"])
+
+    def testChangesAndDeletes(self):
+        lmilk = self.Create("milk")
+        lbread = self.Create("bread")
+        lwatermark = self.Sync(LONGAGO)["watermark"]
+
+        self.CallJson("PATCH", "/todos/%s" % lmilk["id"], {"done": True})
+        self.Call("DELETE", "/todos/%s" % lbread["id"])
+        lchocolate = self.Create("chocolate")
+
+        ldelta = self.Sync(lwatermark)
+        self.assertFalse(ldelta["full"])
+        self.assertEqual([litem["id"] for litem in ldelta["items"]], [lmilk["id"], lchocolate["id"]])
+        self.assertEqual(ldelta["deleted"], [lbread["id"]])
+
+        # nothing since
+        ldelta = self.Sync(ldelta["watermark"])
+        self.assertEqual((ldelta["items"], ldelta["deleted"]), ([], []))
+
+    def testDeletesLeaveTombstones(self):
+        lmilk = self.Create("milk")
+        self.Call("DELETE", "/todos/%s" % lmilk["id"])
+        ltombstones = SleepyTombstone.query(ancestor = self.OwnerKey()).fetch()
+        self.assertEqual([ltombstone.entity_id for ltombstone in ltombstones], [lmilk["id"]])
+
+        # other owners don't see them
+        self.SignIn("2")
+        self.assertEqual(self.Sync(lmilk["created"])["deleted"], [])
+
+    def testTombstonesAreCollected(self):
+        lmilk = self.Create("milk")
+        self.Call("DELETE", "/todos/%s" % lmilk["id"])
+        Sleepy.TOMBSTONEMAXAGE = datetime.timedelta(0)
+        Sleepy.CollectTombstones()
+        self.RunTasks()
+        self.assertEqual(SleepyTombstone.query().count(), 0)
+
+    def testLimitPages(self):
+        lwatermark = self.Sync(LONGAGO)["watermark"]
+        for lindex in range(3):
+            self.Create("todo %s" % lindex)
+
+        ldelta = self.Sync(lwatermark, "&limit=2")
+        self.assertTrue(ldelta["more"])
+        self.assertEqual([litem["text"] for litem in ldelta["items"]], ["todo 0", "todo 1"])
+
+        ltexts = set()
+        while ldelta["more"]:
+            ltexts.update(litem["text"] for litem in ldelta["items"])
+            ldelta = self.Sync(ldelta["watermark"], "&limit=2")
+        ltexts.update(litem["text"] for litem in ldelta["items"])
+        self.assertEqual(ltexts, set(["todo 0", "todo 1", "todo 2"]))
+
+    def testFiltersAreRefused(self):
+        self.assertEqual(self.Call("GET", "/todos?since=%s&done=false" % LONGAGO).status_int, 400)
+
+class DbDeltaTest(testutil.SleepyTestCase):
+    restHandlerClass = testutil.DbToDoRestHandler
+
+    def testDeletesLeaveTombstones(self):
+        # the tombstone is ndb, so it can't be in the delete's db transaction
+        Sleepy.SYNCOVERLAP = datetime.timedelta(0)
+        lmilk = self.Create("milk")
+        lwatermark = self.CallJson("GET", "/todos?since=%s" % LONGAGO)["watermark"]
+        self.assertEqual(self.Call("DELETE", "/todos/%s" % lmilk["id"]).status_int, 200)
+        self.assertEqual(self.CallJson("GET", "/todos?since=%s" % lwatermark)["deleted"], [lmilk["id"]])
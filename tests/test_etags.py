@@ -0,0 +1,49 @@
+'''
+ETags and conditional requests, see Sleepy.UseETags
+'''
+import testutil
+
+class ETagTest(testutil.SleepyTestCase):
+    def testCollectionNotModified(self):
+        self.Create("milk")
+        lresponse = self.Call("GET", "/todos")
+        letag = lresponse.headers["ETag"]
+        self.assertEqual(self.Call("GET", "/todos", aHeaders = {"If-None-Match": letag}).status_int, 304)
+
+        self.Create("bread")
+        lresponse = self.Call("GET", "/todos", aHeaders = {"If-None-Match": letag})
+        self.assertEqual(lresponse.status_int, 200)
+        self.assertNotEqual(lresponse.headers["ETag"], letag)
+
+    def testItemNotModified(self):
+        lmilk = self.Create("milk")
+        lresponse = self.Call("GET", "/todos/%s" % lmilk["id"])
+        letag = lresponse.headers["ETag"]
+        self.assertEqual(self.Call("GET", "/todos/%s" % lmilk["id"], aHeaders = {"If-None-Match": letag}).status_int, 304)
+
+        self.CallJson("PATCH", "/todos/%s" % lmilk["id"], {"done": True})
+        self.assertEqual(self.Call("GET", "/todos/%s" % lmilk["id"], aHeaders = {"If-None-Match": letag}).status_int, 200)
+
+    def testIfMatch(self):
+        lresponse = self.Call("POST", "/todos", {"text": "milk"})
+        letag = lresponse.headers["ETag"]
+        lid = self.CallJson("GET", "/todos")[0]["id"]
+
+        lresponse = self.Call("PUT", "/todos/%s" % lid, {"text": "oat milk"}, {"If-Match": letag})
+        self.assertEqual(lresponse.status_int, 200)
+
+        # the ETag is for the text before the PUT
+        lresponse = self.Call("PUT", "/todos/%s" % lid, {"text": "soy milk"}, {"If-Match": letag})
+        self.assertEqual(lresponse.status_int, 412)
+        self.assertEqual(self.CallJson("GET", "/todos/%s" % lid)["text"], "oat milk")
+
+    def testBadArgumentsAreNotNotModified(self):
+        letag = self.Call("GET", "/todos").headers["ETag"]
+        self.assertEqual(self.Call("GET", "/todos?limit=x", aHeaders = {"If-None-Match": letag}).status_int, 400)
+
+    def testETagsDependOnTheQuery(self):
+        self.Create("milk")
+        letag = self.Call("GET", "/todos").headers["ETag"]
+        lresponse = self.Call("GET", "/todos?fields=text", aHeaders = {"If-None-Match": letag})
+        self.assertEqual(lresponse.status_int, 200)
+        self.assertNotEqual(lresponse.headers["ETag"], letag)
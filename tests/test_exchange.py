@@ -0,0 +1,93 @@
+'''
+GET _export and POST _import, see Sleepy.ExportHandler and Sleepy.ImportHandler
+'''
+import json
+import re
+import testutil
+from restapi import Sleepy
+
+class ExchangeTest(testutil.SleepyTestCase):
+    def Texts(self):
+        return sorted(litem["text"] for litem in self.CallJson("GET", "/todos"))
+
+    def Export(self, aArgs = ""):
+        """
+        The lines of an export, and the cursor for the rest, or None
+        """
+        lresponse = self.Call("GET", "/todos/_export%s" % aArgs)
+        self.assertEqual(lresponse.status_int, 200, lresponse.body)
+        return [json.loads(lline) for lline in lresponse.body.splitlines()], lresponse.headers.get("X-Sleepy-Next-Cursor")
+
+    def Import(self, aLines, aJob = None):
+        lbody = "".join("%s\n" % json.dumps(lline) for lline in aLines)
+        return self.CallJson("POST", "/todos/_import%s" % ("?job=%s" % aJob if aJob else ""), lbody)
+
+    def testRoundTrip(self):
+        self.Create("milk")
+        self.Create("eggs", done = True)
+        llines, lcursor = self.Export()
+        self.assertEqual(lcursor, None)
+        self.assertEqual(llines, self.CallJson("GET", "/todos"))
+
+        self.SignIn("2")
+        lresult = self.Import(llines)
+        self.assertEqual((lresult["imported"], lresult["line"], lresult["done"]), (2, 2, True))
+        self.assertEqual(self.Texts(), ["eggs", "milk"])
+        self.assertEqual(self.CallJson("GET", "/todos/meta/stats"), {"total": 2, "done": 1, "remaining": 1})
+
+    def testExportPages(self):
+        Sleepy.MAXEXPORTLINES = 2
+        for lindex in range(5):
+            self.Create("todo %s" % lindex)
+
+        ltexts = []
+        lcursor = ""
+        while lcursor is not None:
+            llines, lcursor = self.Export("?cursor=%s" % lcursor if lcursor else "")
+            self.assertTrue(len(llines) <= 2)
+            ltexts.extend(lline["text"] for lline in llines)
+        self.assertEqual(ltexts, ["todo %s" % lindex for lindex in range(5)])
+
+    def testExportArguments(self):
+        self.Create("milk")
+        self.Create("eggs", done = True)
+        self.assertEqual(self.Export("?done=true&fields=text")[0], [{"id": 2, "text": "eggs"}])
+        for largs in ["?limit=1", "?since=2000-01-01T00:00:00Z", "?q=milk"]:
+            self.assertEqual(self.Call("GET", "/todos/_export%s" % largs).status_int, 400, largs)
+
+    def testImportResumes(self):
+        Sleepy.MAXBATCHSIZE = 2
+        # out of time after every batch
+        Sleepy.IMPORTTIMEBUDGET = -1
+        llines = [{"text": "todo %s" % lindex} for lindex in range(5)]
+
+        lresult = self.Import(llines)
+        self.assertEqual((lresult["imported"], lresult["line"], lresult["done"]), (2, 2, False))
+        while not lresult["done"]:
+            lresult = self.Import(llines, lresult["job"])
+        self.assertEqual(self.Texts(), ["todo %s" % lindex for lindex in range(5)])
+        self.assertEqual(self.CallJson("GET", "/todos/meta/stats")["total"], 5)
+
+        # once it's done, resending writes nothing
+        lresult = self.Import(llines, lresult["job"])
+        self.assertEqual((lresult["imported"], lresult["done"]), (0, True))
+        self.assertEqual(len(self.Texts()), 5)
+
+    def testBadLineNamesTheJob(self):
+        lresponse = self.Call("POST", "/todos/_import", '{"text": "milk"}\n\n{"done": "nope"}\n{"text": "eggs"}\n')
+        self.assertEqual(lresponse.status_int, 400)
+        lmatch = re.search(r"line 2 of job (\d+)", lresponse.body)
+        self.assertTrue(lmatch, lresponse.body)
+        # the lines before it are written
+        self.assertEqual(self.Texts(), ["milk"])
+
+        lresult = self.CallJson("POST", "/todos/_import?job=%s" % lmatch.group(1), '{"text": "milk"}\n\n{"done": true}\n{"text": "eggs"}\n')
+        self.assertEqual((lresult["imported"], lresult["done"]), (2, True))
+        self.assertEqual(len(self.Texts()), 3)
+
+    def testJobsAreChecked(self):
+        self.assertEqual(self.Call("POST", "/todos/_import?job=x", "").status_int, 400)
+        self.assertEqual(self.Call("POST", "/todos/_import?job=999", "").status_int, 400)
+        ljob = self.Import([{"text": "milk"}])["job"]
+        self.SignIn("2")
+        self.assertEqual(self.Call("POST", "/todos/_import?job=%s" % ljob, "").status_int, 400)
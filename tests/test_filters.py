@@ -0,0 +1,46 @@
+'''
+Query string filters and order_by on collection GETs, see Sleepy.GetFiltersAndOrders and Sleepy.GetIndexes
+'''
+import os
+import testutil
+from restapi import Sleepy, ToDoRestHandler
+
+class FiltersTest(testutil.SleepyTestCase):
+    def Texts(self, aArgs):
+        return [litem["text"] for litem in self.CallJson("GET", "/todos%s" % aArgs)]
+
+    def setUp(self):
+        testutil.SleepyTestCase.setUp(self)
+        self.Create("milk", order = 3, done = True)
+        self.Create("bread", order = 1)
+        self.Create("eggs", order = 2)
+
+    def testFilters(self):
+        self.assertEqual(self.Texts("?done=false"), ["bread", "eggs"])
+        self.assertEqual(self.Texts("?done=1"), ["milk"])
+        self.assertEqual(self.Texts("?done=false&order_by=-order"), ["eggs", "bread"])
+        self.assertEqual(self.Texts("?done__gt=false"), ["milk"])
+
+    def testOrders(self):
+        self.assertEqual(self.Texts("?order_by=order"), ["bread", "eggs", "milk"])
+        self.assertEqual(self.Texts("?order_by=-order"), ["milk", "eggs", "bread"])
+        self.assertEqual(self.Texts("?order_by=-modified,order"), ["eggs", "bread", "milk"])
+        self.assertEqual(self.Texts("?done=false&order_by=-created"), ["eggs", "bread"])
+
+    def testUnderscoreArgumentsAreIgnored(self):
+        self.assertEqual(self.Texts("?_=1234&done=true"), ["milk"])
+
+    def testBadQueriesAreRefused(self):
+        for largs in ["?nope=1", "?text=milk", "?done__nope=true", "?done=maybe",
+                      # order can be sorted on but not filtered, done the other way round
+                      "?order=1", "?order_by=done", "?order_by=text", "?order_by=search_terms",
+                      # the inequality's field has to be ordered by first
+                      "?done__gt=false&order_by=order"]:
+            lresponse = self.Call("GET", "/todos%s" % largs)
+            self.assertEqual(lresponse.status_int, 400, largs)
+
+    def testIndexYamlIsUpToDate(self):
+        lyaml = Sleepy.IndexesToYaml(Sleepy.GetIndexes(ToDoRestHandler()))
+        self.assertTrue("- kind: ToDo\n  ancestor: yes\n  properties:\n  - name: done\n  - name: order\n    direction: desc\n" in lyaml)
+        with open(os.path.join(testutil.SRCPATH, "index.yaml")) as lfile:
+            self.assertTrue(lyaml in lfile.read(), "run tools/genindexes.py")
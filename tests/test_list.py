@@ -0,0 +1,202 @@
+'''
+List storage, see Sleepy.UseListStorage and sleepylist.ListBackend
+
+Everything but storage is meant to be the same with lists, so the other tests are run again against a
+ToDoRestHandler which uses them. Tests of where entities are stored are replaced with list equivalents.
+'''
+import json
+import testutil
+import webapp2
+import test_batch
+import test_bulk
+import test_cache
+import test_counters
+import test_delta
+import test_etags
+import test_exchange
+import test_filters
+import test_owners
+import test_paging
+import test_patch
+import test_ranks
+import test_search
+import test_wire
+from google.appengine.ext import ndb
+from datamodel import ToDo
+from restapi import Sleepy, ToDoRestHandler
+from restapi.sleepylist import SleepyList
+from restapi.sleepymodels import SleepyListChunk
+
+class ListToDoRestHandler(ToDoRestHandler):
+    def UseListStorage(self):
+        return True
+
+def ListItems(aOwnerKey):
+    return SleepyList.Load("ToDo", aOwnerKey).Items()
+
+class ListBatchTest(test_batch.BatchTest):
+    restHandlerClass = ListToDoRestHandler
+
+class ListBulkTest(test_bulk.BulkTest):
+    restHandlerClass = ListToDoRestHandler
+
+class ListCacheTest(test_cache.CacheTest):
+    restHandlerClass = ListToDoRestHandler
+
+class ListCounterTest(test_counters.CounterTest):
+    restHandlerClass = ListToDoRestHandler
+
+class ListDeltaTest(test_delta.DeltaTest):
+    restHandlerClass = ListToDoRestHandler
+
+class ListETagTest(test_etags.ETagTest):
+    restHandlerClass = ListToDoRestHandler
+
+class ListExchangeTest(test_exchange.ExchangeTest):
+    restHandlerClass = ListToDoRestHandler
+
+class ListFiltersTest(test_filters.FiltersTest):
+    restHandlerClass = ListToDoRestHandler
+
+class ListOwnerTest(test_owners.OwnerTest):
+    restHandlerClass = ListToDoRestHandler
+
+    def testEntitiesAreUnderTheOwner(self):
+        lmilk = self.Create("milk")
+        self.assertEqual(ToDo.query().count(), 0)
+        self.assertEqual([lchunk.key.parent() for lchunk in SleepyListChunk.query()], [self.OwnerKey()])
+        self.assertEqual([litem["text"] for litem in ListItems(self.OwnerKey())], ["milk"])
+        self.assertEqual(ListItems(self.OwnerKey())[0]["id"], lmilk["id"])
+
+    def testAdoptRootEntities(self):
+        lmilk = self.Create("milk")
+        ndb.put_multi([ToDo(id = lmilk["id"], text = "old milk"), ToDo(text = "old eggs", done = True)])
+
+        Sleepy.AdoptRootEntities(ListToDoRestHandler, self.OwnerKey())
+        Sleepy.AdoptRootEntities(ListToDoRestHandler, self.OwnerKey())
+        self.RunTasks()
+
+        # the copies are in the owner's list, and the roots are gone
+        self.assertEqual(sorted(litem["text"] for litem in ListItems(self.OwnerKey())), ["milk", "old eggs", "old milk"])
+        self.assertEqual(ToDo.query().count(), 0)
+        self.assertEqual(self.CallJson("GET", "/todos/meta/stats"), {"total": 3, "done": 1, "remaining": 2})
+
+class ListPagingTest(test_paging.PagingTest):
+    restHandlerClass = ListToDoRestHandler
+
+class ListPatchTest(test_patch.PatchTest):
+    restHandlerClass = ListToDoRestHandler
+
+class ListRankTest(test_ranks.RankTest):
+    restHandlerClass = ListToDoRestHandler
+
+    def testTiesAreConflictsUntilRebalanced(self):
+        la, lb, lc = [self.Create(ltext) for ltext in ["a", "b", "c"]]
+        llist = SleepyList.Load("ToDo", self.OwnerKey())
+        litem = llist.Items()[llist.Find(lb["id"])]
+        litem["rank"] = la["rank"]
+        llist.Put(litem)
+        ndb.transaction(llist.Save)
+
+        self.assertEqual(self.Call("POST", "/todos/%s/move" % lc["id"], {"after": la["id"], "before": lb["id"]}).status_int, 409)
+        self.RunTasks()
+        self.CallJson("POST", "/todos/%s/move" % lc["id"], {"after": la["id"], "before": lb["id"]})
+        self.assertEqual(self.Order(), ["a", "c", "b"])
+
+class ListSearchTest(test_search.SearchTest):
+    restHandlerClass = ListToDoRestHandler
+
+class ListWireTest(test_wire.WireTest):
+    restHandlerClass = ListToDoRestHandler
+
+class QueryingToDoRestHandler(ListToDoRestHandler):
+    def ModifyQuery(self, aQuery, *args, **kwargs):
+        return aQuery
+
+class ListStorageTest(testutil.SleepyTestCase):
+    restHandlerClass = ListToDoRestHandler
+
+    def Texts(self, aArgs = ""):
+        return [litem["text"] for litem in self.CallJson("GET", "/todos%s" % aArgs)]
+
+    def testMadeFromEntities(self):
+        ToDo(parent = self.OwnerKey(), id = 5, text = "milk").put()
+        ToDo(parent = self.OwnerKey(), id = 7, text = "bread").put()
+        ToDo(parent = self.OwnerKey("2"), id = 9, text = "eggs").put()
+
+        self.assertEqual([(litem["id"], litem["text"]) for litem in self.CallJson("GET", "/todos")], [(5, "milk"), (7, "bread")])
+
+        # only once: the entities are left as they were, and don't come back
+        self.Call("DELETE", "/todos/5")
+        self.assertEqual(self.Texts(), ["bread"])
+        self.assertEqual(ToDo.query().count(), 3)
+
+    def testEmptyListIsSaved(self):
+        self.assertEqual(self.CallJson("GET", "/todos"), [])
+        self.assertEqual(SleepyList.Load("ToDo", self.OwnerKey()).version, 1)
+
+    def testTimesAreStamped(self):
+        lmilk = self.Create("milk")
+        self.assertTrue(lmilk["created"])
+        self.assertEqual(lmilk["modified"], lmilk["created"])
+
+        lpatched = self.CallJson("PATCH", "/todos/%s" % lmilk["id"], {"done": True})
+        self.assertTrue(lpatched["modified"] > lmilk["modified"])
+        self.assertEqual(self.CallJson("GET", "/todos/%s" % lmilk["id"])["created"], lmilk["created"])
+
+    def testCursorsSurviveWrites(self):
+        for lindex in range(5):
+            self.Create("todo %s" % lindex, order = lindex)
+        lresponse = self.Call("GET", "/todos?order_by=order&limit=2")
+        lcursor = lresponse.headers["X-Sleepy-Next-Cursor"]
+
+        # the page's items going doesn't move the rest
+        for litem in json.loads(lresponse.body):
+            self.Call("DELETE", "/todos/%s" % litem["id"])
+        self.assertEqual(self.Texts("?order_by=order&limit=2&cursor=%s" % lcursor), ["todo 2", "todo 3"])
+        self.assertEqual(self.Call("GET", "/todos?limit=2&cursor=nope").status_int, 400)
+
+    def testImportWritesABatchAtATime(self):
+        Sleepy.MAXBATCHSIZE = 2
+        Sleepy.IMPORTTIMEBUDGET = -1
+        lresult = self.CallJson("POST", "/todos/_import", "".join('{"text": "todo %s"}\n' % lindex for lindex in range(5)))
+        self.assertEqual((lresult["imported"], lresult["done"]), (2, False))
+        self.assertEqual(len(ListItems(self.OwnerKey())), 2)
+
+    def testQueriesAcrossOwners(self):
+        self.Create("milk", done = True)
+        self.SignIn("2")
+        self.Create("bread", done = True)
+        self.Create("eggs")
+
+        Sleepy.MAXBATCHSIZE = 1
+        Sleepy.RebalanceRanks(ListToDoRestHandler)
+        Sleepy.RepairCounters(ListToDoRestHandler)
+        self.assertEqual(self.CallJson("GET", "/todos/meta/stats"), {"total": 2, "done": 1, "remaining": 1})
+        self.SignIn("1")
+        self.assertEqual(self.CallJson("GET", "/todos/meta/stats"), {"total": 1, "done": 1, "remaining": 0})
+
+        ndb.transaction(lambda: SleepyList.Load("ToDo", self.OwnerKey("2")).Save())
+        lmilk = ListItems(self.OwnerKey())[0]
+        lmilk["search_terms"] = []
+        lmilkList = SleepyList.Load("ToDo", self.OwnerKey())
+        lmilkList.Put(lmilk)
+        ndb.transaction(lmilkList.Save)
+        Sleepy.BackfillSearchTerms(ListToDoRestHandler)
+        self.RunTasks()
+        self.assertEqual(ListItems(self.OwnerKey())[0]["search_terms"], ["milk"])
+
+    def testModifyQueryIsRefused(self):
+        self.app = webapp2.WSGIApplication(Sleepy.FixRoutes([("todos", QueryingToDoRestHandler)]))
+        lresponse = self.Call("GET", "/todos")
+        self.assertEqual(lresponse.status_int, 400)
+        self.assertTrue("ModifyQuery" in lresponse.body)
+
+    def testDbModelsAreRefused(self):
+        class ListDbToDoRestHandler(testutil.DbToDoRestHandler):
+            def UseListStorage(self):
+                return True
+        self.app = webapp2.WSGIApplication(Sleepy.FixRoutes([("todos", ListDbToDoRestHandler)]))
+        lresponse = self.Call("GET", "/todos")
+        self.assertEqual(lresponse.status_int, 400)
+        self.assertTrue("ndb" in lresponse.body)
@@ -0,0 +1,44 @@
+'''
+Partitioning by owner, see Sleepy.GetOwnerKey
+'''
+import testutil
+from google.appengine.ext import ndb
+from datamodel import ToDo
+from restapi import Sleepy
+
+class OwnerTest(testutil.SleepyTestCase):
+    def testOwnersOnlySeeTheirOwn(self):
+        lmilk = self.Create("milk")
+        self.SignIn("2")
+        self.assertEqual(self.CallJson("GET", "/todos"), [])
+        self.assertEqual(self.Call("GET", "/todos/%s" % lmilk["id"]).status_int, 404)
+        self.assertEqual(self.Call("PUT", "/todos/%s" % lmilk["id"], {"done": True}).status_int, 404)
+        self.Call("DELETE", "/todos/%s" % lmilk["id"])
+
+        self.SignIn("1")
+        self.assertEqual(self.CallJson("GET", "/todos/%s" % lmilk["id"]), lmilk)
+
+    def testEntitiesAreUnderTheOwner(self):
+        lmilk = self.Create("milk")
+        self.assertEqual(ToDo.get_by_id(lmilk["id"], parent = self.OwnerKey()).text, "milk")
+
+    def testSignedOutIsRefused(self):
+        self.SignIn(None)
+        self.assertEqual(self.Call("GET", "/todos").status_int, 403)
+        self.assertEqual(self.Call("POST", "/todos", {"text": "milk"}).status_int, 403)
+
+    def testAdoptRootEntities(self):
+        lmilk = self.Create("milk")
+        # made before todos had owners; one has the same id as milk
+        lold = [ToDo(id = lmilk["id"], text = "old milk"), ToDo(text = "old eggs", done = True)]
+        ndb.put_multi(lold)
+        self.assertEqual(len(self.CallJson("GET", "/todos")), 1)
+
+        Sleepy.AdoptRootEntities(self.restHandlerClass, self.OwnerKey())
+        # a retry doesn't copy them again
+        Sleepy.AdoptRootEntities(self.restHandlerClass, self.OwnerKey())
+        self.RunTasks()
+
+        self.assertEqual(sorted(litem["text"] for litem in self.CallJson("GET", "/todos")), ["milk", "old eggs", "old milk"])
+        self.assertEqual(self.CallJson("GET", "/todos/meta/stats"), {"total": 3, "done": 1, "remaining": 2})
+        self.assertEqual(ToDo.query(ToDo.text == "old milk").count(), 1)
@@ -0,0 +1,74 @@
+'''
+The page, with the caller's list in it, and its ETag, see htmlui.ToDoHandler
+'''
+import datetime
+import json
+import testutil
+import webapp2
+from htmlui import ToDoHandler
+from restapi import Sleepy, ToDoRestHandler
+
+class PageTest(testutil.SleepyTestCase):
+    def setUp(self):
+        testutil.SleepyTestCase.setUp(self)
+        self.app = webapp2.WSGIApplication([("/", ToDoHandler)] + Sleepy.FixRoutes([("todos", ToDoRestHandler)]))
+        self.app.allowed_methods = webapp2.WSGIApplication.allowed_methods.union(["PATCH"])
+        # whether or not the assets have been built here
+        self.page, self.builtPagePath = ToDoHandler._page, ToDoHandler.BUILTPAGEPATH
+        ToDoHandler._page = None
+        ToDoHandler.BUILTPAGEPATH = "nope"
+
+    def tearDown(self):
+        ToDoHandler._page, ToDoHandler.BUILTPAGEPATH = self.page, self.builtPagePath
+        testutil.SleepyTestCase.tearDown(self)
+
+    def Bootstrap(self, aResponse):
+        """
+        The initial list in a page
+        """
+        _, _, lrest = aResponse.body.partition(ToDoHandler.BOOTSTRAPMARKER)
+        return json.loads(lrest[:lrest.index("</script>")])
+
+    def testListIsInThePage(self):
+        Sleepy.SYNCOVERLAP = datetime.timedelta(0)
+        self.Create("milk")
+        self.Create("bread", done = True)
+        lresponse = self.Call("GET", "/")
+        self.assertEqual(lresponse.status_int, 200)
+        self.assertEqual(lresponse.headers["Cache-Control"], "private, no-cache")
+
+        lbootstrap = self.Bootstrap(lresponse)
+        self.assertEqual(lbootstrap["items"], self.CallJson("GET", "/todos"))
+        # the page carries on with delta syncs from there
+        self.assertEqual(self.CallJson("GET", "/todos?since=%s" % lbootstrap["watermark"])["items"], [])
+
+    def testNotModified(self):
+        self.Create("milk")
+        letag = self.Call("GET", "/").headers["ETag"]
+        lresponse = self.Call("GET", "/", aHeaders = {"If-None-Match": letag})
+        self.assertEqual(lresponse.status_int, 304)
+        self.assertEqual(lresponse.body, "")
+
+    def testWritesChangeTheETag(self):
+        lmilk = self.Create("milk")
+        letag = self.Call("GET", "/").headers["ETag"]
+
+        self.CallJson("PATCH", "/todos/%s" % lmilk["id"], {"done": True})
+        lresponse = self.Call("GET", "/", aHeaders = {"If-None-Match": letag})
+        self.assertEqual(lresponse.status_int, 200)
+        self.assertNotEqual(lresponse.headers["ETag"], letag)
+        self.assertTrue(self.Bootstrap(lresponse)["items"][0]["done"])
+
+    def testPagesArePerOwner(self):
+        self.Create("milk")
+        letag = self.Call("GET", "/").headers["ETag"]
+        self.SignIn("2")
+        lresponse = self.Call("GET", "/", aHeaders = {"If-None-Match": letag})
+        self.assertEqual(lresponse.status_int, 200)
+        self.assertEqual(self.Bootstrap(lresponse)["items"], [])
+
+    def testTextCantEndTheScript(self):
+        self.Create("</script><script>alert(1)</script>")
+        lresponse = self.Call("GET", "/")
+        self.assertFalse("<script>alert" in lresponse.body)
+        self.assertEqual(self.Bootstrap(lresponse)["items"][0]["text"], "</script><script>alert(1)</script>")
@@ -0,0 +1,44 @@
+'''
+Collection GETs with ?limit= and ?cursor=, see Sleepy.ReturnCollection
+'''
+import json
+import testutil
+from restapi import Sleepy
+
+class PagingTest(testutil.SleepyTestCase):
+    def Page(self, aArgs):
+        """
+        A page of the collection: the texts in it, and the cursor for the next, or None
+        """
+        lresponse = self.Call("GET", "/todos%s" % aArgs)
+        self.assertEqual(lresponse.status_int, 200, lresponse.body)
+        return [litem["text"] for litem in json.loads(lresponse.body)], lresponse.headers.get("X-Sleepy-Next-Cursor")
+
+    def testCursorsWalkTheCollection(self):
+        for lindex in range(5):
+            self.Create("todo %s" % lindex)
+
+        ltexts, lcursor = self.Page("?limit=2")
+        self.assertEqual(ltexts, ["todo 0", "todo 1"])
+        self.assertTrue(lcursor)
+
+        # a full last page may hand back a cursor to an empty one
+        while lcursor:
+            lpage, lcursor = self.Page("?limit=2&cursor=%s" % lcursor)
+            ltexts.extend(lpage)
+        self.assertEqual(ltexts, ["todo %s" % lindex for lindex in range(5)])
+
+    def testNoCursorWithoutLimit(self):
+        # STREAMBATCHSIZE only changes how it's fetched and written
+        Sleepy.STREAMBATCHSIZE = 2
+        for lindex in range(5):
+            self.Create("todo %s" % lindex)
+        self.assertEqual(self.Page(""), (["todo %s" % lindex for lindex in range(5)], None))
+
+    def testNoCursorWhenThePageIsShort(self):
+        self.Create("milk")
+        self.assertEqual(self.Page("?limit=2"), (["milk"], None))
+
+    def testBadArgumentsAreRefused(self):
+        for largs in ["?limit=0", "?limit=%s" % (Sleepy.MAXLIMIT + 1), "?limit=x", "?cursor=nope"]:
+            self.assertEqual(self.Call("GET", "/todos%s" % largs).status_int, 400, largs)
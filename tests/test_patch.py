@@ -0,0 +1,44 @@
+'''
+PATCH, and updates that change nothing, see Sleepy.UpdateHandler
+'''
+import testutil
+
+class PatchTest(testutil.SleepyTestCase):
+    def testPatchNoOp(self):
+        lmilk = self.Create("milk")
+        lresponse = self.Call("GET", "/todos")
+        letag = lresponse.headers["ETag"]
+
+        lresult = self.CallJson("PATCH", "/todos/%s" % lmilk["id"], {"text": "milk"})
+        self.assertEqual(lresult, {"id": lmilk["id"]})
+        self.assertEqual(self.CallJson("GET", "/todos/%s" % lmilk["id"])["modified"], lmilk["modified"])
+        # nothing was written, so the collection hasn't changed
+        self.assertEqual(self.Call("GET", "/todos", aHeaders = {"If-None-Match": letag}).status_int, 304)
+
+    def testPutNoOp(self):
+        lmilk = self.Create("milk")
+        lresult = self.CallJson("PUT", "/todos/%s" % lmilk["id"], {"text": "milk", "done": False})
+        self.assertEqual(lresult, lmilk)
+
+    def testPatchReturnsChanges(self):
+        lmilk = self.Create("milk")
+        lresult = self.CallJson("PATCH", "/todos/%s" % lmilk["id"], {"text": "milk", "done": True})
+        self.assertEqual(sorted(lresult), ["done", "id", "modified"])
+        self.assertTrue(lresult["done"])
+        self.assertNotEqual(lresult["modified"], lmilk["modified"])
+
+        # fields that weren't sent are left alone
+        lmilk = self.CallJson("GET", "/todos/%s" % lmilk["id"])
+        self.assertEqual((lmilk["text"], lmilk["done"]), ("milk", True))
+
+    def testPreferMinimal(self):
+        lmilk = self.Create("milk")
+        for lmethod in ["PATCH", "PUT"]:
+            lresponse = self.Call(lmethod, "/todos/%s" % lmilk["id"], {"text": lmethod}, {"Prefer": "return=minimal"})
+            self.assertEqual(lresponse.status_int, 204, lmethod)
+            self.assertEqual(lresponse.body, "")
+            self.assertEqual(lresponse.headers["Preference-Applied"], "return=minimal")
+            self.assertEqual(self.CallJson("GET", "/todos/%s" % lmilk["id"])["text"], lmethod)
+
+    def testPatchMissing(self):
+        self.assertEqual(self.Call("PATCH", "/todos/999", {"done": True}).status_int, 404)
@@ -0,0 +1,64 @@
+'''
+Ranks and POST <id>/move, see Sleepy.GetRankField
+'''
+import testutil
+from datamodel import ToDo
+from restapi import Sleepy
+
+class RankTest(testutil.SleepyTestCase):
+    def Order(self):
+        return [litem["text"] for litem in self.CallJson("GET", "/todos?order_by=rank")]
+
+    def testNewItemsGoOnTheEnd(self):
+        for ltext in ["a", "b", "c"]:
+            self.Create(ltext)
+        self.assertEqual(self.Order(), ["a", "b", "c"])
+
+    def testMove(self):
+        la, lb, lc = [self.Create(ltext) for ltext in ["a", "b", "c"]]
+
+        lmoved = self.CallJson("POST", "/todos/%s/move" % lc["id"], {"after": None, "before": la["id"]})
+        self.assertEqual(self.Order(), ["c", "a", "b"])
+        self.assertTrue(lmoved["rank"] < la["rank"])
+
+        self.CallJson("POST", "/todos/%s/move" % lc["id"], {"after": la["id"]})
+        self.assertEqual(self.Order(), ["a", "c", "b"])
+
+        self.CallJson("POST", "/todos/%s/move" % la["id"], {"before": None})
+        self.assertEqual(self.Order(), ["c", "b", "a"])
+
+    def testMoveChangesOnlyTheMovedItem(self):
+        la, lb = self.Create("a"), self.Create("b")
+        self.CallJson("POST", "/todos/%s/move" % lb["id"], {"before": la["id"]})
+        self.assertEqual(self.CallJson("GET", "/todos/%s" % la["id"]), la)
+
+    def testBadMoves(self):
+        la = self.Create("a")
+        self.assertEqual(self.Call("POST", "/todos/%s/move" % la["id"], {"after": la["id"]}).status_int, 400)
+        self.assertEqual(self.Call("POST", "/todos/%s/move" % la["id"], {"after": 999}).status_int, 400)
+        self.assertEqual(self.Call("POST", "/todos/999/move", {"after": None}).status_int, 404)
+
+    def testLongRanksAreRebalanced(self):
+        Sleepy.MAXRANKLENGTH = 3
+        la, lb = self.Create("a"), self.Create("b")
+        # each move halves the gap after a, lengthening the moved item's rank
+        for ltext in ["c", "d", "e", "f"]:
+            lnew = self.Create(ltext)
+            self.CallJson("POST", "/todos/%s/move" % lnew["id"], {"after": la["id"]})
+        self.RunTasks()
+
+        self.assertEqual(self.Order(), ["a", "f", "e", "d", "c", "b"])
+        self.assertTrue(all(len(litem["rank"]) <= 3 for litem in self.CallJson("GET", "/todos")))
+
+    def testTiesAreConflictsUntilRebalanced(self):
+        la, lb, lc = [self.Create(ltext) for ltext in ["a", "b", "c"]]
+        # as if a and b were created at the same time
+        lmodel = ToDo.get_by_id(lb["id"], parent = self.OwnerKey())
+        lmodel.rank = la["rank"]
+        lmodel.put()
+
+        self.assertEqual(self.Call("POST", "/todos/%s/move" % lc["id"], {"after": la["id"], "before": lb["id"]}).status_int, 409)
+        # the client tries again after a while (see Todo.move in todos.js), by which time they've been spread out
+        self.RunTasks()
+        self.CallJson("POST", "/todos/%s/move" % lc["id"], {"after": la["id"], "before": lb["id"]})
+        self.assertEqual(self.Order(), ["a", "c", "b"])
@@ -0,0 +1,58 @@
+'''
+Search (GET ?q=), see Sleepy.GetSearchIndex
+'''
+import testutil
+from datamodel import ToDo
+from restapi import Sleepy
+
+class SearchTest(testutil.SleepyTestCase):
+    def Search(self, aQuery, aArgs = ""):
+        return [litem["text"] for litem in self.CallJson("GET", "/todos?q=%s%s" % (aQuery, aArgs))]
+
+    def testMatchesAllWords(self):
+        self.Create("buy milk")
+        self.Create("milk chocolate")
+        self.Create("bread")
+        self.assertEqual(sorted(self.Search("milk")), ["buy milk", "milk chocolate"])
+        self.assertEqual(self.Search("buy+milk"), ["buy milk"])
+        self.assertEqual(self.Search("cheese"), [])
+
+    def testRanked(self):
+        self.Create("milk the cows and buy some bread")
+        self.Create("buy milk")
+        self.Create("milk to buy")
+        self.assertEqual(self.Search("buy+milk"), ["buy milk", "milk to buy", "milk the cows and buy some bread"])
+
+    def testWordsAreNormalized(self):
+        self.Create(u"Cr\u00e8me Br\u00fbl\u00e9e")
+        self.assertEqual(self.Search("creme+BRULEE"), [u"Cr\u00e8me Br\u00fbl\u00e9e"])
+        self.assertEqual(self.Call("GET", "/todos?q=+").status_int, 400)
+
+    def testFiltersAndLimit(self):
+        self.Create("buy milk", done = True)
+        self.Create("milk chocolate")
+        self.assertEqual(self.Search("milk", "&done=false"), ["milk chocolate"])
+        self.assertEqual(len(self.Search("milk", "&limit=1")), 1)
+
+    def testTermsFollowWrites(self):
+        lmilk = self.Create("buy milk")
+        self.CallJson("PATCH", "/todos/%s" % lmilk["id"], {"text": "buy bread"})
+        self.assertEqual(self.Search("milk"), [])
+        self.assertEqual(self.Search("bread"), ["buy bread"])
+
+    def testSearchIsPerOwner(self):
+        self.Create("buy milk")
+        self.SignIn("2")
+        self.assertEqual(self.Search("milk"), [])
+
+    def testOrderIsRefused(self):
+        self.assertEqual(self.Call("GET", "/todos?q=milk&order_by=rank").status_int, 400)
+
+    def testBackfill(self):
+        # written without going through Sleepy, so without search terms
+        ToDo(parent = self.OwnerKey(), text = "buy milk").put()
+        self.assertEqual(self.Search("milk"), [])
+
+        Sleepy.BackfillSearchTerms(self.restHandlerClass)
+        self.RunTasks()
+        self.assertEqual(self.Search("milk"), ["buy milk"])
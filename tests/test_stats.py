@@ -0,0 +1,69 @@
+'''
+Per-request timings and RPC counts, see sleepystats
+'''
+import testutil
+import webapp2
+from restapi import Sleepy, ToDoRestHandler, StatsHandler
+from restapi.sleepystats import SleepyStats, SleepyStatsMiddleware
+
+class StatsTest(testutil.SleepyTestCase):
+    def setUp(self):
+        testutil.SleepyTestCase.setUp(self)
+        self._history = SleepyStats._history
+        SleepyStats._history = {}
+        # the testbed has a new API proxy, which needs the hook
+        SleepyStats._hookInstalled = False
+
+        lapp = webapp2.WSGIApplication(Sleepy.FixRoutes([("todos", ToDoRestHandler)]) + [("/_stats", StatsHandler)])
+        lapp.allowed_methods = webapp2.WSGIApplication.allowed_methods.union(["PATCH"])
+        self.app = SleepyStatsMiddleware(lapp)
+
+    def tearDown(self):
+        SleepyStats._history = self._history
+        SleepyStats._hookInstalled = False
+        testutil.SleepyTestCase.tearDown(self)
+
+    def ServerTiming(self, aResponse):
+        return dict(lmetric.split(";", 1) for lmetric in aResponse.headers["Server-Timing"].split(", "))
+
+    def testServerTiming(self):
+        lmilk = self.Create("milk")
+        ltiming = self.ServerTiming(self.Call("GET", "/todos/%s" % lmilk["id"]))
+        self.assertTrue(ltiming["total"].startswith("dur="))
+        self.assertTrue("serialize" in ltiming)
+        self.assertTrue(ltiming["rpc-datastore_v3"].endswith('calls"'))
+
+    def testErrorsAreTimedToo(self):
+        lresponse = self.Call("GET", "/todos/nope")
+        self.assertEqual(lresponse.status_int, 400)
+        self.assertTrue("total" in self.ServerTiming(lresponse))
+
+    def testStatsByRoute(self):
+        lmilk = self.Create("milk")
+        for _ in range(3):
+            self.CallJson("GET", "/todos/%s" % lmilk["id"])
+        self.CallJson("GET", "/todos")
+
+        lstats = self.CallJson("GET", "/_stats")
+        lroutes = lstats["routes"]
+        self.assertEqual(lroutes["GET /todos/:arg"]["requests"], 3)
+        self.assertEqual(lroutes["GET /todos"]["requests"], 1)
+        self.assertEqual(lroutes["POST /todos"]["requests"], 1)
+        lroute = lroutes["GET /todos/:arg"]
+        self.assertTrue(lroute["p50"] <= lroute["p95"] <= lroute["p99"] <= lroute["max"])
+        self.assertTrue(lroute["rpcs"]["datastore_v3"] > 0)
+        self.assertTrue("cache" in lstats)
+
+    def testUntimedWithoutARequest(self):
+        lfunc = lambda: None
+        self.assertTrue(SleepyStats.Timed("json", lfunc) is lfunc)
+
+    def testRoutes(self):
+        self.assertEqual(SleepyStats.GetRoute("/todos"), "/todos")
+        self.assertEqual(SleepyStats.GetRoute("/todos/"), "/todos")
+        self.assertEqual(SleepyStats.GetRoute("/todos/12/move"), "/todos/:arg")
+
+    def testPercentile(self):
+        lvalues = range(1, 101)
+        self.assertEqual([SleepyStats.Percentile(lvalues, lpercent) for lpercent in [50, 95, 99, 100]], [50, 95, 99, 100])
+        self.assertEqual(SleepyStats.Percentile([7], 99), 7)
@@ -0,0 +1,54 @@
+'''
+?fields= projection, compact json and gzip, see Sleepy.GetFieldsTemplate and Sleepy.CompressResponse
+'''
+import gzip
+import json
+import StringIO
+import testutil
+from restapi import Sleepy
+
+class WireTest(testutil.SleepyTestCase):
+    def testFieldsNarrowTheResponse(self):
+        lmilk = self.Create("milk", done = True)
+        self.assertEqual(self.CallJson("GET", "/todos?fields=text"), [{"id": lmilk["id"], "text": "milk"}])
+        self.assertEqual(self.CallJson("GET", "/todos/%s?fields=done" % lmilk["id"]), {"id": lmilk["id"], "done": True})
+
+    def testProjectedFields(self):
+        # text and done have a composite index (see ToDoRestHandler.GetProjections), so this is a projection query
+        lmilk = self.Create("milk", done = True)
+        self.Create("bread")
+        # in the index's order
+        self.assertEqual(sorted(self.CallJson("GET", "/todos?fields=text,done")),
+                         sorted([{"id": lmilk["id"], "text": "milk", "done": True}, {"id": lmilk["id"] + 1, "text": "bread", "done": False}]))
+        self.assertEqual(self.CallJson("GET", "/todos?fields=text,done&done=true"), [{"id": lmilk["id"], "text": "milk", "done": True}])
+
+    def testBadFieldsAreRefused(self):
+        for lfields in ["nope", "id", "search_terms"]:
+            self.assertEqual(self.Call("GET", "/todos?fields=%s" % lfields).status_int, 400, lfields)
+
+    def testCompactUnlessPretty(self):
+        self.Create("milk")
+        self.assertFalse(" " in self.Call("GET", "/todos?fields=done").body)
+        lpretty = self.Call("GET", "/todos?fields=done&pretty=1").body
+        self.assertTrue("\n" in lpretty)
+        self.assertEqual(json.loads(lpretty), self.CallJson("GET", "/todos?fields=done"))
+
+    def testGzip(self):
+        for lindex in range(Sleepy.MINGZIPSIZE / 50):
+            self.Create("todo %s" % lindex)
+        lplain = self.Call("GET", "/todos")
+        self.assertFalse("Content-Encoding" in lplain.headers)
+
+        lzipped = self.Call("GET", "/todos", aHeaders = {"Accept-Encoding": "gzip"})
+        self.assertEqual(lzipped.headers["Content-Encoding"], "gzip")
+        self.assertEqual(lzipped.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(gzip.GzipFile(fileobj = StringIO.StringIO(lzipped.body)).read(), lplain.body)
+        # same meaning, different bytes
+        self.assertEqual(lzipped.headers["ETag"], "W/%s" % lplain.headers["ETag"])
+        self.assertEqual(self.Call("GET", "/todos", aHeaders = {"If-None-Match": lzipped.headers["ETag"]}).status_int, 304)
+
+    def testSmallResponsesAreNotZipped(self):
+        self.Create("milk")
+        lresponse = self.Call("GET", "/todos", aHeaders = {"Accept-Encoding": "gzip"})
+        self.assertFalse("Content-Encoding" in lresponse.headers)
+        self.assertEqual(lresponse.headers["Vary"], "Accept-Encoding")
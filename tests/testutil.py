@@ -0,0 +1,149 @@
+'''
+Shared setup for the tests in this directory.
+
+The tests run in-process against the App Engine SDK's testbed stubs, as the benchmarks do, so they need the
+python 2.7 SDK. Point APPENGINE_SDK at it if it isn't in /usr/local/google_appengine.
+
+usage: python -m unittest discover -s tests
+'''
+import json
+import os
+import sys
+import unittest
+
+SDKPATH = os.environ.get("APPENGINE_SDK", "/usr/local/google_appengine")
+SRCPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+def FixSysPath():
+    """
+    Makes the SDK, its bundled libraries, and the app source importable.
+    """
+    if SDKPATH not in sys.path:
+        sys.path.insert(0, SDKPATH)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    if SRCPATH not in sys.path:
+        sys.path.insert(0, SRCPATH)
+
+# the app runs on python27, where webapp is webapp2
+os.environ.setdefault("APPENGINE_RUNTIME", "python27")
+FixSysPath()
+
+from google.appengine.api import users
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+import webapp2
+import webob
+
+from restapi import Sleepy, ToDoRestHandler
+
+class DbToDo(db.Model):
+    """
+    ToDo as a db model, for testing Sleepy's db paths
+    """
+    text = db.StringProperty()
+    order = db.IntegerProperty()
+    rank = db.StringProperty()
+    done = db.BooleanProperty(default = False)
+    created = db.DateTimeProperty(auto_now_add = True)
+    modified = db.DateTimeProperty(auto_now = True)
+    search_terms = db.StringListProperty()
+
+class DbToDoRestHandler(ToDoRestHandler):
+    def GetModelClass(self):
+        return DbToDo
+
+    def GetOwnerKey(self, *args, **kwargs):
+        # db models need db parents
+        return db.Key.from_path("ToDoOwner", users.get_current_user().user_id())
+
+class SleepyTestCase(unittest.TestCase):
+    """
+    Serves restHandlerClass at /todos, over the testbed's datastore, memcache, user and task queue stubs,
+    with user "1" signed in.
+    """
+    restHandlerClass = ToDoRestHandler
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        # make the stub strongly consistent, so reads straight after writes see them
+        lpolicy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability = 1)
+        self.testbed.init_datastore_v3_stub(consistency_policy = lpolicy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_user_stub()
+        self.testbed.init_taskqueue_stub(root_path = SRCPATH)
+        self.SignIn("1")
+        ndb.get_context().clear_cache()
+
+        self.app = webapp2.WSGIApplication(Sleepy.FixRoutes([("todos", self.restHandlerClass)]))
+        self.app.allowed_methods = webapp2.WSGIApplication.allowed_methods.union(["PATCH"])
+
+        # class attributes tests change, put back afterwards
+        self._sleepyAttributes = dict(vars(Sleepy))
+
+    def tearDown(self):
+        for lname, lvalue in self._sleepyAttributes.items():
+            if vars(Sleepy).get(lname) is not lvalue:
+                setattr(Sleepy, lname, lvalue)
+        self.testbed.deactivate()
+
+    def SignIn(self, aUserId):
+        """
+        Makes later calls as the user aUserId, or signed out if it's None
+        """
+        if aUserId is None:
+            self.testbed.setup_env(USER_EMAIL = "", USER_ID = "", USER_IS_ADMIN = "0", overwrite = True)
+        else:
+            self.testbed.setup_env(USER_EMAIL = "%s@example.com" % aUserId, USER_ID = aUserId, USER_IS_ADMIN = "0", overwrite = True)
+
+    def OwnerKey(self, aUserId = "1"):
+        return ndb.Key("ToDoOwner", aUserId)
+
+    def Call(self, aMethod, aPath, aBody = None, aHeaders = None):
+        """
+        Makes a request to the app, returns the response. aBody is sent as json, unless it's a string.
+        """
+        # don't let ndb's in-context cache carry over between calls, as it wouldn't between requests
+        ndb.get_context().clear_cache()
+        lrequest = webapp2.Request.blank(aPath)
+        lrequest.method = aMethod
+        if aBody is not None:
+            lrequest.body = aBody if isinstance(aBody, str) else json.dumps(aBody)
+        for lname, lvalue in (aHeaders or {}).items():
+            lrequest.headers[lname] = lvalue
+        # webapp2's own responses start with Cache-Control: no-cache, which would hide the app's
+        lrequest.ResponseClass = webob.Response
+        return lrequest.get_response(self.app)
+
+    def CallJson(self, aMethod, aPath, aBody = None, aHeaders = None, aStatus = 200):
+        """
+        As Call, checking the response status is aStatus, and returns the response's json
+        """
+        lresponse = self.Call(aMethod, aPath, aBody, aHeaders)
+        self.assertEqual(lresponse.status_int, aStatus, "%s %s: %s %s" % (aMethod, aPath, lresponse.status, lresponse.body))
+        return json.loads(lresponse.body)
+
+    def Create(self, aText, **kwargs):
+        """
+        POSTs a ToDo, returns it
+        """
+        ljsonable = dict(kwargs, text = aText)
+        return self.CallJson("POST", "/todos", ljsonable)
+
+    def RunTasks(self):
+        """
+        Runs queued deferred tasks, and any they queue, until there are none left
+        """
+        ltaskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        while True:
+            ltasks = ltaskqueue.get_filtered_tasks()
+            if not ltasks:
+                return
+            for lqueue in ltaskqueue.GetQueues():
+                ltaskqueue.FlushQueue(lqueue["name"])
+            for ltask in ltasks:
+                deferred.run(ltask.payload)
@@ -0,0 +1,159 @@
+'''
+Builds the page's static assets for deployment.
+
+src/htmlui/todos.html loads its scripts and stylesheet as separate, unminified files from todos_files. This
+concatenates the scripts (in page order) into one minified bundle, and the stylesheets into another, each named
+by a hash of its content and written to src/htmlui/static. It writes src/htmlui/todos.built.html: the page with
+the scripts and stylesheets replaced by the bundles. So a cold load is the page plus two files, and app.yaml lets
+browsers cache the bundles forever, as their names change whenever they do. htmlui.ToDoHandler serves the
+built page if there is one.
+
+Minifying uses rjsmin and rcssmin if they're installed. Otherwise it falls back to something conservative, which
+saves little: it only drops comments, indentation and blank lines, keeping line breaks so semicolon insertion
+still works. Install them (pip install rjsmin rcssmin) for real minification.
+
+Its output isn't checked in, so run it before every deploy; tools/deploy.sh does both.
+
+usage: python tools/buildassets.py
+'''
+import hashlib
+import os
+import re
+
+HTMLUIPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "htmlui")
+SOURCEPAGE = "todos.html"
+BUILTPAGE = "todos.built.html"
+STATICDIR = "static"
+
+# where the page's relative asset references live, and the url app.yaml serves them from
+ASSETSPREFIX = "./todos_files/"
+ASSETSURL = "/todos_files/"
+STATICURL = "/static/"
+
+SCRIPTPATTERN = re.compile(r'[ \t]*<script src="%s([^"]+\.js)"></script>\n?' % re.escape(ASSETSPREFIX))
+STYLEPATTERN = re.compile(r'[ \t]*<link href="%s([^"]+\.css)"[^>]*>\n?' % re.escape(ASSETSPREFIX))
+CSSURLPATTERN = re.compile(r'url\((?![\'"]?(?:/|data:|https?:))[\'"]?([^\'")]+)[\'"]?\)')
+
+def MinifyJs(aSource):
+    try:
+        import rjsmin
+        return rjsmin.jsmin(aSource)
+    except ImportError:
+        pass
+
+    llines = []
+    lincomment = False
+    for lline in aSource.splitlines():
+        lline = lline.strip()
+        if lincomment:
+            lend = lline.find("*/")
+            if lend < 0:
+                continue
+            lincomment = False
+            lline = lline[lend + 2:].strip()
+        elif lline.startswith("/*") and not lline.startswith("/*!"):
+            lend = lline.find("*/", 2)
+            if lend < 0:
+                lincomment = True
+                continue
+            lline = lline[lend + 2:].strip()
+        if lline and not lline.startswith("//"):
+            llines.append(lline)
+    return "\n".join(llines)
+
+def MinifyCss(aSource):
+    try:
+        import rcssmin
+        return rcssmin.cssmin(aSource)
+    except ImportError:
+        pass
+
+    retval = re.sub(r"/\*.*?\*/", "", aSource, flags = re.DOTALL)
+    retval = re.sub(r"\s+", " ", retval)
+    retval = re.sub(r"\s*([{};])\s*", r"\1", retval)
+    return retval.strip()
+
+def ReadAsset(aHtmlUiPath, aName):
+    with open(os.path.join(aHtmlUiPath, ASSETSPREFIX, aName)) as lfile:
+        return lfile.read()
+
+def ReadStyle(aHtmlUiPath, aName):
+    """
+    A stylesheet, with the urls in it made absolute. They were relative to the stylesheet, and the bundle is
+    served from somewhere else.
+    """
+    return CSSURLPATTERN.sub(lambda lurl: "url(%s%s)" % (ASSETSURL, lurl.group(1)), ReadAsset(aHtmlUiPath, aName))
+
+def WriteBundle(aHtmlUiPath, aContent, aExtension):
+    """
+    Writes a bundle to the static directory as todos.<hash of aContent>.<aExtension>, replacing any older
+    bundles of that type. Returns its name.
+    """
+    lname = "todos.%s.%s" % (hashlib.md5(aContent).hexdigest()[:12], aExtension)
+
+    lstaticPath = os.path.join(aHtmlUiPath, STATICDIR)
+    if not os.path.isdir(lstaticPath):
+        os.makedirs(lstaticPath)
+    for loldName in os.listdir(lstaticPath):
+        if loldName.startswith("todos.") and loldName.endswith("." + aExtension) and loldName != lname:
+            os.remove(os.path.join(lstaticPath, loldName))
+    with open(os.path.join(lstaticPath, lname), "w") as lfile:
+        lfile.write(aContent)
+    return lname
+
+def ReplaceAll(aPattern, aPage, aReplacement):
+    """
+    Replaces the first match of aPattern in aPage with aReplacement, and removes the others
+    """
+    lfirst = [True]
+    def lreplace(aMatch):
+        if lfirst[0]:
+            lfirst[0] = False
+            return aReplacement
+        return ""
+    return aPattern.sub(lreplace, aPage)
+
+def Build(aHtmlUiPath = HTMLUIPATH):
+    """
+    Builds the bundles and the page. Returns a list of (bundle name, source size, minified size).
+    """
+    with open(os.path.join(aHtmlUiPath, SOURCEPAGE)) as lfile:
+        lpage = lfile.read()
+
+    lscripts = SCRIPTPATTERN.findall(lpage)
+    lstyles = STYLEPATTERN.findall(lpage)
+    if not lscripts:
+        raise Exception("no scripts found in %s" % SOURCEPAGE)
+
+    retval = []
+    # a file missing its final semicolon mustn't run into the next
+    lsource = ";\n".join(ReadAsset(aHtmlUiPath, lname) for lname in lscripts)
+    lbundle = MinifyJs(lsource)
+    lname = WriteBundle(aHtmlUiPath, lbundle, "js")
+    retval.append((lname, len(lsource), len(lbundle)))
+    # the bundle goes where the first script was
+    lpage = ReplaceAll(SCRIPTPATTERN, lpage, '    <script src="%s%s"></script>\n' % (STATICURL, lname))
+
+    if lstyles:
+        lsource = "\n".join(ReadStyle(aHtmlUiPath, lname) for lname in lstyles)
+        lbundle = MinifyCss(lsource)
+        lname = WriteBundle(aHtmlUiPath, lbundle, "css")
+        retval.append((lname, len(lsource), len(lbundle)))
+        lpage = ReplaceAll(STYLEPATTERN, lpage, '    <link href="%s%s" media="all" rel="stylesheet" type="text/css">\n' % (STATICURL, lname))
+
+    with open(os.path.join(aHtmlUiPath, BUILTPAGE), "w") as lfile:
+        lfile.write(lpage)
+    return retval
+
+def main():
+    try:
+        import rjsmin
+        import rcssmin
+    except ImportError:
+        print "rjsmin or rcssmin isn't installed, so the bundles are only lightly minified"
+    for lname, lsourceSize, lsize in Build():
+        print "%s%s: %s bytes, from %s" % (STATICURL, lname, lsize, lsourceSize)
+    print "wrote %s" % BUILTPAGE
+
+if __name__ == "__main__":
+    main()
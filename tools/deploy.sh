@@ -0,0 +1,7 @@
+#!/bin/sh
+# Builds the page's assets (see buildassets.py), which aren't checked in, then deploys the app.
+# Any arguments are passed on to appcfg.py, eg: tools/deploy.sh --oauth2
+set -e
+cd "$(dirname "$0")/.."
+python tools/buildassets.py
+appcfg.py update src "$@"
@@ -0,0 +1,39 @@
+'''
+Prints the index.yaml entries needed by the filters and orderings Sleepy accepts on each REST resource.
+
+See Sleepy.GetFiltersAndOrders and Sleepy.GetIndexes. Paste the output into src/index.yaml.
+
+Needs the python 2.7 App Engine SDK; point APPENGINE_SDK at it if it isn't in /usr/local/google_appengine.
+
+usage: python tools/genindexes.py
+'''
+import os
+import sys
+
+SDKPATH = os.environ.get("APPENGINE_SDK", "/usr/local/google_appengine")
+SRCPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+def FixSysPath():
+    sys.path.insert(0, SDKPATH)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, SRCPATH)
+
+def main():
+    FixSysPath()
+    import restapi
+    from restapi import Sleepy
+
+    lseen = set()
+    for lroute in restapi.restRoutes:
+        lhandlerClass = lroute[1]
+        if lhandlerClass in lseen or not hasattr(lhandlerClass, "GetModelClass"):
+            continue
+        lseen.add(lhandlerClass)
+        lindexes = Sleepy.GetIndexes(lhandlerClass())
+        if lindexes:
+            print "# filters and order_by for %s, generated by tools/genindexes.py" % lhandlerClass.__name__
+            print Sleepy.IndexesToYaml(lindexes)
+
+if __name__ == "__main__":
+    main()